@@ -0,0 +1,330 @@
+"""
+Scaling benchmarks for idaenv.
+
+Builds synthetic site-packages directories with N distributions, a mix of
+dist-info and egg-info entries of which a fraction provide IDA modules, and
+times the main operations on each metadata backend:
+
+    $ python benchmarks/bench_scaling.py --sizes 10,100,1000 --output bench.json
+
+Results are written as JSON.  Given a previous result file, the run fails if
+any timing regressed by more than the allowed ratio:
+
+    $ python benchmarks/bench_scaling.py --baseline bench.json --max-ratio 1.5
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idaenv import command_line, entrypoints  # noqa: E402
+from idaenv.manager import MODULE_TYPES, PluginManager  # noqa: E402
+
+
+DIST_INFO = """\
+Metadata-Version: 2.1
+Name: %(name)s
+Version: 1.0
+Summary: Synthetic distribution %(index)d
+"""
+
+EGG_INFO = """\
+Metadata-Version: 1.1
+Name: %(name)s
+Version: 1.0
+Summary: Synthetic distribution %(index)d
+"""
+
+
+def build_site(site_dir, size, module_fraction):
+    """
+    Create `size` distributions in site_dir.  Every other one is an egg-info
+    directory; one in every 1/module_fraction provides a plugin, loader and
+    proc.  Returns the number of distributions providing IDA modules.
+    """
+    step = max(1, int(round(1 / module_fraction))) if module_fraction else 0
+    providers = 0
+    for i in range(size):
+        name = "synthetic-dist-%05d" % i
+        if i % 2:
+            meta_dir = os.path.join(site_dir, "synthetic_dist_%05d.egg-info" % i)
+            metadata_name, template = "PKG-INFO", EGG_INFO
+        else:
+            meta_dir = os.path.join(site_dir, "synthetic_dist_%05d-1.0.dist-info" % i)
+            metadata_name, template = "METADATA", DIST_INFO
+        os.mkdir(meta_dir)
+        with open(os.path.join(meta_dir, metadata_name), "w") as f:
+            f.write(template % {"name": name, "index": i})
+
+        entry_points = ["[console_scripts]", "tool%d = synthetic%d:main" % (i, i)]
+        if step and i % step == 0:
+            providers += 1
+            entry_points += [
+                "[idapython_plugins]",
+                "plugin = synthetic%d.plugin:Plugin" % i,
+                "[idapython_loaders]",
+                "loader = synthetic%d.loader" % i,
+                "[idapython_procs]",
+                "proc = synthetic%d.proc" % i,
+            ]
+        with open(os.path.join(meta_dir, "entry_points.txt"), "w") as f:
+            f.write("\n".join(entry_points) + "\n")
+    return providers
+
+
+@contextlib.contextmanager
+def isolated_path(site_dir):
+    "Make site_dir the only site directory on sys.path."
+    saved = sys.path[:]
+    sys.path[:] = [site_dir] + [
+        p for p in saved if p and "site-packages" not in p and "dist-packages" not in p
+    ]
+    entrypoints.refresh_entrypoint_caches()
+    try:
+        yield
+    finally:
+        sys.path[:] = saved
+        entrypoints.refresh_entrypoint_caches()
+
+
+@contextlib.contextmanager
+def quiet():
+    saved = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def new_manager(user_dir, use_cache=True):
+    return PluginManager(user_dir, use_cache=use_cache, compile=False)
+
+
+def run_case(site_dir, backend, wrapper_fraction):
+    "Time each phase once for a synthetic site and return {phase: seconds}."
+    timings = {}
+    user_dir = tempfile.mkdtemp(prefix="idaenv-bench-")
+    try:
+        entrypoints.set_backend(backend)
+        with quiet():
+            # Pre-populate a fraction of the wrappers.
+            mgr = new_manager(user_dir, use_cache=False)
+            timings["scan_cold"], _ = timed(mgr.entry_point_index)
+            for module_type in sorted(MODULE_TYPES):
+                eps = sorted(mgr.find_installed_modules(module_type))
+                count = int(len(eps) * wrapper_fraction)
+                mgr.execute_update(module_type, {"create": eps[:count], "delete": []})
+
+            mgr = new_manager(user_dir)
+            timings["scan_warm"], _ = timed(mgr.entry_point_index)
+
+            timings["plan_update"], plans = timed(
+                lambda: dict((t, mgr.plan_update(t)) for t in sorted(MODULE_TYPES))
+            )
+            timings["execute_update"], _ = timed(
+                lambda: [mgr.execute_update(t, plans[t]) for t in sorted(plans)]
+            )
+
+            wrappers = mgr.load_wrappers("plugins")
+            last = wrappers[-1][0] if wrappers else None
+            name = "%s.%s" % (last.dist, last.name) if last else "missing.plugin"
+            mgr = new_manager(user_dir)
+            timings["find_module_wrapper"], _ = timed(
+                lambda: mgr.find_module_wrapper("plugins", name)
+            )
+
+            mgr = new_manager(user_dir)
+            timings["cmd_status"], _ = timed(lambda: command_line.cmd_status(mgr, None))
+    finally:
+        entrypoints.set_backend(None)
+        shutil.rmtree(user_dir)
+    return timings
+
+
+def available_backends():
+    "Return the metadata backends whose library can be imported."
+    backends = []
+    for backend in entrypoints.BACKENDS:
+        try:
+            entrypoints.set_backend(backend)
+        except (ImportError, ValueError):
+            # e.g. pkg_resources on Python 3.12+ without setuptools
+            continue
+        backends.append(backend)
+    entrypoints.set_backend(None)
+    return backends
+
+
+def run_benchmarks(sizes, backends, wrapper_fractions, module_fraction, repeat):
+    # Import the metadata libraries while site-packages is still on the path.
+    for backend in backends:
+        entrypoints.set_backend(backend)
+    entrypoints.set_backend(None)
+
+    results = []
+    for size in sizes:
+        site_dir = tempfile.mkdtemp(prefix="idaenv-bench-site-")
+        try:
+            providers = build_site(site_dir, size, module_fraction)
+            with isolated_path(site_dir):
+                for backend in backends:
+                    for fraction in wrapper_fractions:
+                        best = {}
+                        for _ in range(repeat):
+                            for phase, seconds in run_case(
+                                site_dir, backend, fraction
+                            ).items():
+                                best[phase] = min(seconds, best.get(phase, seconds))
+                        for phase in sorted(best):
+                            results.append(
+                                {
+                                    "backend": backend,
+                                    "distributions": size,
+                                    "module_distributions": providers,
+                                    "wrapper_fraction": fraction,
+                                    "phase": phase,
+                                    "seconds": best[phase],
+                                }
+                            )
+                            print(
+                                "%-14s %6d dists  %3d%% wrappers  %-20s %9.2f ms"
+                                % (
+                                    backend,
+                                    size,
+                                    fraction * 100,
+                                    phase,
+                                    best[phase] * 1000,
+                                ),
+                                file=sys.stderr,
+                            )
+        finally:
+            shutil.rmtree(site_dir)
+    return results
+
+
+def result_key(result):
+    return (
+        result["backend"],
+        result["distributions"],
+        result["wrapper_fraction"],
+        result["phase"],
+    )
+
+
+def find_regressions(results, baseline, max_ratio, min_seconds=0.001):
+    """
+    Return (result, baseline seconds) pairs for timings more than max_ratio
+    times slower than the baseline.  Timings under min_seconds are ignored as
+    noise.
+    """
+    previous = dict((result_key(r), r["seconds"]) for r in baseline["results"])
+    regressions = []
+    for r in results:
+        base = previous.get(result_key(r))
+        if base is None or max(base, r["seconds"]) < min_seconds:
+            continue
+        if r["seconds"] > base * max_ratio:
+            regressions.append((r, base))
+    return regressions
+
+
+def parse_list(convert):
+    return lambda s: [convert(v) for v in s.split(",") if v]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument(
+        "--sizes",
+        type=parse_list(int),
+        default=[10, 100, 1000, 10000],
+        help="Comma-separated numbers of distributions.",
+    )
+    ap.add_argument(
+        "--backends",
+        type=parse_list(str),
+        help="Comma-separated metadata backends (default: those available).",
+    )
+    ap.add_argument(
+        "--wrapper-fractions",
+        type=parse_list(float),
+        default=[0.0, 0.5, 1.0],
+        help="Fractions of wrappers that already exist before the update.",
+    )
+    ap.add_argument(
+        "--module-fraction",
+        type=float,
+        default=0.1,
+        help="Fraction of distributions that provide IDA modules.",
+    )
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per case; best kept.")
+    ap.add_argument("--output", help="Write JSON results to this file.")
+    ap.add_argument("--baseline", help="JSON results to compare against.")
+    ap.add_argument(
+        "--max-ratio",
+        type=float,
+        default=1.5,
+        help="Slowdown relative to the baseline that counts as a regression.",
+    )
+    opts = ap.parse_args(argv)
+
+    results = run_benchmarks(
+        opts.sizes,
+        opts.backends or available_backends(),
+        opts.wrapper_fractions,
+        opts.module_fraction,
+        opts.repeat,
+    )
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    data = json.dumps(report, indent=1, sort_keys=True)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, opts.max_ratio)
+        for r, base in regressions:
+            print(
+                "Regression: %s %d dists %d%% wrappers %s: %.2f ms -> %.2f ms"
+                % (
+                    r["backend"],
+                    r["distributions"],
+                    r["wrapper_fraction"] * 100,
+                    r["phase"],
+                    base * 1000,
+                    r["seconds"] * 1000,
+                ),
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
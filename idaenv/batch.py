@@ -0,0 +1,323 @@
+"""
+Run headless IDA over many input files.
+
+The IDA executable and the environment are resolved once, then each input is
+analyzed by its own IDA process (`idat64 -A -S script input`), several at a
+time.  Jobs that fail or time out are retried.
+
+Progress is kept in a state directory:
+
+    results.jsonl    one line per finished job, appended as jobs finish
+    manifest.json    the results of every job, written at the end
+    logs/            the IDA log (<job>.log) and output (<job>.out) per job
+
+A run with the same state directory skips the jobs that already finished, so
+an interrupted batch can be resumed.  Retries, and reruns of failed jobs,
+pass -c so that IDA rebuilds any database a failed attempt left behind.
+"""
+from __future__ import print_function
+
+import os
+import json
+import time
+import hashlib
+import threading
+import subprocess
+
+from .utils import FileLock, atomic_write, communicate, get_platform
+
+
+RESULTS_NAME = "results.jsonl"
+MANIFEST_NAME = "manifest.json"
+LOGS_NAME = "logs"
+
+
+def find_ida(ida=None, name="idat64"):
+    """
+    Return the path of the IDA executable: `ida` if given, otherwise `name`
+    in $IDAHOME.
+    """
+    if ida is not None:
+        candidates = [ida]
+    else:
+        idahome = os.environ.get("IDAHOME")
+        if not idahome:
+            raise ValueError("IDAHOME is not set; pass the IDA executable.")
+        candidates = [os.path.join(idahome, name)]
+        if get_platform() == "win":
+            candidates = [candidates[0] + ".exe"] + candidates
+    for path in candidates:
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return os.path.abspath(path)
+    raise ValueError("IDA executable not found: %s" % candidates[-1])
+
+
+def expand_inputs(paths):
+    "Return the files named by paths, including those in directories, sorted."
+    inputs = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                inputs.update(os.path.join(dirpath, name) for name in filenames)
+        elif os.path.isfile(path):
+            inputs.add(path)
+        else:
+            raise ValueError("No such file or directory: %s" % path)
+    return sorted(os.path.abspath(path) for path in inputs)
+
+
+def job_id(input_path):
+    "Return a stable, file name safe identifier for the job of an input."
+    digest = hashlib.sha1(input_path.encode("utf8")).hexdigest()[:12]
+    name = "".join(
+        c if c.isalnum() or c in "-_." else "_" for c in os.path.basename(input_path)
+    )
+    return "%s-%s" % (name[:64], digest)
+
+
+def quote_arg(arg):
+    "Quote an argument of an IDA -S option."
+    if arg and not any(c in arg for c in ' \t"'):
+        return arg
+    return '"%s"' % arg.replace('"', '\\"')
+
+
+def ida_command(
+    ida_bin, script, input_path, log_path, script_args=(), ida_args=(), database=None
+):
+    "Return the command line analyzing an input with a script."
+    command = [ida_bin, "-A"]
+    command.append("-S" + " ".join(quote_arg(a) for a in [script] + list(script_args)))
+    command.append("-L" + log_path)
+    if database is not None:
+        command.append("-o" + database)
+    return command + list(ida_args) + [input_path]
+
+
+class ProcessGroup(object):
+    """
+    The IDA processes of a batch.  Once the group is stopped, its running
+    processes are killed and no new ones are started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = set()
+        self.stopped = False
+
+    def start(self, command, **kwargs):
+        "Start a process, or raise OSError if the group was stopped."
+        with self.lock:
+            if self.stopped:
+                raise OSError("Batch stopped")
+            proc = subprocess.Popen(command, **kwargs)
+            self.processes.add(proc)
+            return proc
+
+    def finished(self, proc):
+        with self.lock:
+            self.processes.discard(proc)
+
+    def stop(self):
+        "Kill the running processes and wait for them to exit."
+        with self.lock:
+            self.stopped = True
+            processes = list(self.processes)
+        for proc in processes:
+            try:
+                proc.kill()
+            except OSError:
+                # Exited in the meantime
+                pass
+            proc.wait()
+
+
+def run_ida(command, environ, output_path, timeout=None, group=None):
+    """
+    Run IDA once, appending its output to output_path.  Returns the status
+    ("ok", "failed" or "timeout") and the exit status.
+    """
+    if group is None:
+        group = ProcessGroup()
+    with open(output_path, "ab") as out, open(os.devnull, "rb") as devnull:
+        try:
+            proc = group.start(
+                command,
+                stdin=devnull,
+                stdout=out,
+                stderr=subprocess.STDOUT,
+                env=environ,
+            )
+        except OSError as e:
+            out.write(("idaenv: %s\n" % e).encode("utf8"))
+            return "failed", None
+        try:
+            if communicate(proc, timeout) is None:
+                return "timeout", None
+        finally:
+            group.finished(proc)
+    return ("ok" if proc.returncode == 0 else "failed"), proc.returncode
+
+
+def rebuild_command(command):
+    "Return an IDA command line that discards the existing database."
+    return command[:1] + ["-c"] + command[1:]
+
+
+def run_job(job, environ, timeout=None, retries=0, group=None, rebuild=False):
+    """
+    Run a job, retrying if it fails or times out.  Returns the job with its
+    "status", "returncode", "attempts" and "seconds" filled in.  Retries, and
+    the first attempt if `rebuild` is set, start from a new database.
+    """
+    result = dict(job)
+    start = time.time()
+    for attempt in range(1, retries + 2):
+        command = job["command"]
+        if rebuild or attempt > 1:
+            command = rebuild_command(command)
+        status, returncode = run_ida(command, environ, job["output"], timeout, group)
+        if status == "ok" or (group is not None and group.stopped):
+            break
+    result.update(
+        status=status,
+        returncode=returncode,
+        attempts=attempt,
+        seconds=time.time() - start,
+        finished=time.time(),
+    )
+    return result
+
+
+def load_results(state_dir):
+    "Return the latest result of each job recorded in the state directory."
+    results = {}
+    try:
+        f = open(os.path.join(state_dir, RESULTS_NAME), "r")
+    except (IOError, OSError):
+        return results
+    with f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Cut short by an interruption
+                continue
+            results[result["id"]] = result
+    return results
+
+
+def make_jobs(
+    inputs, ida_bin, script, state_dir, script_args=(), ida_args=(), db_dir=None
+):
+    jobs = []
+    # IDA runs in the directory of its input, so -L needs an absolute path.
+    logs_dir = os.path.join(os.path.abspath(state_dir), LOGS_NAME)
+    for input_path in inputs:
+        name = job_id(input_path)
+        log_path = os.path.join(logs_dir, name + ".log")
+        database = None if db_dir is None else os.path.join(db_dir, name)
+        jobs.append(
+            {
+                "id": name,
+                "input": input_path,
+                "log": log_path,
+                "output": os.path.join(logs_dir, name + ".out"),
+                "database": database,
+                "command": ida_command(
+                    ida_bin,
+                    script,
+                    input_path,
+                    log_path,
+                    script_args,
+                    ida_args,
+                    database,
+                ),
+            }
+        )
+    return jobs
+
+
+def run_batch(
+    jobs,
+    environ,
+    state_dir,
+    concurrency=None,
+    timeout=None,
+    retries=0,
+    rerun_failed=False,
+    progress=None,
+):
+    """
+    Run jobs concurrently, skipping those that finished in an earlier run
+    with the same state directory (unless they failed and `rerun_failed` is
+    set).  `progress` is called with each new result.  Returns the results of
+    all jobs, in the order of `jobs`, and writes the manifest.
+
+    If the batch is interrupted, the running IDA processes are killed before
+    the state directory is unlocked, so a resumed run never analyzes an input
+    twice at the same time.
+    """
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+
+    if not os.path.isdir(os.path.join(state_dir, LOGS_NAME)):
+        os.makedirs(os.path.join(state_dir, LOGS_NAME))
+
+    with FileLock(os.path.join(state_dir, "batch.lock")):
+        results = load_results(state_dir)
+        pending = [
+            job
+            for job in jobs
+            if job["id"] not in results
+            or (rerun_failed and results[job["id"]]["status"] != "ok")
+        ]
+
+        group = ProcessGroup()
+        # Failed earlier, possibly leaving a half-written database
+        rerun = set(job["id"] for job in pending if job["id"] in results)
+
+        def run(job):
+            return run_job(job, environ, timeout, retries, group, job["id"] in rerun)
+
+        try:
+            if pending:
+                pool = ThreadPool(
+                    min(len(pending), concurrency or multiprocessing.cpu_count())
+                )
+                try:
+                    with open(os.path.join(state_dir, RESULTS_NAME), "a") as f:
+                        for result in pool.imap_unordered(run, pending):
+                            f.write(json.dumps(result, sort_keys=True) + "\n")
+                            f.flush()
+                            results[result["id"]] = result
+                            if progress is not None:
+                                progress(result)
+                finally:
+                    group.stop()
+                    pool.terminate()
+        finally:
+            write_manifest(state_dir, jobs, results)
+
+    return [results[job["id"]] for job in jobs if job["id"] in results]
+
+
+def write_manifest(state_dir, jobs, results):
+    "Write the results of all jobs; those that haven't run are pending."
+    entries = [results.get(job["id"], dict(job, status="pending")) for job in jobs]
+    manifest = {"jobs": entries, "counts": count_statuses(entries)}
+    atomic_write(
+        os.path.join(state_dir, MANIFEST_NAME),
+        json.dumps(manifest, indent=1, sort_keys=True).encode("utf8"),
+    )
+
+
+def count_statuses(results):
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return counts
+
+
+def failed(results):
+    return [r for r in results if r["status"] in ("failed", "timeout")]
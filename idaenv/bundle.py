@@ -0,0 +1,253 @@
+"""
+Pack the active wrappers and the packages they import into a bundle that IDA
+loads without a virtualenv.
+
+The output directory is used as an IDAUSR directory:
+
+    plugins/ loaders/ procs/   the wrappers, and a bootstrap plugin adding
+                               the bundle to sys.path
+    packages.zip               pure Python packages with bytecode, imported
+                               through zipimport (packages/ with --format dir)
+    native/                    packages with native code, which zipimport
+                               can't load
+    bundle.json                description of the contents
+
+Loaders and processor modules can be loaded before any plugin, so their
+wrappers add the bundle to sys.path too.
+
+Packages are found by following the imports of the wrappers with
+modulefinder, and are bundled whole, including their data files.  Only
+packages on the site paths (see utils.site_paths) are bundled; IDA provides
+the standard library.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+
+from . import compiling
+from . import manager
+from .utils import site_paths
+
+
+ZIP_NAME = "packages.zip"
+DIR_NAME = "packages"
+NATIVE_NAME = "native"
+MANIFEST_NAME = "bundle.json"
+
+BUNDLE_SECTION = """
+import os
+
+# The bundle is the parent of this plugin's directory, so it can be moved.
+BUNDLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLE_PATHS = [os.path.join(BUNDLE_DIR, name) for name in %(entries)r]
+sys.path[0:0] = [path for path in BUNDLE_PATHS if path not in sys.path]
+"""
+
+# Added to the wrappers of loaders and processor modules
+BUNDLE_MODULE_SECTION = """
+# Added by `idaenv bundle`: this module may load before the bootstrap plugin.
+import os as _idaenv_os
+import sys as _idaenv_sys
+
+_idaenv_dir = _idaenv_os.path.abspath(__file__)
+_idaenv_dir = _idaenv_os.path.dirname(_idaenv_os.path.dirname(_idaenv_dir))
+for _idaenv_name in reversed(%(entries)r):
+    _idaenv_name = _idaenv_os.path.join(_idaenv_dir, _idaenv_name)
+    if _idaenv_name not in _idaenv_sys.path:
+        _idaenv_sys.path.insert(0, _idaenv_name)
+"""
+
+
+def native_suffixes():
+    "Return the suffixes of files that can't be loaded from a zip."
+    try:
+        from importlib.machinery import EXTENSION_SUFFIXES
+    except ImportError:
+        EXTENSION_SUFFIXES = []
+    return tuple(EXTENSION_SUFFIXES) + (".so", ".pyd", ".dll", ".dylib")
+
+
+def import_closure(scripts, paths):
+    """
+    Return the files of the modules imported, directly or indirectly, by
+    scripts.  Only modules on `paths` are followed.
+    """
+    from modulefinder import ModuleFinder
+
+    finder = ModuleFinder(path=list(paths))
+    for script in scripts:
+        finder.run_script(script)
+    return set(
+        m.__file__
+        for name, m in finder.modules.items()
+        if m.__file__ and name != "__main__"
+    )
+
+
+def package_roots(files, paths):
+    """
+    Map the files of imported modules to the top-level packages containing
+    them.  Returns a mapping of the package's name (a file or directory
+    name) to its path.
+    """
+    entries = [os.path.join(os.path.realpath(p), "") for p in paths]
+    roots = {}
+    for path in files:
+        path = os.path.realpath(path)
+        for entry in entries:
+            if path.startswith(entry):
+                name = path[len(entry) :].split(os.sep)[0]
+                roots.setdefault(name, os.path.join(entry, name))
+                break
+    return roots
+
+
+def iter_files(root):
+    "Yield the files of a package, leaving out bytecode."
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        for name in sorted(filenames):
+            if not name.endswith((".pyc", ".pyo")):
+                yield os.path.join(dirpath, name)
+
+
+def native_files(root):
+    suffixes = native_suffixes()
+    return [path for path in iter_files(root) if path.endswith(suffixes)]
+
+
+def write_zip(zip_path, roots):
+    """
+    Write packages to a zip file, with bytecode next to each source file.
+    Returns a list of (path, error) pairs for sources that failed to compile.
+    """
+    errors = []
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, root in sorted(roots.items()):
+            base = os.path.dirname(root)
+            for path in iter_files(root):
+                arcname = os.path.relpath(path, base).replace(os.sep, "/")
+                zf.write(path, arcname)
+                if not path.endswith(".py"):
+                    continue
+                with open(path, "rb") as f:
+                    source = f.read()
+                try:
+                    data = compiling.bytecode(source, arcname)
+                except (SyntaxError, ValueError) as e:
+                    errors.append((path, "%s: %s" % (type(e).__name__, e)))
+                    continue
+                if data is not None:
+                    # The legacy location, which zipimport looks in
+                    zf.writestr(arcname[:-3] + ".pyc", data)
+    return errors
+
+
+def copy_packages(dst_dir, roots):
+    "Copy packages to a directory and byte-compile them."
+    os.mkdir(dst_dir)
+    for name, root in sorted(roots.items()):
+        dst = os.path.join(dst_dir, name)
+        if os.path.isdir(root):
+            shutil.copytree(root, dst, ignore=shutil.ignore_patterns("__pycache__"))
+        else:
+            shutil.copy2(root, dst)
+    return compiling.compile_sources([dst_dir])
+
+
+def add_module_section(path, entries):
+    "Make a loader or processor module wrapper add the bundle to sys.path."
+    with open(path) as f:
+        lines = f.read().splitlines(True)
+    # Keep the EntryPointInfo comment first, so the wrapper is still recognized.
+    at = next(
+        (i + 1 for i, line in enumerate(lines) if line.startswith("# EntryPointInfo")),
+        0,
+    )
+    lines.insert(at, BUNDLE_MODULE_SECTION % {"entries": entries})
+    with open(path, "w") as f:
+        f.writelines(lines)
+
+
+def build_bundle(mgr, output, fmt="zip", native="extract"):
+    """
+    Build a bundle of the active wrappers in the output directory, which must
+    not exist yet.  Packages with native code are copied to native/ if
+    `native` is "extract", or left out if it is "report".  Returns the
+    description written to bundle.json.
+    """
+    if os.path.exists(output):
+        raise ValueError("Output already exists: %s" % output)
+    paths = site_paths()
+    os.makedirs(output)
+
+    wrappers = {}
+    for module_type in sorted(manager.MODULE_TYPES):
+        dst_dir = os.path.join(output, module_type)
+        os.mkdir(dst_dir)
+        found = mgr.find_wrappers(mgr.wrapper_dir(module_type))
+        for ep, path in sorted(found):
+            shutil.copy2(path, dst_dir)
+        wrappers[module_type] = sorted(
+            "%s.%s" % (ep.dist, ep.name) for ep, path in found
+        )
+    scripts = [
+        os.path.join(output, module_type, name)
+        for module_type in manager.MODULE_TYPES
+        for name in os.listdir(os.path.join(output, module_type))
+    ]
+
+    roots = package_roots(import_closure(scripts, paths), paths)
+    native_roots = dict(
+        (name, root) for name, root in roots.items() if native_files(root)
+    )
+    pure_roots = dict(
+        (name, root) for name, root in roots.items() if name not in native_roots
+    )
+
+    entries = []
+    if fmt == "zip":
+        errors = write_zip(os.path.join(output, ZIP_NAME), pure_roots)
+        entries.append(ZIP_NAME)
+    else:
+        errors = copy_packages(os.path.join(output, DIR_NAME), pure_roots)
+        entries.append(DIR_NAME)
+    if native == "extract" and native_roots:
+        errors += copy_packages(os.path.join(output, NATIVE_NAME), native_roots)
+        entries.append(NATIVE_NAME)
+
+    for module_type in ["loaders", "procs"]:
+        for name in os.listdir(os.path.join(output, module_type)):
+            add_module_section(os.path.join(output, module_type, name), entries)
+
+    sections = [BUNDLE_SECTION % {"entries": entries}]
+    modules = mgr.prewarm_modules()
+    if modules:
+        sections.append(manager.BOOTSTRAP_PREWARM_SECTION % {"modules": modules})
+    bootstrap = manager.BOOTSTRAP_TEMPLATE % {"sections": "".join(sections)}
+    with open(os.path.join(output, "plugins", manager.BOOTSTRAP_NAME), "w") as f:
+        f.write(bootstrap)
+
+    description = {
+        "python": "%d.%d" % sys.version_info[:2],
+        "format": fmt,
+        "wrappers": wrappers,
+        "packages": sorted(pure_roots),
+        "native": sorted(
+            os.path.relpath(path, os.path.dirname(root))
+            for root in native_roots.values()
+            for path in native_files(root)
+        ),
+        "native_extracted": native == "extract",
+        "compile_errors": dict(errors),
+    }
+    with open(os.path.join(output, MANIFEST_NAME), "w") as f:
+        json.dump(description, f, indent=1, sort_keys=True)
+    return description
@@ -0,0 +1,183 @@
+"""
+Persistent record of installed distributions and their entry points.
+
+Resolving entry points requires reading the metadata of every distribution on
+the path.  idaenv remembers the entry points contributed by each dist-info or
+egg-info directory along with its mtime, so later runs only re-read the
+distributions that were added or modified since.
+
+The distributions found in each sys.path directory are recorded too, with the
+directory's mtime.  Installers create and remove dist-info directories
+whole, so while a directory's mtime is unchanged its listing and dist-info
+records are reused without a stat.  egg-info directories are rewritten in
+place by `setup.py develop`, so they are always checked.
+"""
+import os
+import sys
+import json
+
+from . import entrypoints
+from . import trace
+from .utils import atomic_write
+
+
+CACHE_VERSION = 4
+
+
+def rewritten_in_place(path):
+    "Check whether a metadata directory's files may change without it."
+    return path.endswith(".egg-info")
+
+
+def metadata_mtime(path):
+    "Return the modification time of a dist-info or egg-info directory."
+    mtime = os.stat(path).st_mtime
+    if rewritten_in_place(path):
+        try:
+            # `setup.py develop` rewrites egg-info files in place.
+            entry_points_path = os.path.join(path, "entry_points.txt")
+            mtime = max(mtime, os.stat(entry_points_path).st_mtime)
+        except OSError:
+            pass
+    return mtime
+
+
+def list_distributions(path_entry, directories, new_directories):
+    """
+    Return the (key, path) pairs of the distributions in a sys.path entry and
+    whether they come from an unchanged directory record.
+    """
+    try:
+        mtime = os.stat(path_entry or ".").st_mtime
+    except OSError:
+        return [], False
+    record = directories.get(path_entry)
+    unchanged = record is not None and record["mtime"] == mtime
+    if unchanged:
+        dists = record["dists"]
+    else:
+        dists = entrypoints.find_distributions(path_entry)
+    new_directories[path_entry] = {"mtime": mtime, "dists": dists}
+    return dists, unchanged
+
+
+def scan_distributions(
+    group_names, records, paths=None, versions=None, directories=None
+):
+    """
+    Build the entry point index for the given groups, reusing the entry points
+    recorded for distributions that haven't changed.
+
+    Returns the index, the updated records and a mapping listing the "added",
+    "modified" and "removed" distribution paths.  If given, `versions` is
+    filled with the versions of the distributions providing entry points.
+    `directories` holds the recorded listings of sys.path directories, and is
+    updated in place.
+    """
+    if paths is None:
+        paths = sys.path
+    if directories is None:
+        directories = {}
+    new_directories = {}
+
+    index = dict((group_name, []) for group_name in group_names)
+    new_records = {}
+    changes = {"added": [], "modified": [], "removed": []}
+
+    # Only the first distribution of a given name on the path is visible.
+    seen = set()
+    for path_entry in paths:
+        dists, unchanged = list_distributions(path_entry, directories, new_directories)
+        if trace.enabled:
+            trace.count(dists=len(dists))
+        for key, dist_path in dists:
+            if dist_path in new_records:
+                continue
+            record = records.get(dist_path)
+            if unchanged and record is not None and not rewritten_in_place(dist_path):
+                mtime = record["mtime"]
+            else:
+                try:
+                    mtime = metadata_mtime(dist_path)
+                except OSError:
+                    continue
+
+            if record is None or record["mtime"] != mtime:
+                changes["added" if record is None else "modified"].append(dist_path)
+                eps = entrypoints.read_dist_entry_points(key, dist_path, group_names)
+                record = {
+                    "key": key,
+                    "mtime": mtime,
+                    # Only needed for distributions providing entry points
+                    "version": entrypoints.dist_version(dist_path) if eps else "",
+                    "entry_points": eps,
+                }
+            new_records[dist_path] = record
+
+            if record["key"] in seen:
+                continue
+            seen.add(record["key"])
+            if versions is not None and record["entry_points"]:
+                versions[record["key"]] = record["version"]
+            for ep in record["entry_points"]:
+                index[ep.group].append(ep)
+
+    changes["removed"] = sorted(set(records) - set(new_records))
+    directories.clear()
+    directories.update(new_directories)
+    return index, new_records, changes
+
+
+def load_dist_records(path, backend, group_names, directories=None):
+    """
+    Return the stored distribution records, or an empty mapping if they are
+    missing or were built with a different backend or set of groups.  If
+    given, `directories` is filled with the stored directory listings.
+    """
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+        data = json.loads(text)
+    except (IOError, OSError, ValueError):
+        return {}
+    if trace.enabled:
+        trace.count(files=1, read=len(text))
+
+    if (
+        not isinstance(data, dict)
+        or data.get("version") != CACHE_VERSION
+        or data.get("backend") != backend
+        or data.get("groups") != sorted(group_names)
+    ):
+        return {}
+
+    records = {}
+    for dist_path, record in data["distributions"].items():
+        records[str(dist_path)] = {
+            "key": str(record["key"]),
+            "mtime": record["mtime"],
+            "version": str(record.get("version", "")),
+            "entry_points": [
+                entrypoints.EntryPointInfo(*map(str, ep))
+                for ep in record["entry_points"]
+            ],
+        }
+    if directories is not None:
+        for path_entry, record in data["directories"].items():
+            directories[str(path_entry)] = {
+                "mtime": record["mtime"],
+                "dists": [(str(key), str(p)) for key, p in record["dists"]],
+            }
+    return records
+
+
+def save_dist_records(path, backend, group_names, records, directories=None):
+    "Store distribution records, and directory listings, for later runs."
+    data = {
+        "version": CACHE_VERSION,
+        "backend": backend,
+        "groups": sorted(group_names),
+        "distributions": records,
+        "directories": directories or {},
+    }
+    atomic_write(path, json.dumps(data, indent=1, sort_keys=True).encode("utf8"))
@@ -1,31 +1,172 @@
-from . import manager
+import os
+import sys
+import json
+import fnmatch
+
+# Only lightweight modules are imported up front; commands such as `prefix`
+# and `env` run on every IDA launch and never need the entry point machinery.
+from . import launch
+from . import trace
+from . import entrypoints
 from .cmd_utils import ArgumentParser
+from .utils import get_default_user_dir, get_virtualenv_path
+
+
+def print_stale(stale):
+    if stale["missing"] or stale["extra"]:
+        print("Warning: stored entry point records were out of date.")
+        for ep in stale["missing"]:
+            print("  + %s.%s" % (ep.dist, ep.name))
+        for ep in stale["extra"]:
+            print("  - %s.%s" % (ep.dist, ep.name))
+
+
+def plan_summary(plan):
+    "Describe the changes of a plan by entry point name."
+
+    def names(eps):
+        return sorted("%s.%s" % (ep.dist, ep.name) for ep in eps)
+
+    return {
+        "created": names(plan["create"]),
+        "deleted": names(ep for ep, _ in plan["delete"]),
+        "rewritten": names(ep for ep, _ in plan["rewrite"]),
+        "upgraded": names(ep for ep, _ in plan["upgrade"]),
+        "quarantined": names(ep for ep, _ in plan.get("quarantine", [])),
+    }
+
+
+def quarantined(changes):
+    "List the entry points quarantined by an update, from its summary."
+    return sorted(name for c in changes.values() for name in c.get("quarantined", []))
 
 
 def cmd_update(mgr, opts):
-    def print_plan(changes):
-        if changes["create"]:
-            print("  Updated:")
-            for ep in changes["create"]:
-                print("    - %s.%s" % (ep.dist, ep.name))
+    if opts.json:
+        # Keep stdout for the summary; progress messages go to stderr.
+        out = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            changes = update_plugins(mgr, opts)
+        finally:
+            sys.stdout = out
+        print(
+            json.dumps(
+                {
+                    "user_dir": mgr.user_dir,
+                    "changes": changes,
+                    "compile_errors": mgr.compile_errors,
+                },
+                sort_keys=True,
+            )
+        )
+    else:
+        changes = update_plugins(mgr, opts)
+    # Modules that failed verification fail the update, so scripts notice.
+    if opts.verify and quarantined(changes):
+        return 1
 
-        if changes["delete"]:
-            print("  Uninstalled:")
-            for ep, path in changes["delete"]:
-                print("    - %s.%s" % (ep.dist, ep.name))
 
-    changed = False
-    for mtype in ["plugins", "loaders", "procs"]:
-        plan = mgr.plan_update(mtype)
-        if plan["create"] or plan["delete"]:
-            print("%s:" % mtype.capitalize())
-            mgr.execute_update(mtype, plan)
-            print_plan(plan)
-            changed = True
+def print_plan(changes, verified=False):
+    "Print the changes made by a plan."
+    if changes["create"]:
+        print("  Updated:")
+        for ep in changes["create"]:
+            print("    - %s.%s" % (ep.dist, ep.name))
 
-    if not changed:
+    if changes["rewrite"]:
+        print("  Rewritten:")
+        for ep, path in changes["rewrite"]:
+            print("    - %s.%s" % (ep.dist, ep.name))
+
+    if changes["upgrade"]:
+        print("  Upgraded:")
+        for ep, path in changes["upgrade"]:
+            print("    - %s.%s" % (ep.dist, ep.name))
+
+    if changes["delete"]:
+        print("  Uninstalled:")
+        for ep, path in changes["delete"]:
+            print("    - %s.%s" % (ep.dist, ep.name))
+
+    if verified and changes["quarantine"]:
+        print("  Quarantined:")
+        for ep, error in changes["quarantine"]:
+            print("    - %s.%s: %s" % (ep.dist, ep.name, error))
+
+    if changes.get("bootstrap"):
+        print("  Bootstrap plugin updated")
+
+
+def update_plugins(mgr, opts):
+    "Run an update, printing progress, and return a summary of the changes."
+    # Quarantined modules are only reported when they were checked again
+    verified = getattr(opts, "verify", False)
+
+    if getattr(opts, "full_rescan", False):
+        mgr.entry_point_index()
+        print_stale(mgr.stale_entry_points)
+
+    changes = {}
+    with mgr.locked():
+        mtypes = ["plugins", "loaders", "procs"]
+        plans = dict((mtype, mgr.plan_update(mtype)) for mtype in mtypes)
+        if verified:
+            mgr.verify_plans(plans, jobs=opts.jobs, timeout=opts.timeout)
+
+        for mtype in mtypes:
+            plan = plans[mtype]
+            changed = mgr.plan_changes(plan)
+            if changed or (verified and plan["quarantine"]):
+                print("%s:" % mtype.capitalize())
+                if changed:
+                    mgr.execute_update(mtype, plan)
+                print_plan(plan, verified)
+                changes[mtype] = plan_summary(plan)
+        mgr.write_launch_env()
+
+    if not changes:
         print("No changes.")
 
+    if mgr.compile_errors:
+        print("Failed to compile:")
+        for path, error in sorted(mgr.compile_errors.items()):
+            print("  - %s: %s" % (path, error))
+    return changes
+
+
+def cmd_update_all_envs(user_dir, opts):
+    from . import environments
+
+    try:
+        env_dirs = environments.find_environments(opts.all_envs)
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        return 2
+
+    global_args = []
+    if opts.no_cache:
+        global_args.append("--no-cache")
+    if opts.backend:
+        global_args += ["--backend", opts.backend]
+    update_args = []
+    if opts.full_rescan:
+        update_args.append("--full-rescan")
+    if opts.no_compile:
+        update_args.append("--no-compile")
+    if opts.verify:
+        update_args.append("--verify")
+
+    results = environments.update_environments(
+        env_dirs, global_args, update_args, jobs=opts.jobs, timeout=opts.timeout
+    )
+    if opts.json:
+        print(environments.dump_summary(results))
+    else:
+        for line in environments.format_summary(results):
+            print(line)
+    return 1 if environments.failed(results) else 0
+
 
 def cmd_status(mgr, opts):
     def print_plan(changes):
@@ -39,11 +180,38 @@ def cmd_status(mgr, opts):
             for ep in changes["create"]:
                 print("    - %s.%s" % (ep.dist, ep.name))
 
+        if changes["rewrite"]:
+            print("  Outdated Wrapper:")
+            for ep, path in changes["rewrite"]:
+                print("    - %s.%s" % (ep.dist, ep.name))
+
+        if changes["upgrade"]:
+            print("  Upgraded:")
+            for ep, path in changes["upgrade"]:
+                print("    - %s.%s" % (ep.dist, ep.name))
+
         if changes["delete"]:
             print("  Uninstalled:")
             for ep, path in changes["delete"]:
                 print("    - %s.%s" % (ep.dist, ep.name))
 
+        if changes["quarantine"]:
+            print("  Quarantined:")
+            for ep, error in changes["quarantine"]:
+                print("    - %s.%s: %s" % (ep.dist, ep.name, error))
+
+        if changes["disabled"]:
+            print("  Disabled:")
+            for ep in changes["disabled"]:
+                print("    - %s.%s" % (ep.dist, ep.name))
+
+        if changes["bootstrap"]:
+            print("  Bootstrap plugin outdated")
+
+    from .manager import DEFAULT_PROFILE
+
+    if mgr.active_profile() != DEFAULT_PROFILE:
+        print("Profile: %s" % mgr.active_profile())
     for mtype in ["plugins", "loaders", "procs"]:
         plan = mgr.plan_update(mtype)
         if any(v for v in plan.values()):
@@ -51,30 +219,449 @@ def cmd_status(mgr, opts):
             print_plan(plan)
 
 
-def cmd_prefix(mgr, opts):
-    print(mgr.user_dir)
+def cmd_fingerprint(mgr, opts):
+    digest, wrappers = mgr.fingerprint()
+    if opts.json:
+        print(
+            json.dumps(
+                {"fingerprint": digest, "wrappers": wrappers}, indent=1, sort_keys=True
+            )
+        )
+    else:
+        print(digest)
+
+
+def cmd_prefix(user_dir, opts):
+    print(user_dir)
+
+
+def cmd_env(user_dir, opts):
+    sys.stdout.write(launch.format_env_file(user_dir, get_virtualenv_path()))
+
+
+def set_enabled(mgr, opts, action):
+    "Add profile rules, and apply them if they are in the active profile."
+    mtypes = ["plugins", "loaders", "procs"]
+    with mgr.locked():
+        mgr.reload_config()
+        profile = opts.profile or mgr.active_profile()
+        old_rules = mgr.profile_rules()
+        mgr.add_profile_rules(action, opts.patterns, profile)
+
+        installed = set()
+        for mtype in mtypes:
+            eps = mgr.find_installed_modules(mtype)
+            installed.update("%s.%s" % (ep.dist, ep.name) for ep in eps)
+        for pattern in opts.patterns:
+            if not fnmatch.filter(installed, pattern):
+                print("Warning: no installed module matches %r." % pattern)
+
+        if profile != mgr.active_profile():
+            hint = "run `idaenv use %s` to apply" % profile
+            print("Saved to profile %r; %s." % (profile, hint))
+            return
+
+        # Only the wrappers of toggled modules change; `update` does the rest.
+        changed = False
+        for mtype in mtypes:
+            plan = mgr.plan_profile_change(mtype, old_rules)
+            if mgr.plan_changes(plan):
+                print("%s:" % mtype.capitalize())
+                mgr.execute_update(mtype, plan)
+                print_plan(plan)
+                changed = True
+    if not changed:
+        print("No changes.")
 
 
 def cmd_disable(mgr, opts):
-    def print_plan(changes):
-        if changes["delete"]:
-            print("Uninstalled:")
-            for ep, path in changes["delete"]:
-                print("  - %s.%s" % (ep.dist, ep.name))
+    set_enabled(mgr, opts, "disable")
+
+
+def cmd_enable(mgr, opts):
+    set_enabled(mgr, opts, "enable")
+
+
+def cmd_profiles(mgr, opts):
+    try:
+        if opts.delete:
+            mgr.delete_profile(opts.delete)
+            return
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+
+    active = mgr.active_profile()
+    for name in mgr.list_profiles():
+        print("%s %s" % ("*" if name == active else " ", name))
+        for action, pattern in mgr.profile_rules(name):
+            print("    %s %s" % (action, pattern))
+
+
+def cmd_use(mgr, opts):
+    try:
+        mgr.use_profile(opts.name, create=opts.create)
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    print("Using profile %r." % opts.name)
+    update_plugins(mgr, opts)
+
+
+def cmd_lazy(mgr, opts):
+    from . import introspect
+
+    for ep in mgr.find_installed_modules("plugins"):
+        if "%s.%s" % (ep.dist, ep.name) == opts.module_name:
+            break
+    else:
+        print("No installed plugin named %r." % opts.module_name)
+        return
+
+    info = mgr.set_lazy(
+        ep,
+        enable=not opts.off,
+        wanted_name=opts.wanted_name,
+        wanted_hotkey=opts.wanted_hotkey,
+        flags=opts.flags,
+    )
+    if info is not None:
+        eager_flags = ["PLUGIN_FIX", "PLUGIN_HIDE", "PLUGIN_PROC", "PLUGIN_DBG"]
+        for flag in eager_flags:
+            if info.get("flags", 0) & introspect.PLUGIN_FLAGS[flag]:
+                print(
+                    "Warning: %s sets %s and may rely on being initialized at "
+                    "startup." % (opts.module_name, flag)
+                )
 
+    with mgr.locked():
+        plan = mgr.plan_update("plugins")
+        mgr.execute_update("plugins", plan)
+
+
+def cmd_profile(mgr, opts):
+    from . import profiling
+
+    eps = set()
     for mtype in ["plugins", "loaders", "procs"]:
-        wrapper = mgr.find_module_wrapper(mtype, opts.module_name)
-        if wrapper is not None:
-            plan = mgr.plan_delete([wrapper])
-            print_plan(plan)
-            mgr.execute_update(mtype, plan)
+        eps.update(mgr.find_installed_modules(mtype))
+
+    results = profiling.profile_entry_points(
+        eps,
+        jobs=opts.jobs,
+        timeout=opts.timeout,
+        trace_memory=opts.trace_memory,
+        top=opts.top,
+    )
+    if opts.json:
+        print(profiling.dump_report(results))
+    else:
+        for line in profiling.format_report(results):
+            print(line)
+
+
+def cmd_prewarm(mgr, opts):
+    from . import profiling, sandbox
+
+    if opts.detect:
+        if not sandbox.HAS_IMPORTTIME:
+            sys.stderr.write("--detect needs import times, from Python 3.7+.\n")
+            return 1
+        eps = set()
+        for mtype in ["plugins", "loaders", "procs"]:
+            eps.update(mgr.find_installed_modules(mtype))
+        results = profiling.profile_entry_points(
+            eps, jobs=opts.jobs, timeout=opts.timeout, top=None
+        )
+        modules = profiling.shared_imports(results, min_ms=opts.min_ms)
+    elif opts.off or opts.modules:
+        modules = [] if opts.off else opts.modules
+    else:
+        for module in mgr.prewarm_modules():
+            print(module)
+        return
+
+    modules = mgr.set_prewarm_modules(modules)
+    if modules:
+        print("Importing in the background at startup: %s" % ", ".join(modules))
+    else:
+        print("Nothing is imported in the background at startup.")
+    update_plugins(mgr, opts)
+
+
+def cmd_snapshot_path(mgr, opts):
+    from .utils import site_paths
+
+    mgr.set_path_snapshot(not opts.off, index=opts.index)
+    if opts.off:
+        print("IDA's sys.path is no longer set up by idaenv.")
+    else:
+        print("Setting up IDA's sys.path with:")
+        for path in site_paths():
+            print("  - %s" % path)
+        if mgr.find_installed_modules("loaders") or mgr.find_installed_modules("procs"):
+            print(
+                "Loaders and processor modules can load before the bootstrap "
+                "plugin, so keep starting IDA in the virtualenv."
+            )
+    update_plugins(mgr, opts)
+
+
+def cmd_bundle(mgr, opts):
+    from . import bundle
+
+    try:
+        description = bundle.build_bundle(
+            mgr, opts.output, fmt=opts.format, native=opts.native
+        )
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        return 2
+
+    for mtype, names in sorted(description["wrappers"].items()):
+        if names:
+            print("%s: %s" % (mtype.capitalize(), ", ".join(names)))
+    print("Packages: %s" % ", ".join(description["packages"]))
+    if description["native"]:
+        if description["native_extracted"]:
+            print("Extracted packages with native code:")
+        else:
+            print("Left out packages with native code, which must be installed:")
+        for path in description["native"]:
+            print("  - %s" % path)
+    for path, error in sorted(description["compile_errors"].items()):
+        print("Failed to compile %s: %s" % (path, error))
+    print("Set IDAUSR to %s to load the bundle." % os.path.abspath(opts.output))
+
+
+def cmd_run(user_dir, opts):
+    import subprocess
+    from . import batch
+
+    try:
+        ida_bin = batch.find_ida(opts.ida, "idat64" if opts.batch else "ida64")
+        inputs = batch.expand_inputs(opts.args) if opts.batch else []
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        return 2
+    environ = launch.launch_environ(user_dir, get_virtualenv_path())
+    if not opts.batch:
+        return subprocess.call([ida_bin] + opts.args, env=environ)
+
+    if opts.script is None:
+        sys.stderr.write("--batch requires --script.\n")
+        return 2
+    # Text-mode IDA without a terminal
+    environ["TVHEADLESS"] = "1"
+    # IDA changes its working directory, so relative paths would move.
+    state = os.path.abspath(opts.state)
+    jobs = batch.make_jobs(
+        inputs,
+        ida_bin,
+        os.path.abspath(opts.script),
+        state,
+        script_args=opts.script_arg,
+        ida_args=opts.ida_arg,
+        db_dir=opts.db_dir and os.path.abspath(opts.db_dir),
+    )
+
+    done = [0]
+
+    def progress(result):
+        done[0] += 1
+        print(
+            "[%d] %-7s %6.1fs  %s%s"
+            % (
+                done[0],
+                result["status"],
+                result["seconds"],
+                result["input"],
+                " (%d attempts)" % result["attempts"] if result["attempts"] > 1 else "",
+            )
+        )
+        sys.stdout.flush()
+
+    try:
+        results = batch.run_batch(
+            jobs,
+            environ,
+            state,
+            concurrency=opts.jobs,
+            timeout=opts.timeout,
+            retries=opts.retries,
+            rerun_failed=opts.rerun_failed,
+            progress=progress,
+        )
+    except KeyboardInterrupt:
+        print("Interrupted; run again with the same --state to resume.")
+        return 130
+
+    counts = batch.count_statuses(results)
+    print(
+        "%d jobs: %s; %d run now, manifest in %s"
+        % (
+            len(results),
+            ", ".join("%d %s" % (n, s) for s, n in sorted(counts.items())),
+            done[0],
+            os.path.join(state, batch.MANIFEST_NAME),
+        )
+    )
+    return 1 if batch.failed(results) else 0
+
+
+def cmd_watch(user_dir, opts):
+    from . import manager, watch
+
+    def update(changed=()):
+        for path in sorted(changed):
+            print("Changed: %s" % path)
+        entrypoints.refresh_entrypoint_caches()
+        mgr = manager.PluginManager(
+            user_dir, use_cache=not opts.no_cache, compile=not opts.no_compile
+        )
+        update_plugins(mgr, opts)
+        sys.stdout.flush()
+
+    update()
+    print("Watching for installed and removed packages...")
+    sys.stdout.flush()
+    try:
+        watch.watch(
+            update, debounce=opts.debounce, interval=opts.interval, polling=opts.poll
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_instrument(mgr, opts):
+    mgr.set_instrumented(not opts.off)
+    if opts.off:
+        print("Wrappers no longer record load times.")
+    else:
+        print("Wrappers record load times; see `idaenv startup-report`.")
+    update_plugins(mgr, opts)
+
+
+def cmd_startup_report(user_dir, opts):
+    from . import runtime
+
+    if opts.clear:
+        runtime.clear_log(user_dir)
+        return
+
+    rows = runtime.summarize(runtime.read_log(user_dir))
+    if opts.json:
+        print(runtime.dump_summary(rows))
+    elif not rows:
+        print("No load times recorded; enable them with `idaenv instrument`.")
+    else:
+        for line in runtime.format_summary(rows):
+            print(line)
+
+
+def cmd_rollback(mgr, opts):
+    module_types = mgr.rollback_last()
+    for mtype in ["plugins", "loaders", "procs"]:
+        if mtype in module_types:
+            print("%s: restored previous wrappers." % mtype.capitalize())
+
+    if not module_types:
+        print("Nothing to roll back.")
+
+
+def print_timings(fmt):
+    "Print the collected phase timings to stderr, keeping stdout parseable."
+    data = trace.report()
+    if fmt == "json":
+        sys.stderr.write(trace.dump_report(data) + "\n")
+    else:
+        for line in trace.format_report(data):
+            sys.stderr.write(line + "\n")
+
+
+def run_command(opts):
+    user_dir = get_default_user_dir()
+    if not opts.needs_manager:
+        return opts.func(user_dir, opts)
+
+    from . import manager
+
+    mgr = manager.PluginManager(
+        user_dir,
+        use_cache=not opts.no_cache,
+        full_rescan=getattr(opts, "full_rescan", False),
+        compile=not getattr(opts, "no_compile", False),
+    )
+    return opts.func(mgr, opts)
 
 
 def main():
     ap = ArgumentParser()
+    ap.set_defaults(needs_manager=True)
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore the entry point cache and rescan installed packages.",
+    )
+    ap.add_argument(
+        "--backend",
+        choices=entrypoints.BACKENDS,
+        help="Package metadata backend (default: $IDAENV_BACKEND or importlib).",
+    )
+    ap.add_argument(
+        "--timings",
+        action="store_const",
+        const="table",
+        default=trace.env_format(),
+        help="Report time and file operations per phase to stderr "
+        "(default: $IDAENV_TRACE).",
+    )
+    ap.add_argument(
+        "--timings-json",
+        dest="timings",
+        action="store_const",
+        const="json",
+        help="Report timings as JSON.",
+    )
     sps = ap.add_subparsers()
 
     sp = sps.add_parser("update", help="Update installed IDA modules.")
+    sp.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="Rescan every installed package and check the stored records.",
+    )
+    sp.add_argument(
+        "--no-compile",
+        action="store_true",
+        help="Don't byte-compile wrappers and the packages they import.",
+    )
+    sp.add_argument(
+        "--json", action="store_true", help="Print a summary of changes as JSON."
+    )
+    sp.add_argument(
+        "--verify",
+        action="store_true",
+        help="Import new and upgraded modules in a sandbox first, and "
+        "quarantine those that fail instead of activating them.",
+    )
+    sp.add_argument(
+        "--all-envs",
+        nargs="+",
+        metavar="ENV",
+        help="Update these virtualenvs, given as paths or glob patterns, "
+        "instead of the current environment.",
+    )
+    sp.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of environments updated, or modules verified, concurrently.",
+    )
+    sp.add_argument(
+        "--timeout",
+        type=float,
+        help="Seconds allowed per environment update or module verification.",
+    )
     sp.set_defaults(func=cmd_update)
 
     sp = sps.add_parser(
@@ -82,16 +669,240 @@ def main():
     )
     sp.set_defaults(func=cmd_status)
 
+    sp = sps.add_parser(
+        "fingerprint", help="Print a digest identifying the installed wrappers."
+    )
+    sp.add_argument(
+        "--json", action="store_true", help="List the wrappers with the digest."
+    )
+    sp.set_defaults(func=cmd_fingerprint)
+
     sp = sps.add_parser("prefix", help="Print the idaenv install prefix.")
-    sp.set_defaults(func=cmd_prefix)
+    sp.set_defaults(func=cmd_prefix, needs_manager=False)
+
+    sp = sps.add_parser(
+        "env", help="Print shell commands that set up the environment for IDA."
+    )
+    sp.set_defaults(func=cmd_env, needs_manager=False)
+
+    for name, func, help in [
+        ("disable", cmd_disable, "Disable IDA modules in a profile."),
+        ("enable", cmd_enable, "Enable IDA modules in a profile."),
+    ]:
+        sp = sps.add_parser(name, help=help)
+        sp.add_argument(
+            "patterns", nargs="+", metavar="PATTERN", help="dist.name glob pattern"
+        )
+        sp.add_argument("--profile", help="Profile to change (default: active).")
+        sp.set_defaults(func=func)
 
-    sp = sps.add_parser("disable", help="Disable an IDA module.")
+    sp = sps.add_parser("profiles", help="List the plugin profiles.")
+    sp.add_argument("--delete", metavar="NAME", help="Delete a profile.")
+    sp.set_defaults(func=cmd_profiles)
+
+    sp = sps.add_parser("use", help="Switch to another plugin profile.")
+    sp.add_argument("name")
+    sp.add_argument(
+        "--create", action="store_true", help="Create the profile if it is missing."
+    )
+    sp.set_defaults(func=cmd_use)
+
+    sp = sps.add_parser(
+        "lazy", help="Import a plugin only when it is first run from IDA."
+    )
     sp.add_argument("module_name")
-    sp.set_defaults(func=cmd_disable)
+    sp.add_argument(
+        "--off", action="store_true", help="Load the plugin at startup again."
+    )
+    sp.add_argument("--wanted-name", help="Override the plugin menu name.")
+    sp.add_argument("--wanted-hotkey", help="Override the plugin hotkey.")
+    sp.add_argument("--flags", type=lambda s: int(s, 0), help="Override plugin flags.")
+    sp.set_defaults(func=cmd_lazy)
+
+    sp = sps.add_parser(
+        "profile", help="Measure the import cost of each installed IDA module."
+    )
+    sp.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    sp.add_argument("--jobs", type=int, help="Number of concurrent imports.")
+    sp.add_argument("--timeout", type=float, help="Seconds allowed per import.")
+    sp.add_argument(
+        "--top", type=int, default=5, help="Slowest nested imports to list."
+    )
+    sp.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Measure peak allocations with tracemalloc (slows imports).",
+    )
+    sp.set_defaults(func=cmd_profile)
+
+    sp = sps.add_parser(
+        "prewarm",
+        help="Import modules shared by plugins in the background at IDA startup.",
+    )
+    sp.add_argument("modules", nargs="*", metavar="MODULE")
+    sp.add_argument(
+        "--detect",
+        action="store_true",
+        help="Find modules imported by several installed IDA modules.",
+    )
+    sp.add_argument(
+        "--min-ms",
+        type=float,
+        default=5.0,
+        help="Import time below which detected modules are ignored (default: 5).",
+    )
+    sp.add_argument("--jobs", type=int, help="Number of concurrent imports.")
+    sp.add_argument("--timeout", type=float, help="Seconds allowed per import.")
+    sp.add_argument("--off", action="store_true", help="Remove the bootstrap plugin.")
+    sp.set_defaults(func=cmd_prewarm)
+
+    sp = sps.add_parser(
+        "snapshot-path",
+        help="Set up IDA's sys.path from a snapshot taken by each update.",
+    )
+    sp.add_argument(
+        "--index",
+        action="store_true",
+        help="Also record where the entry point packages are.",
+    )
+    sp.add_argument(
+        "--off", action="store_true", help="Stop setting up IDA's sys.path."
+    )
+    sp.set_defaults(func=cmd_snapshot_path)
+
+    sp = sps.add_parser(
+        "bundle", help="Pack the wrappers and their packages for another machine."
+    )
+    sp.add_argument("output", help="Directory to create, used as IDAUSR.")
+    sp.add_argument(
+        "--format",
+        choices=["zip", "dir"],
+        default="zip",
+        help="Pack the packages into a zip file (default) or a directory.",
+    )
+    sp.add_argument(
+        "--native",
+        choices=["extract", "report"],
+        default="extract",
+        help="Copy packages with native code next to the zip (default), "
+        "or leave them out and list them.",
+    )
+    sp.set_defaults(func=cmd_bundle)
+
+    sp = sps.add_parser("run", help="Run IDA with the idaenv environment.")
+    sp.add_argument(
+        "args",
+        nargs="*",
+        help="IDA arguments (after --), or with --batch input files and directories",
+    )
+    sp.add_argument(
+        "--ida",
+        help="IDA executable (default: idat64 with --batch, otherwise ida64, "
+        "in $IDAHOME)",
+    )
+    sp.add_argument(
+        "--batch", action="store_true", help="Analyze each input with headless IDA."
+    )
+    sp.add_argument("--script", help="IDAPython script run on each input.")
+    sp.add_argument(
+        "--script-arg",
+        action="append",
+        default=[],
+        metavar="ARG",
+        help="Argument passed to the script (repeatable).",
+    )
+    sp.add_argument(
+        "--ida-arg",
+        action="append",
+        default=[],
+        metavar="ARG",
+        help="Extra IDA command line option (repeatable).",
+    )
+    sp.add_argument(
+        "--state",
+        default="idaenv-batch",
+        help="Directory for progress, logs and the manifest (default: idaenv-batch).",
+    )
+    sp.add_argument(
+        "--db-dir", help="Write databases here instead of next to the inputs."
+    )
+    sp.add_argument("--jobs", type=int, help="Number of concurrent IDA processes.")
+    sp.add_argument("--timeout", type=float, help="Seconds allowed per attempt.")
+    sp.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="Retries of a failed or timed out job (default: 1).",
+    )
+    sp.add_argument(
+        "--rerun-failed",
+        action="store_true",
+        help="Run jobs that failed in an earlier run again.",
+    )
+    sp.set_defaults(func=cmd_run, needs_manager=False)
+
+    sp = sps.add_parser(
+        "instrument", help="Record the load time of each IDA module inside IDA."
+    )
+    sp.add_argument("--off", action="store_true", help="Stop recording load times.")
+    sp.set_defaults(func=cmd_instrument)
+
+    sp = sps.add_parser(
+        "startup-report", help="Summarize the load times recorded inside IDA."
+    )
+    sp.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    sp.add_argument(
+        "--clear", action="store_true", help="Discard the recorded load times."
+    )
+    sp.set_defaults(func=cmd_startup_report, needs_manager=False)
+
+    sp = sps.add_parser(
+        "rollback", help="Restore the wrappers from before the last change."
+    )
+    sp.set_defaults(func=cmd_rollback)
+
+    sp = sps.add_parser(
+        "watch", help="Update wrappers whenever packages are installed or removed."
+    )
+    sp.add_argument(
+        "--debounce",
+        type=float,
+        default=1.0,
+        help="Seconds without changes before updating (default: 1).",
+    )
+    sp.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes instead of using inotify.",
+    )
+    sp.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between polls (default: 2).",
+    )
+    sp.add_argument(
+        "--no-compile",
+        action="store_true",
+        help="Don't byte-compile wrappers and the packages they import.",
+    )
+    sp.set_defaults(func=cmd_watch, needs_manager=False, full_rescan=False)
 
     opts = ap.parse_args()
     if "func" not in opts:
         opts.func = cmd_status
+    if getattr(opts, "all_envs", None):
+        # Each environment is updated by its own interpreter.
+        opts.func = cmd_update_all_envs
+        opts.needs_manager = False
+
+    if opts.backend:
+        entrypoints.set_backend(opts.backend)
 
-    mgr = manager.get_default_manager()
-    opts.func(mgr, opts)
+    if opts.timings:
+        trace.enable()
+    try:
+        return run_command(opts)
+    finally:
+        if opts.timings:
+            print_timings(opts.timings)
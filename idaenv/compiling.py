@@ -0,0 +1,133 @@
+"""
+Byte-compilation of wrappers and the packages they import.
+
+Bytecode is written with hash-based invalidation where supported, so it stays
+valid when an environment is copied and file mtimes change.
+"""
+import os
+import sys
+import struct
+import py_compile
+
+from .utils import find_module_path
+
+
+# Compiling fewer files than this isn't worth starting worker processes.
+POOL_THRESHOLD = 16
+
+
+def package_root(module):
+    """
+    Return the file or directory of the top-level package containing a
+    module, or None if it isn't on the path.
+    """
+    top = module.split(".")[0]
+    path = find_module_path(top)
+    if path is not None:
+        if os.path.basename(path) == "__init__.py":
+            return os.path.dirname(path)
+        return path
+
+    # Namespace package
+    for entry in sys.path:
+        candidate = os.path.join(entry or ".", top)
+        if os.path.isdir(candidate):
+            return candidate
+    return None
+
+
+def iter_sources(path):
+    "Yield the Python source files in a file or directory tree."
+    if os.path.isfile(path):
+        if path.endswith(".py"):
+            yield path
+        return
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+        for name in filenames:
+            if name.endswith(".py"):
+                yield os.path.join(dirpath, name)
+
+
+def bytecode_is_current(path):
+    "Return True if a source file has up-to-date hash-based bytecode."
+    import importlib.util
+
+    try:
+        with open(importlib.util.cache_from_source(path), "rb") as f:
+            header = f.read(16)
+        with open(path, "rb") as f:
+            source = f.read()
+    except (IOError, OSError):
+        return False
+
+    if len(header) < 16 or header[:4] != importlib.util.MAGIC_NUMBER:
+        return False
+    flags = struct.unpack("<I", header[4:8])[0]
+    return bool(flags & 0x1) and header[8:16] == importlib.util.source_hash(source)
+
+
+def bytecode(source, filename):
+    """
+    Return the contents of a .pyc file for source code, or None where
+    hash-based bytecode isn't supported.  The bytecode is not checked against
+    the source when imported, so it suits files that never change, such as
+    those in a bundle.
+    """
+    import marshal
+    import importlib.util
+
+    if not hasattr(importlib.util, "source_hash"):
+        return None
+    code = compile(source, filename, "exec", dont_inherit=True)
+    return (
+        importlib.util.MAGIC_NUMBER
+        + struct.pack("<I", 0x1)
+        + importlib.util.source_hash(source)
+        + marshal.dumps(code)
+    )
+
+
+def compile_file(path):
+    """
+    Compile a single source file.  Returns None on success, or a description
+    of the error.
+    """
+    try:
+        if hasattr(py_compile, "PycInvalidationMode"):
+            if bytecode_is_current(path):
+                return None
+            py_compile.compile(
+                path,
+                doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+            )
+        else:
+            py_compile.compile(path, doraise=True)
+    except py_compile.PyCompileError as e:
+        return e.msg.strip().splitlines()[-1]
+    except (IOError, OSError) as e:
+        return str(e)
+    return None
+
+
+def compile_sources(paths, jobs=None):
+    """
+    Byte-compile every source file in the given files and directories using
+    a process pool.  Returns a sorted list of (path, error) pairs for files
+    that failed to compile.
+    """
+    sources = sorted(set(src for path in paths for src in iter_sources(path)))
+    if len(sources) < POOL_THRESHOLD:
+        errors = [compile_file(src) for src in sources]
+    else:
+        import multiprocessing
+
+        pool = multiprocessing.Pool(jobs)
+        try:
+            errors = pool.map(compile_file, sources, chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+    return [(src, error) for src, error in zip(sources, errors) if error is not None]
@@ -0,0 +1,20 @@
+"""
+User settings stored alongside the wrappers.
+"""
+import json
+
+from .utils import atomic_write
+
+
+def load_config(path):
+    "Return the stored settings, or an empty mapping if there are none."
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def save_config(path, config):
+    atomic_write(path, json.dumps(config, indent=1, sort_keys=True).encode("utf8"))
@@ -1,29 +1,81 @@
+import os
 import re
-import email.parser
+import sys
 from collections import namedtuple
 
-try:
-    # Try the backport package
-    import importlib_metadata as importlib_metadata
+from . import trace
 
-    pkg_resources = None
-except ImportError:
-    # Try importlib.metadata from stdlib otherwise
-    import importlib.metadata as importlib_metadata
 
-    pkg_resources = None
-except ImportError:
-    # Use pkg_resources if importlib.metadata isn't available
-    importlib_metadata = None
-    import pkg_resources
+def _import_backends():
+    """
+    Import the metadata library used by the importlib or pkg_resources
+    backend.  Both are slow to import, so this is deferred until entry points
+    are actually read.
+    """
+    global importlib_metadata, pkg_resources, _backends_imported
+    if _backends_imported:
+        return
+
+    try:
+        # Try the backport package
+        import importlib_metadata as metadata_module
+    except ImportError:
+        try:
+            # Try importlib.metadata from stdlib otherwise
+            import importlib.metadata as metadata_module
+        except ImportError:
+            metadata_module = None
+
+    if metadata_module is not None:
+        importlib_metadata = metadata_module
+        pkg_resources = None
+    else:
+        # Use pkg_resources if importlib.metadata isn't available
+        import pkg_resources as pkg_resources_module
+
+        importlib_metadata = None
+        pkg_resources = pkg_resources_module
+    _backends_imported = True
+
+
+_backends_imported = False
+
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        if name in ("importlib_metadata", "pkg_resources"):
+            _import_backends()
+            return globals()[name]
+        raise AttributeError(name)
+
+
+else:
+    _import_backends()
 
 
 EntryPointInfo = namedtuple("EntryPointInfo", "dist group name module attr")
 
+BACKENDS = ("importlib", "pkg_resources", "native")
+
+# Explicitly selected backend; by default the metadata library that was
+# successfully imported is used.
+backend = None
+
+
+def _normalize_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
 
 def refresh_entrypoint_caches():
-    if pkg_resources is not None:
+    "Forget cached metadata after distributions were installed or removed."
+    # Nothing to refresh if pkg_resources hasn't been imported yet.
+    if globals().get("pkg_resources") is not None:
         pkg_resources._initialize_master_working_set()
+    if globals().get("importlib_metadata") is not None:
+        # Clears the directory listings cached by importlib.metadata's finder.
+        import importlib
+
+        importlib.invalidate_caches()
 
 
 def _importlib_entry_points_legacy(group_name):
@@ -59,15 +111,43 @@ def _importlib_iter_entry_point_info(group_name):
     if eps is None:
         return
     for ep in eps:
-        key = re.sub(r"[-_.]+", "-", ep.dist.metadata["Name"]).lower()
-        yield EntryPointInfo(key, group_name, ep.name, ep.module, ep.attr)
+        key = _normalize_name(ep.dist.metadata["Name"])
+        yield EntryPointInfo(key, group_name, ep.name, ep.module, ep.attr or "")
+
+
+def _importlib_scan_entry_point_info(group_names):
+    """
+    Collect entry points for several groups in a single pass over the
+    installed distributions.
+    """
+    seen = set()
+    for dist in importlib_metadata.distributions():
+        # Only the first distribution of a given name on the path is visible,
+        # as with importlib_metadata.entry_points()
+        path_key = getattr(dist, "_normalized_name", None)
+        if path_key is not None:
+            if path_key in seen:
+                continue
+            seen.add(path_key)
+
+        if trace.enabled:
+            trace.count(dists=1)
+
+        eps = [ep for ep in dist.entry_points if ep.group in group_names]
+        if not eps:
+            continue
+
+        key = _normalize_name(dist.metadata["Name"])
+        for ep in eps:
+            yield EntryPointInfo(key, ep.group, ep.name, ep.module, ep.attr or "")
 
 
 def _pkg_resources_normalized_name(dist):
+    import email.parser
+
     metadata = dist.get_metadata(dist.PKG_INFO)
     parsed = email.parser.Parser().parsestr(metadata)
-    key = re.sub(r"[-_.]+", "-", parsed["Name"]).lower()
-    return key
+    return _normalize_name(parsed["Name"])
 
 
 def _pkg_resources_iter_entry_point_info(group_name):
@@ -82,8 +162,282 @@ def _pkg_resources_iter_entry_point_info(group_name):
         )
 
 
-def iter_entry_point_info(group_name):
+def _pkg_resources_scan_entry_point_info(group_names):
+    for dist in pkg_resources.working_set:
+        if trace.enabled:
+            trace.count(dists=1)
+        key = None
+        for group_name in group_names:
+            for ep in dist.get_entry_map(group_name).values():
+                if key is None:
+                    key = _pkg_resources_normalized_name(dist)
+                attr = ep.attrs[0] if ep.attrs else ""
+                yield EntryPointInfo(key, group_name, ep.name, ep.module_name, attr)
+
+
+# Same grammar as importlib_metadata.EntryPoint.pattern
+_entry_point_value_rx = re.compile(
+    r"(?P<module>[\w.]+)\s*"
+    r"(:\s*(?P<attr>[\w.]+)\s*)?"
+    r"((?P<extras>\[.*\])\s*)?$"
+)
+
+
+def _native_dist_key(dir_name):
+    """
+    Derive the normalized distribution name from a dist-info or egg-info
+    directory name, e.g. ``Foo_Bar-1.0.dist-info`` -> ``foo-bar``.
+    """
+    stem, ext = os.path.splitext(dir_name)
+    if ext not in (".dist-info", ".egg-info"):
+        return None
+    return _normalize_name(stem.partition("-")[0])
+
+
+def dist_version(path):
+    """
+    Return the version of the distribution in a dist-info or egg-info
+    directory: from the directory name where it's included, otherwise from
+    the metadata headers.  Returns an empty string if it can't be found.
+    """
+    if os.path.basename(path) == "EGG-INFO":
+        # The metadata of an egg, e.g. foo-1.0-py2.7.egg/EGG-INFO
+        path = os.path.dirname(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    # e.g. Foo_Bar-1.0.dist-info or foo-1.0-py2.7.egg-info
+    parts = stem.split("-")
+    if len(parts) > 1:
+        return parts[1]
+
+    for name in ("METADATA", "PKG-INFO"):
+        try:
+            with open(os.path.join(path, name), "rb") as f:
+                for line in f:
+                    line = line.decode("utf8", "replace").strip()
+                    if not line:
+                        # End of the headers
+                        break
+                    if line.startswith("Version:"):
+                        return line[len("Version:") :].strip()
+        except (IOError, OSError):
+            continue
+    return ""
+
+
+def find_distributions(path_entry):
+    """
+    Return (key, path) pairs for the dist-info and egg-info directories in a
+    sys.path entry, where key is the normalized distribution name.  An egg
+    (foo-1.0-py2.7.egg) on sys.path is a distribution of its own, with its
+    metadata in EGG-INFO.
+    """
+    if path_entry.endswith(".egg"):
+        egg_info = os.path.join(path_entry, "EGG-INFO")
+        if not os.path.isdir(egg_info):
+            return []
+        stem = os.path.basename(path_entry).partition("-")[0]
+        return [(_normalize_name(stem), egg_info)]
+
+    try:
+        names = sorted(os.listdir(path_entry or "."))
+    except OSError:
+        return []
+
+    dists = []
+    for name in names:
+        key = _native_dist_key(name)
+        if key is not None:
+            path = os.path.join(path_entry, name)
+            if os.path.isdir(path):
+                dists.append((key, path))
+    return dists
+
+
+def _native_parse_entry_points(text, group_names):
+    "Parse an entry_points.txt file, keeping only the requested groups."
+    group = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            group = line[1:-1].strip()
+            continue
+        if group not in group_names:
+            continue
+
+        name, sep, value = line.partition("=")
+        m = _entry_point_value_rx.match(value.strip())
+        if sep and m:
+            yield group, name.strip(), m.group("module"), m.group("attr") or ""
+
+
+def _native_read_entry_points(key, path, group_names):
+    "Read the entry points of a single distribution."
+    try:
+        with open(os.path.join(path, "entry_points.txt"), "rb") as f:
+            data = f.read()
+    except (IOError, OSError):
+        return []
+    if trace.enabled:
+        trace.count(files=1, read=len(data))
+    # A broken file shouldn't abort the scan of every other distribution.
+    text = data.decode("utf8", "replace")
+    return [
+        EntryPointInfo(key, group, name, module, attr)
+        for group, name, module, attr in _native_parse_entry_points(
+            text, group_names
+        )
+    ]
+
+
+def _native_scan_path_entry(path_entry, group_names):
+    dists = find_distributions(path_entry)
+    if trace.enabled:
+        trace.count(dists=len(dists))
+    return [
+        (key, _native_read_entry_points(key, path, group_names))
+        for key, path in dists
+    ]
+
+
+def _native_scan_entry_point_info(group_names, paths=None):
+    """
+    Collect entry points by reading only the entry_points.txt file of each
+    distribution.
+    """
+    if paths is None:
+        paths = sys.path
+
+    results = [_native_scan_path_entry(p, group_names) for p in paths]
+
+    # Only the first distribution of a given name on the path is visible.
+    seen = set()
+    for dists in results:
+        for key, eps in dists:
+            if key in seen:
+                continue
+            seen.add(key)
+            for ep in eps:
+                yield ep
+
+
+def _native_iter_entry_point_info(group_name):
+    return _native_scan_entry_point_info(set([group_name]))
+
+
+def _importlib_read_entry_points(path, group_names):
+    dist = importlib_metadata.Distribution.at(path)
+    eps = [ep for ep in dist.entry_points if ep.group in group_names]
+    if not eps:
+        return []
+    key = _normalize_name(dist.metadata["Name"])
+    return [
+        EntryPointInfo(key, ep.group, ep.name, ep.module, ep.attr or "")
+        for ep in eps
+    ]
+
+
+def _pkg_resources_read_entry_points(path, group_names):
+    location, basename = os.path.split(path)
+    if basename == "EGG-INFO":
+        dist = pkg_resources.Distribution.from_filename(
+            location, metadata=pkg_resources.PathMetadata(location, path)
+        )
+    else:
+        dist = pkg_resources.Distribution.from_location(
+            location, basename, pkg_resources.PathMetadata(location, path)
+        )
+    eps = []
+    for group_name in sorted(group_names):
+        for ep in dist.get_entry_map(group_name).values():
+            attr = ep.attrs[0] if ep.attrs else ""
+            eps.append((group_name, ep.name, ep.module_name, attr))
+    if not eps:
+        return []
+    key = _pkg_resources_normalized_name(dist)
+    return [EntryPointInfo(key, *ep) for ep in eps]
+
+
+def read_dist_entry_points(key, path, group_names):
+    """
+    Return the entry points in the given groups provided by a single
+    distribution, identified by its key and dist-info/egg-info path as
+    returned by find_distributions().
+    """
+    if trace.enabled:
+        with trace.phase("read metadata"):
+            return _read_dist_entry_points(key, path, group_names)
+    return _read_dist_entry_points(key, path, group_names)
+
+
+def _read_dist_entry_points(key, path, group_names):
+    name = get_backend()
+    if name == "native":
+        return _native_read_entry_points(key, path, group_names)
+    elif name == "importlib":
+        return _importlib_read_entry_points(path, group_names)
+    else:
+        return _pkg_resources_read_entry_points(path, group_names)
+
+
+def get_backend():
+    "Return the name of the metadata backend in use."
+    if backend is not None:
+        return backend
+
+    _import_backends()
     if importlib_metadata is not None:
-        return _importlib_iter_entry_point_info(group_name)
+        return "importlib"
     else:
-        return _pkg_resources_iter_entry_point_info(group_name)
+        return "pkg_resources"
+
+
+def set_backend(name):
+    "Select the metadata backend; None restores the default."
+    global backend, pkg_resources
+    if name is not None and name not in BACKENDS:
+        raise ValueError("Invalid metadata backend: %r" % name)
+    if name in ("importlib", "pkg_resources"):
+        _import_backends()
+    if name == "importlib" and importlib_metadata is None:
+        raise ValueError("importlib_metadata is not available.")
+    if name == "pkg_resources" and pkg_resources is None:
+        import pkg_resources
+    backend = name
+
+
+def iter_entry_point_info(group_name):
+    name = get_backend()
+    if name == "native":
+        eps = _native_iter_entry_point_info(group_name)
+    elif name == "importlib":
+        eps = _importlib_iter_entry_point_info(group_name)
+    else:
+        eps = _pkg_resources_iter_entry_point_info(group_name)
+    if trace.enabled:
+        return trace.traced_iter("scan metadata", eps)
+    return eps
+
+
+def scan_entry_point_info(group_names):
+    """
+    Return a mapping of group name to the installed entry points in that
+    group, visiting each distribution only once.
+    """
+    name = get_backend()
+    if name == "native":
+        eps = _native_scan_entry_point_info(set(group_names))
+    elif name == "importlib":
+        eps = _importlib_scan_entry_point_info(set(group_names))
+    else:
+        eps = _pkg_resources_scan_entry_point_info(group_names)
+
+    index = dict((group_name, []) for group_name in group_names)
+    with trace.phase("scan metadata"):
+        for ep in eps:
+            index[ep.group].append(ep)
+    return index
+
+
+set_backend(os.environ.get("IDAENV_BACKEND") or None)
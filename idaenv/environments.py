@@ -0,0 +1,205 @@
+"""
+Update several virtualenvs at once.
+
+Each environment is updated by its own interpreter running `python -m idaenv
+update --json`, so entry points are read from that environment's sys.path
+with the idaenv version installed there.
+"""
+from __future__ import print_function
+
+import os
+import json
+import glob
+import time
+import subprocess
+
+from .utils import communicate, get_platform
+
+
+def env_python(env_dir):
+    "Return the path of a virtualenv's interpreter."
+    if get_platform() == "win":
+        return os.path.join(env_dir, "Scripts", "python.exe")
+    return os.path.join(env_dir, "bin", "python")
+
+
+def is_virtualenv(path):
+    return os.path.isfile(env_python(path)) and (
+        os.path.isfile(os.path.join(path, "pyvenv.cfg"))
+        or os.path.isfile(os.path.join(os.path.dirname(env_python(path)), "activate"))
+    )
+
+
+def find_environments(patterns):
+    """
+    Expand virtualenv roots and glob patterns into a sorted list of
+    virtualenv directories.  Glob matches that aren't virtualenvs are skipped;
+    an explicitly named directory that isn't one is an error.
+    """
+    envs = set()
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if glob.has_magic(pattern):
+            envs.update(
+                os.path.realpath(path)
+                for path in glob.glob(pattern)
+                if is_virtualenv(path)
+            )
+        elif is_virtualenv(pattern):
+            envs.add(os.path.realpath(pattern))
+        else:
+            raise ValueError("Not a virtualenv: %s" % pattern)
+    return sorted(envs)
+
+
+def child_environ(env_dir):
+    "Return the environment variables of a process running in env_dir."
+    environ = dict(os.environ)
+    # Keep the current interpreter's paths out of the environment's sys.path.
+    for name in ("PYTHONHOME", "PYTHONPATH", "__PYVENV_LAUNCHER__"):
+        environ.pop(name, None)
+    environ["VIRTUAL_ENV"] = env_dir
+    environ["PATH"] = os.pathsep.join(
+        [os.path.dirname(env_python(env_dir)), environ.get("PATH", "")]
+    )
+    return environ
+
+
+def update_environment(env_dir, global_args=(), update_args=(), timeout=None):
+    """
+    Run an update in a virtualenv and return a summary with the "status"
+    ("updated", "unchanged", "failed" or "timeout"), "returncode",
+    "seconds", "changes" and "compile_errors" of the update.
+    """
+    args = [env_python(env_dir), "-m", "idaenv"] + list(global_args)
+    args += ["update", "--json"] + list(update_args)
+    result = {
+        "env": env_dir,
+        "status": "failed",
+        "returncode": None,
+        "changes": {},
+        "compile_errors": {},
+        "error": None,
+    }
+
+    start = time.time()
+    try:
+        proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=child_environ(env_dir),
+            universal_newlines=True,
+        )
+    except OSError as e:
+        result["error"] = str(e)
+        result["seconds"] = time.time() - start
+        return result
+
+    output = communicate(proc, timeout)
+    if output is None:
+        result["status"] = "timeout"
+        result["error"] = "Timed out after %ss" % timeout
+        result["seconds"] = time.time() - start
+        return result
+    stdout, stderr = output
+    result["seconds"] = time.time() - start
+    result["returncode"] = proc.returncode
+
+    lines = stdout.strip().splitlines()
+    try:
+        summary = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        summary = None
+    if isinstance(summary, dict):
+        result["changes"] = summary.get("changes", {})
+        result["compile_errors"] = summary.get("compile_errors", {})
+    if proc.returncode != 0 or not isinstance(summary, dict):
+        # `update --verify` fails when it quarantines modules.
+        names = sorted(
+            name
+            for changes in result["changes"].values()
+            for name in changes.get("quarantined", [])
+        )
+        if names:
+            result["error"] = "Quarantined %s" % ", ".join(names)
+        else:
+            tail = stderr.strip().splitlines()[-1:] or ["no output"]
+            result["error"] = "Exited with status %d: %s" % (proc.returncode, tail[0])
+        return result
+
+    result["status"] = "updated" if result["changes"] else "unchanged"
+    return result
+
+
+def update_environments(
+    env_dirs, global_args=(), update_args=(), jobs=None, timeout=None
+):
+    "Update virtualenvs concurrently.  Results are in the order of env_dirs."
+    if not env_dirs:
+        return []
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+
+    def update(env_dir):
+        return update_environment(env_dir, global_args, update_args, timeout)
+
+    pool = ThreadPool(min(len(env_dirs), jobs or multiprocessing.cpu_count()))
+    try:
+        return pool.map(update, env_dirs)
+    finally:
+        pool.close()
+
+
+def failed(results):
+    return [r for r in results if r["status"] in ("failed", "timeout")]
+
+
+def format_changes(changes):
+    parts = []
+    for module_type in sorted(changes):
+        counts = changes[module_type]
+        parts.append(
+            "%s +%d -%d ~%d ^%d"
+            % (
+                module_type,
+                len(counts.get("created", [])),
+                len(counts.get("deleted", [])),
+                len(counts.get("rewritten", [])),
+                len(counts.get("upgraded", [])),
+            )
+        )
+    return ", ".join(parts)
+
+
+def format_summary(results):
+    "Return a human-readable summary as a list of lines."
+    lines = []
+    for r in results:
+        lines.append(
+            "%-10s %7.1fs  %s" % (r["status"], r.get("seconds", 0), r["env"])
+        )
+        if r["error"]:
+            lines.append("           error: %s" % r["error"])
+        if r["changes"]:
+            lines.append("           %s" % format_changes(r["changes"]))
+        for path, error in sorted(r["compile_errors"].items()):
+            lines.append("           failed to compile %s: %s" % (path, error))
+    lines.append(
+        "%d environments, %d updated, %d failed"
+        % (
+            len(results),
+            len([r for r in results if r["status"] == "updated"]),
+            len(failed(results)),
+        )
+    )
+    return lines
+
+
+def dump_summary(results):
+    return json.dumps(
+        {"environments": results, "failed": len(failed(results))},
+        indent=1,
+        sort_keys=True,
+    )
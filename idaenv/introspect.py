@@ -0,0 +1,196 @@
+"""
+Static inspection of plugin sources.
+
+Plugin attributes such as wanted_name are read from the syntax tree of the
+plugin module, so nothing is imported and no IDA modules are needed.
+"""
+import ast
+import binascii
+import __future__
+
+from .utils import find_module_path
+
+try:
+    text_type = unicode
+except NameError:
+    # Python 3
+    text_type = str
+
+
+# plugin_t.flags values from the IDA SDK
+PLUGIN_FLAGS = {
+    "PLUGIN_MOD": 0x0001,
+    "PLUGIN_DRAW": 0x0002,
+    "PLUGIN_SEG": 0x0004,
+    "PLUGIN_UNL": 0x0008,
+    "PLUGIN_HIDE": 0x0010,
+    "PLUGIN_DBG": 0x0020,
+    "PLUGIN_PROC": 0x0040,
+    "PLUGIN_FIX": 0x0080,
+    "PLUGIN_MULTI": 0x0100,
+    "PLUGIN_SCRIPTED": 0x8000,
+}
+
+PLUGIN_INFO_ATTRS = ("wanted_name", "wanted_hotkey", "comment", "help", "flags")
+
+
+def eval_flags(node):
+    "Evaluate a flags expression built from integers and PLUGIN_* names."
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitOr, ast.Add)):
+        return eval_flags(node.left) | eval_flags(node.right)
+    if isinstance(node, ast.Attribute):
+        return PLUGIN_FLAGS[node.attr]
+    if isinstance(node, ast.Name):
+        return PLUGIN_FLAGS[node.id]
+    value = ast.literal_eval(node)
+    if not isinstance(value, int):
+        raise ValueError("Not a flags value.")
+    return value
+
+
+def parse_plugin_info(source, class_name):
+    """
+    Return the plugin attributes assigned in the body of a class, as far as
+    they can be evaluated statically.
+    """
+    tree = ast.parse(source)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            break
+    else:
+        return {}
+
+    info = {}
+    for stmt in node.body:
+        if not isinstance(stmt, ast.Assign):
+            continue
+        for target in stmt.targets:
+            if not isinstance(target, ast.Name) or target.id not in PLUGIN_INFO_ATTRS:
+                continue
+            try:
+                if target.id == "flags":
+                    info["flags"] = eval_flags(stmt.value)
+                else:
+                    value = ast.literal_eval(stmt.value)
+                    if isinstance(value, str):
+                        info[target.id] = value
+            except (KeyError, ValueError):
+                pass
+    return info
+
+
+def plugin_info(module, attr):
+    """
+    Return the statically known plugin attributes of an entry point, or an
+    empty mapping if its source can't be found.
+    """
+    path = find_module_path(module)
+    if path is None or not attr or "." in attr:
+        return {}
+    with open(path, "rb") as f:
+        source = f.read()
+    try:
+        return parse_plugin_info(source, attr)
+    except SyntaxError:
+        return {}
+
+
+def read_module_tree(module):
+    "Parse the source of a module, or return None if it can't be found."
+    path = find_module_path(module)
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        source = f.read()
+    try:
+        # Parsed as on Python 3 so plain string literals are text on Python 2
+        # too, and can be told apart from bytes literals.
+        return compile(
+            source,
+            path,
+            "exec",
+            ast.PyCF_ONLY_AST | __future__.unicode_literals.compiler_flag,
+        )
+    except SyntaxError:
+        return None
+
+
+def module_constant(module, name):
+    """
+    Return the literal value assigned to a module-level name.  Raises
+    ValueError if there is no such assignment or it isn't a literal.
+    """
+    tree = read_module_tree(module)
+    if tree is None:
+        raise ValueError("Source of %s not found." % module)
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == name
+            for target in stmt.targets
+        ):
+            return ast.literal_eval(stmt.value)
+    raise ValueError("%s.%s is not assigned a literal." % (module, name))
+
+
+def module_functions(module):
+    """
+    Return the names of the functions defined at the top level of a module,
+    or None if its source can't be found.
+    """
+    tree = read_module_tree(module)
+    if tree is None:
+        return None
+    return set(stmt.name for stmt in tree.body if isinstance(stmt, ast.FunctionDef))
+
+
+def normalize_loader_filters(spec):
+    """
+    Validate a loader filter declaration and convert it to a list of
+    (offset, hex magic, extensions) tuples.
+
+    A declaration is a dict, or list of dicts, with any of the keys "magic"
+    (bytes, or a hex string), "offset" (of the magic, default 0) and
+    "extensions" (file extensions).  A file matches a filter if it satisfies
+    every condition given; it is passed to the loader if it matches any
+    filter.
+    """
+    if isinstance(spec, dict):
+        spec = [spec]
+    if not isinstance(spec, (list, tuple)) or not spec:
+        raise ValueError("Loader filters must be a dict or a list of dicts.")
+
+    filters = []
+    for item in spec:
+        if not isinstance(item, dict):
+            raise ValueError("Loader filters must be a dict or a list of dicts.")
+        unknown = set(item) - set(["magic", "offset", "extensions"])
+        if unknown:
+            raise ValueError("Unknown loader filter keys: %s" % ", ".join(unknown))
+
+        magic = item.get("magic", b"")
+        if isinstance(magic, text_type):
+            magic = magic.lower()
+            try:
+                binascii.unhexlify(magic.encode("ascii"))
+            except (TypeError, ValueError, binascii.Error):
+                raise ValueError("Invalid loader filter magic: %r" % (magic,))
+        elif isinstance(magic, bytes):
+            magic = binascii.hexlify(magic).decode("ascii")
+        else:
+            raise ValueError("Invalid loader filter magic: %r" % (magic,))
+
+        offset = item.get("offset", 0)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Invalid loader filter offset: %r" % (offset,))
+
+        extensions = item.get("extensions", ())
+        if isinstance(extensions, (text_type, str)):
+            extensions = [extensions]
+        extensions = tuple(
+            sorted(("." + ext.lstrip(".")).lower() for ext in extensions)
+        )
+
+        if not magic and not extensions:
+            raise ValueError("Loader filter without magic or extensions.")
+        filters.append((offset, magic, extensions))
+    return filters
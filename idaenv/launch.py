@@ -0,0 +1,76 @@
+"""
+Environment for launching IDA with an idaenv prefix.
+
+`idaenv update` writes the settings run-ida.sh needs to a shell script in the
+prefix, so launching IDA doesn't require starting Python to look them up.
+"""
+import os
+import sysconfig
+
+from .utils import atomic_write
+
+
+ENV_FILE_NAME = "idaenv.env"
+
+
+def get_libpython():
+    "Return the path of the shared libpython, or None if there isn't one."
+    libpl = sysconfig.get_config_var("LIBPL")
+    ldlibrary = sysconfig.get_config_var("LDLIBRARY")
+    if not libpl or not ldlibrary:
+        return None
+    return "%s/%s" % (libpl, ldlibrary)
+
+
+def shell_quote(value):
+    return "'%s'" % value.replace("'", "'\"'\"'")
+
+
+def format_env_file(user_dir, venv=None):
+    "Return a shell script that sets up the environment for IDA."
+    lines = ["# Generated by idaenv; sourced by run-ida.sh."]
+    if venv is not None:
+        # Equivalent to bin/activate
+        bin_dir = os.path.join(venv, "Scripts" if os.name == "nt" else "bin")
+        lines.append("export VIRTUAL_ENV=%s" % shell_quote(venv))
+        lines.append('export PATH=%s:"$PATH"' % shell_quote(bin_dir))
+        lines.append("unset PYTHONHOME")
+
+    lines.append('export IDAUSR="$HOME/.idapro":%s' % shell_quote(user_dir))
+
+    libpython = get_libpython()
+    if libpython is not None:
+        lines.append("export LIBPYTHON=%s" % shell_quote(libpython))
+    return "\n".join(lines) + "\n"
+
+
+def write_env_file(user_dir, venv=None):
+    "Write the environment script to the prefix and return its path."
+    path = os.path.join(user_dir, ENV_FILE_NAME)
+    atomic_write(path, format_env_file(user_dir, venv).encode("utf8"))
+    return path
+
+
+def launch_environ(user_dir, venv=None, environ=None):
+    """
+    Return the environment variables for running IDA, as set up by
+    run-ida.sh: the virtualenv, IDAUSR and a preloaded libpython.
+    """
+    environ = dict(os.environ if environ is None else environ)
+    if venv is not None:
+        bin_dir = os.path.join(venv, "Scripts" if os.name == "nt" else "bin")
+        environ["VIRTUAL_ENV"] = venv
+        environ["PATH"] = os.pathsep.join([bin_dir, environ.get("PATH", "")])
+        environ.pop("PYTHONHOME", None)
+
+    default_usr = os.path.join(os.path.expanduser("~"), ".idapro")
+    environ["IDAUSR"] = os.pathsep.join([default_usr, user_dir])
+
+    libpython = get_libpython()
+    if (
+        libpython is not None
+        and os.path.isfile(libpython)
+        and os.path.isfile("/lib64/ld-linux-x86-64.so.2")
+    ):
+        environ["LD_PRELOAD"] = libpython
+    return environ
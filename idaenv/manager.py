@@ -3,14 +3,41 @@ from __future__ import print_function
 import re
 import ast
 import os
+import time
+import errno
+import shutil
+import fnmatch
 import hashlib
 
+from . import cache
+from . import config
+from . import compiling
+from . import manifest
+from . import launch
+from . import introspect
 from . import entrypoints
-from .utils import get_virtualenv_path, get_default_ida_usr
+from . import trace
+from . import sandbox
+from .utils import (
+    FileLock,
+    find_module_path,
+    get_default_user_dir,
+    get_virtualenv_path,
+    link_tree,
+    replace_file,
+    site_paths,
+    supports_symlinks,
+)
 
 
 MODULE_TYPES = {"plugins", "loaders", "procs"}
 
+# Entry points naming the filter declarations of lazily imported loaders
+LOADER_FILTER_GROUP = "idapython_loader_filters"
+
+# Profile used until another one is selected
+DEFAULT_PROFILE = "default"
+
 
 PLUGIN_TEMPLATE = """
 # EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
@@ -21,6 +48,54 @@ def PLUGIN_ENTRY():
     return %(attr)s()
 """
 
+LAZY_PLUGIN_TEMPLATE = """
+# EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
+
+import idaapi
+
+
+class LazyPlugin(idaapi.plugin_t):
+    "Stand-in that imports %(module)s the first time the plugin is run."
+
+    flags = %(flags)d
+    wanted_name = %(wanted_name)r
+    wanted_hotkey = %(wanted_hotkey)r
+    comment = %(comment)r
+    help = %(help)r
+
+    def __init__(self):
+        idaapi.plugin_t.__init__(self)
+        self.plugin = None
+        self.runner = None
+
+    def load(self):
+        if self.plugin is None:
+            from %(module)s import %(attr)s
+
+            self.plugin = %(attr)s()
+            result = self.plugin.init()
+            if result == idaapi.PLUGIN_SKIP:
+                return None
+            self.runner = result if hasattr(result, "run") else self.plugin
+        return self.runner
+
+    def init(self):
+        return idaapi.PLUGIN_KEEP
+
+    def run(self, arg):
+        runner = self.load()
+        if runner is not None:
+            return runner.run(arg)
+
+    def term(self):
+        if self.runner is not None and hasattr(self.runner, "term"):
+            self.runner.term()
+
+
+def PLUGIN_ENTRY():
+    return LazyPlugin()
+"""
+
 PROC_TEMPLATE = """
 # EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
 
@@ -35,6 +110,196 @@ from %(module)s import *
 """
 
 
+LAZY_LOADER_TEMPLATE = """
+# EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
+
+import os
+import binascii
+
+# (offset, magic, extensions) filters; %(module)s is only imported for files
+# matching one of them.
+FILTERS = %(filters)r
+
+
+def matches(li, filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    for offset, magic, extensions in FILTERS:
+        if extensions and ext not in extensions:
+            continue
+        if magic:
+            magic = binascii.unhexlify(magic)
+            li.seek(offset)
+            if li.read(len(magic)) != magic:
+                continue
+        return True
+    return False
+
+
+def accept_file(li, filename):
+    if not matches(li, filename):
+        return 0
+    li.seek(0)
+    from %(module)s import accept_file
+
+    return accept_file(li, filename)
+
+
+def load_file(li, neflags, format):
+    from %(module)s import load_file
+
+    return load_file(li, neflags, format)
+%(delegates)s"""
+
+
+LAZY_LOADER_DELEGATE = """
+
+def %(function)s(*args):
+    from %(module)s import %(function)s
+
+    return %(function)s(*args)
+"""
+
+# Variants of the templates that record load times (see runtime.py)
+INSTRUMENTED_PLUGIN_TEMPLATE = """
+# EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
+
+import time
+
+from idaenv import runtime
+
+_user_dir = runtime.wrapper_user_dir(__file__)
+_start = time.time()
+from %(module)s import %(attr)s
+
+runtime.record(_user_dir, "import", %(module_name)r, time.time() - _start)
+
+
+def PLUGIN_ENTRY():
+    start = time.time()
+    plugin = %(attr)s()
+    runtime.record(_user_dir, "entry", %(module_name)r, time.time() - start)
+    return runtime.instrument_plugin(_user_dir, %(module_name)r, plugin)
+"""
+
+INSTRUMENTED_MODULE_TEMPLATE = """
+# EntryPointInfo(%(dist)r, %(group)r, %(name)r, %(module)r, %(attr)r)
+
+# Aliased so the names exported by %(module)s can't shadow them
+import time as _idaenv_time
+from idaenv import runtime as _idaenv_runtime
+
+_idaenv_user_dir = _idaenv_runtime.wrapper_user_dir(__file__)
+_idaenv_start = _idaenv_time.time()
+from %(module)s import *
+
+_idaenv_runtime.record(
+    _idaenv_user_dir, "import", %(module_name)r, _idaenv_time.time() - _idaenv_start
+)
+"""
+
+# Plugin file importing shared dependencies in the background.  The name sorts
+# before the wrappers and doesn't match wrapper_rx.
+BOOTSTRAP_NAME = "00_idaenv_bootstrap.py"
+
+BOOTSTRAP_TEMPLATE = """
+# Generated by idaenv.  Prepares IDA's interpreter for the plugin wrappers,
+# which are loaded after this file.  Loaders and processor modules can be
+# loaded before any plugin, e.g. when IDA opens a new file, so they may run
+# before this setup.
+
+import sys
+
+import idaapi
+%(sections)s
+
+class BootstrapPlugin(idaapi.plugin_t):
+    flags = idaapi.PLUGIN_HIDE
+    wanted_name = "idaenv bootstrap"
+    wanted_hotkey = ""
+    comment = ""
+    help = ""
+
+    def init(self):
+        return idaapi.PLUGIN_SKIP
+
+    def run(self, arg):
+        pass
+
+    def term(self):
+        pass
+
+
+def PLUGIN_ENTRY():
+    return BootstrapPlugin()
+"""
+
+BOOTSTRAP_PATH_SECTION = """
+# The import path resolved by `idaenv update`, so the virtualenv's .pth files
+# don't need to be processed.
+PATHS = %(paths)r
+
+for _path in PATHS:
+    if _path not in sys.path:
+        sys.path.append(_path)
+"""
+
+BOOTSTRAP_INDEX_SECTION = """
+import os
+
+# Locations of the entry point packages, found without probing every
+# directory on sys.path.
+INDEX = %(index)r
+
+
+class IndexFinder(object):
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        location = INDEX.get(fullname)
+        # Uninstalled since the update: fall back to the regular search.
+        if path is not None or location is None or not os.path.isfile(location):
+            return None
+        import importlib.util
+
+        if os.path.basename(location) != "__init__.py":
+            return importlib.util.spec_from_file_location(fullname, location)
+        return importlib.util.spec_from_file_location(
+            fullname, location, submodule_search_locations=[os.path.dirname(location)]
+        )
+
+
+if sys.version_info >= (3, 4):
+    sys.meta_path.insert(0, IndexFinder)
+"""
+
+BOOTSTRAP_PREWARM_SECTION = """
+import threading
+
+# Modules used by several plugins, imported on a background thread to overlap
+# their cost with IDA loading the remaining plugins.  The import system's
+# module locks make a plugin importing one of them on the main thread wait for
+# the background import to finish.
+MODULES = %(modules)r
+
+
+def prewarm():
+    for name in MODULES:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+
+
+# Python 2 has a global import lock, which would block the main thread.
+if sys.version_info[0] >= 3:
+    _thread = threading.Thread(target=prewarm, name="idaenv-prewarm")
+    _thread.daemon = True
+    _thread.start()
+"""
+
+# Optional loader callbacks, only defined by the wrapper if the loader has them
+LOADER_OPTIONAL_FUNCTIONS = ("save_file", "move_segm", "process_archive")
+
+
 class PluginManager(object):
     """
     IDAPython plugin manager.
@@ -46,15 +311,45 @@ class PluginManager(object):
         "loaders": LOADER_TEMPLATE,
     }
 
+    instrumented_template_map = {
+        "plugins": INSTRUMENTED_PLUGIN_TEMPLATE,
+        "procs": INSTRUMENTED_MODULE_TEMPLATE,
+        "loaders": INSTRUMENTED_MODULE_TEMPLATE,
+    }
+
     wrapper_rx = r"^[a-zA-Z][a-zA-Z0-9_]*_[0-9a-fA-F]+\.py$"
 
-    def __init__(self, user_dir):
+    def __init__(self, user_dir, use_cache=True, full_rescan=False, compile=True):
         self.user_dir = user_dir
+        self.use_cache = use_cache
+        self.full_rescan = full_rescan
+        self.compile = compile
+        # Generations written by this manager are stamped with the time it was
+        # created, so rollback can tell which module types an operation changed.
+        self.operation = repr(time.time())
         self.initialize_user_dir(self.user_dir)
+        self._lock = FileLock(os.path.join(self.user_dir, "update.lock"))
 
-        # XXX: Doing this here is a bit of a hack; pkg_resources needs to be
-        # re-initialized whenever a module is installed or removed.
-        entrypoints.refresh_entrypoint_caches()
+        # Installed entry points for every module type, scanned on first use.
+        self._entry_point_index = None
+
+        # Distributions re-read by the last scan, and for a full rescan the
+        # entry points the incremental scan got wrong.
+        self.dist_changes = None
+        self.stale_entry_points = None
+
+        # Versions of the distributions providing entry points, by key
+        self.dist_versions = {}
+
+        # Sources that failed to byte-compile, mapped to the error
+        self.compile_errors = {}
+
+        # Wrapper manifest and settings, loaded on first use.
+        self._manifest = None
+        self._config = None
+
+        # Lazy loader settings by entry point, read from package sources.
+        self._lazy_loader_info = {}
 
     def initialize_user_dir(self, user_dir):
         if not user_dir:
@@ -65,42 +360,96 @@ class PluginManager(object):
 
         for module_type in MODULE_TYPES:
             subdir_path = self.wrapper_dir(module_type)
-            if not os.path.isdir(subdir_path):
+            if os.path.isdir(subdir_path):
+                continue
+            if supports_symlinks():
+                self.activate_generation(module_type, self.new_generation(module_type))
+            else:
                 os.mkdir(subdir_path)
 
+    def locked(self):
+        """
+        Return a context manager that serializes changes to the user directory
+        across processes.
+        """
+        return self._lock
+
     def update_plugins(self):
         "Update the list of installed IDA plugins and wrapper files."
         # Update module wrappers
-        for module_type in MODULE_TYPES:
-            plan = self.plan_update(module_type)
-            self.execute_update(module_type, plan)
+        with self.locked():
+            for module_type in MODULE_TYPES:
+                plan = self.plan_update(module_type)
+                self.execute_update(module_type, plan)
+            self.write_launch_env()
+
+    def plan_changes(self, plan):
+        "Check whether executing a plan would change any files."
+        return any(
+            plan.get(k) for k in ["create", "delete", "rewrite", "upgrade", "bootstrap"]
+        )
+
+    def write_launch_env(self):
+        "Write the environment script used by run-ida.sh."
+        return launch.write_env_file(self.user_dir, get_virtualenv_path())
 
     def find_module_wrapper(self, module_type, module_name):
         "Locate a module wrapper by name."
-        wrapper_dir = self.wrapper_dir(module_type)
-        wrappers = self.find_wrappers(wrapper_dir)
+        wrappers = self.load_wrappers(module_type)
         for ep, wrapper_path in wrappers:
             if "%s.%s" % (ep.dist, ep.name) == module_name:
                 return (ep, wrapper_path)
 
     def plan_delete(self, wrappers):
-        return {"create": [], "delete": list(wrappers)}
+        return {"create": [], "delete": list(wrappers), "rewrite": [], "upgrade": []}
 
     def plan_update(self, module_type):
         "Plan actions for synchronization."
         if module_type not in MODULE_TYPES:
             raise ValueError("Invalid module type: %r" % module_type)
 
-        # Scan installed modules
-        cur_modules = self.find_installed_modules(module_type)
+        with trace.phase("plan update"):
+            return self.compute_plan(module_type)
+
+    def compute_plan(self, module_type):
+        # Scan installed modules, leaving out those disabled by the profile
+        installed = self.find_installed_modules(module_type)
+        enabled = set(ep for ep in installed if self.is_enabled(ep))
+
+        # Quarantined modules stay inactive until their distribution changes
+        quarantined = self.quarantined(module_type)
+        cur_modules = set(ep for ep in enabled if ep not in quarantined)
 
         # Scan installed wrappers
-        wrapper_dir = self.wrapper_dir(module_type)
-        wrappers = self.find_wrappers(wrapper_dir)
+        wrappers = self.load_wrappers(module_type)
         wrapper_set = set(ep for ep, _ in wrappers)
+        digests = self.wrapper_digests(module_type)
+
+        # Rewrite wrappers whose contents differ from the current template
+        to_rewrite = [
+            (ep, path)
+            for ep, path in wrappers
+            if ep in cur_modules
+            and digests[path] != self.wrapper_digest(module_type, ep)
+        ]
+        rewrite_set = set(ep for ep, _ in to_rewrite)
+
+        # Record the new version of upgraded distributions and recompile them
+        records = self.wrapper_section(module_type)["wrappers"]
+        to_upgrade = [
+            (ep, path)
+            for ep, path in wrappers
+            if ep in cur_modules
+            and ep not in rewrite_set
+            and records[os.path.basename(path)]["version"]
+            != self.dist_versions.get(ep.dist, "")
+        ]
+        changed_set = rewrite_set | set(ep for ep, _ in to_upgrade)
 
         # Active modules don't need a change
-        active_modules = [ep for ep in cur_modules if ep in wrapper_set]
+        active_modules = [
+            ep for ep in cur_modules if ep in wrapper_set and ep not in changed_set
+        ]
 
         # Delete wrappers for uninstalled modules
         to_delete = [(ep, path) for ep, path in wrappers if ep not in cur_modules]
@@ -108,39 +457,855 @@ class PluginManager(object):
         # Create wrappers for new modules
         to_create = [ep for ep in cur_modules if ep not in wrapper_set]
 
-        return {"active": active_modules, "delete": to_delete, "create": to_create}
+        return {
+            "active": active_modules,
+            "delete": to_delete,
+            "create": to_create,
+            "rewrite": to_rewrite,
+            "upgrade": to_upgrade,
+            "disabled": sorted(installed - enabled),
+            "quarantine": sorted(
+                (ep, quarantined[ep]["error"]) for ep in enabled if ep in quarantined
+            ),
+            "bootstrap": module_type == "plugins" and self.bootstrap_outdated(),
+        }
 
     def execute_update(self, module_type, changes):
+        """
+        Apply planned changes.  Where symlinks are available, the changes are
+        made to a copy of the wrapper directory, which then replaces it with a
+        single rename so IDA never sees a partially updated set of wrappers.
+        Plans without changes leave the wrappers, and generations, alone.
+        """
+        if not self.plan_changes(changes):
+            return
+        changed = changes.get("rewrite", []) + changes.get("upgrade", [])
+        activated = changes["create"] + [ep for ep, _ in changed]
+        with self.locked(), trace.phase("execute update"):
+            section = self.wrapper_section(module_type)
+            if supports_symlinks():
+                with trace.phase("copy generation"):
+                    dst_dir = self.new_generation(module_type)
+            else:
+                dst_dir = self.wrapper_dir(module_type)
+
+            with trace.phase("write wrappers"):
+                self.apply_changes(module_type, dst_dir, changes, section["wrappers"])
+                self.release_quarantine(module_type, activated)
+            with trace.phase("compile"):
+                self.compile_changes(dst_dir, changes)
+
+            if supports_symlinks():
+                with trace.phase("activate generation"):
+                    self.activate_generation(module_type, dst_dir)
+
+            with trace.phase("save manifest"):
+                section["mtime"] = self.wrapper_dir_mtime(module_type)
+                manifest.save_manifest(self.manifest_path(), self._manifest)
+
+    def apply_changes(self, module_type, dst_dir, changes, records):
+        "Delete and write wrappers in dst_dir, updating manifest records."
         # Delete uninstalled modules
         for ep, wrapper_path in changes["delete"]:
-            os.remove(wrapper_path)
+            name = os.path.basename(wrapper_path)
+            try:
+                os.remove(os.path.join(dst_dir, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            records.pop(name, None)
+
+        # Create new wrappers and rewrite outdated ones
+        for ep in changes["create"] + [ep for ep, _ in changes.get("rewrite", [])]:
+            dst_path, digest = self.write_entry_point_wrapper(module_type, ep, dst_dir)
+            records[os.path.basename(dst_path)] = {
+                "entry_point": ep,
+                "digest": digest,
+                "template": self.template_version(module_type, ep),
+                "version": self.dist_versions.get(ep.dist, ""),
+            }
+
+        # Wrappers of upgraded distributions are unchanged
+        for ep, wrapper_path in changes.get("upgrade", []):
+            record = records[os.path.basename(wrapper_path)]
+            record["version"] = self.dist_versions.get(ep.dist, "")
+
+        if changes.get("bootstrap"):
+            self.write_bootstrap(dst_dir)
+
+    def compile_changes(self, dst_dir, changes):
+        """
+        Byte-compile the wrappers written to dst_dir and the packages of their
+        entry points, so IDA doesn't compile them on every launch.
+        """
+        eps = changes["create"] + [
+            ep for ep, _ in changes.get("rewrite", []) + changes.get("upgrade", [])
+        ]
+        if not self.compile or not eps:
+            return
+
+        paths = [os.path.join(dst_dir, self.wrapper_name(ep)) for ep in eps]
+        for module in sorted(set(ep.module for ep in eps)):
+            root = compiling.package_root(module)
+            if root is not None:
+                paths.append(root)
+        self.compile_errors.update(compiling.compile_sources(paths))
+
+    def generations_dir(self):
+        return os.path.join(self.user_dir, "generations")
+
+    def generation_path(self, module_type, number):
+        return os.path.join(self.generations_dir(), "%s-%d" % (module_type, number))
+
+    def generation_operation(self, gen_dir):
+        "Return the stamp of the operation that created a generation, or None."
+        try:
+            with open(gen_dir + ".stamp", "r") as f:
+                return f.read().strip() or None
+        except (IOError, OSError):
+            return None
+
+    def list_generations(self, module_type):
+        "Return the generation numbers of a module type in ascending order."
+        gen_rx = r"^%s-([0-9]+)$" % re.escape(module_type)
+        try:
+            names = os.listdir(self.generations_dir())
+        except OSError:
+            return []
+        return sorted(
+            int(m.group(1)) for m in (re.match(gen_rx, n) for n in names) if m
+        )
+
+    def new_generation(self, module_type):
+        "Create a new generation directory holding the current wrappers."
+        if not os.path.isdir(self.generations_dir()):
+            os.mkdir(self.generations_dir())
+
+        number = max(self.list_generations(module_type) + [0]) + 1
+        gen_dir = self.generation_path(module_type, number)
+        wrapper_dir = self.wrapper_dir(module_type)
+        if os.path.isdir(wrapper_dir):
+            link_tree(os.path.realpath(wrapper_dir), gen_dir)
+        else:
+            os.mkdir(gen_dir)
+        # Next to the generation, where IDA won't try to load it
+        with open(gen_dir + ".stamp", "w") as f:
+            f.write(self.operation)
+        return gen_dir
+
+    def activate_generation(self, module_type, gen_dir):
+        """
+        Point the wrapper directory of a module type at a generation.  The
+        generation it replaces is kept for rollback; older ones are removed.
+        """
+        wrapper_dir = self.wrapper_dir(module_type)
+        previous = os.path.realpath(wrapper_dir)
+        if os.path.isdir(wrapper_dir) and not os.path.islink(wrapper_dir):
+            # Adopt a wrapper directory created before generations were used.
+            previous = self.generation_path(module_type, 0)
+            os.rename(wrapper_dir, previous)
 
-        # Create new wrappers
-        for ep in changes["create"]:
-            self.write_entry_point_wrapper(module_type, ep)
+        tmp_link = os.path.join(self.user_dir, ".%s.tmp" % module_type)
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.relpath(gen_dir, self.user_dir), tmp_link)
+        replace_file(tmp_link, wrapper_dir)
 
-    def write_entry_point_wrapper(self, module_type, ep_info):
-        "Create a wrapper file for IDA."
-        wrapper = self.template_map[module_type] % ep_info._asdict()
+        keep = set([os.path.realpath(gen_dir), previous])
+        for number in self.list_generations(module_type):
+            path = self.generation_path(module_type, number)
+            if os.path.realpath(path) not in keep:
+                shutil.rmtree(path)
+                if os.path.exists(path + ".stamp"):
+                    os.remove(path + ".stamp")
+
+    def rollback(self, module_type):
+        """
+        Switch a module type back to the previous generation of wrappers.
+        Returns False if there is nothing to roll back to.
+        """
+        with self.locked():
+            current = os.path.realpath(self.wrapper_dir(module_type))
+            others = [
+                self.generation_path(module_type, number)
+                for number in self.list_generations(module_type)
+                if os.path.realpath(self.generation_path(module_type, number))
+                != current
+            ]
+            if not others:
+                return False
+            records = self.wrapper_section(module_type)["wrappers"]
+            self.activate_generation(module_type, others[-1])
+            self.refresh_wrapper_section(module_type, records)
+            return True
+
+    def rollback_last(self):
+        """
+        Roll back the module types changed by the most recent operation, so
+        all of them return to the state before it.  Returns the module types
+        that were rolled back.
+        """
+        with self.locked():
+            stamps = dict(
+                (t, self.generation_operation(os.path.realpath(self.wrapper_dir(t))))
+                for t in MODULE_TYPES
+                if os.path.islink(self.wrapper_dir(t))
+            )
+            known = [stamp for stamp in stamps.values() if stamp is not None]
+            if known:
+                # The stamps are times, compared as numbers.
+                last = max(known, key=float)
+                module_types = [t for t, stamp in stamps.items() if stamp == last]
+            else:
+                # Generations from before stamps were written
+                module_types = list(stamps)
+            return sorted(t for t in module_types if self.rollback(t))
 
-        dst_path = os.path.join(
-            self.wrapper_dir(module_type), self.wrapper_name(ep_info)
+    def refresh_wrapper_section(self, module_type, old_records):
+        """
+        Rebuild the manifest section of a module type after its wrapper
+        directory was switched, keeping the distribution versions of the old
+        records for wrappers that are unchanged.
+        """
+        section = self.scan_wrapper_section(module_type)
+        for name, record in section["wrappers"].items():
+            old = old_records.get(name)
+            if old is not None and old["digest"] == record["digest"]:
+                record["version"] = old["version"]
+        self._manifest[module_type] = section
+        manifest.save_manifest(self.manifest_path(), self._manifest)
+
+    def wrapper_template(self, module_type, ep_info):
+        "Return the template used for the wrapper of an entry point."
+        if self.lazy_plugin_info(module_type, ep_info) is not None:
+            return LAZY_PLUGIN_TEMPLATE
+        if self.lazy_loader_info(module_type, ep_info) is not None:
+            return LAZY_LOADER_TEMPLATE
+        if self.instrumented():
+            return self.instrumented_template_map[module_type]
+        return self.template_map[module_type]
+
+    def render_wrapper(self, module_type, ep_info):
+        "Return the contents of the wrapper file for an entry point."
+        values = ep_info._asdict()
+        lazy_info = self.lazy_plugin_info(module_type, ep_info)
+        if lazy_info is not None:
+            values.update(lazy_info)
+        lazy_info = self.lazy_loader_info(module_type, ep_info)
+        if lazy_info is not None:
+            values.update(lazy_info)
+        values["module_name"] = "%s.%s" % (ep_info.dist, ep_info.name)
+        return self.wrapper_template(module_type, ep_info) % values
+
+    def wrapper_digest(self, module_type, ep_info):
+        "Return the digest of the wrapper that would be written for an entry point."
+        return manifest.content_digest(self.render_wrapper(module_type, ep_info))
+
+    def wrapper_digests(self, module_type):
+        "Return a mapping of wrapper path to the digest of its contents."
+        wrapper_dir = self.wrapper_dir(module_type)
+        records = self.wrapper_section(module_type)["wrappers"]
+        return dict(
+            (os.path.join(wrapper_dir, name), record["digest"])
+            for name, record in records.items()
+        )
+
+    def write_entry_point_wrapper(self, module_type, ep_info, dst_dir=None):
+        """
+        Create a wrapper file for IDA, by default in the wrapper directory of
+        the module type.  Returns the path of the wrapper and the digest of
+        its contents.
+
+        An existing file with identical contents is left untouched, so its
+        mtime and any cached bytecode stay valid.
+        """
+        wrapper = self.render_wrapper(module_type, ep_info)
+        digest = manifest.content_digest(wrapper)
+
+        name = self.wrapper_name(ep_info)
+        dst_path = os.path.join(dst_dir or self.wrapper_dir(module_type), name)
+        if os.path.exists(dst_path):
+            if manifest.file_digest(dst_path) == digest:
+                return dst_path, digest
+            # May be hard linked into another generation.
+            os.remove(dst_path)
+
+        print(
+            "Writing wrapper to %r..."
+            % os.path.join(self.wrapper_dir(module_type), name)
         )
-        print("Writing wrapper to %r..." % dst_path)
         with open(dst_path, "w") as wf:
             wf.write(wrapper)
+        if trace.enabled:
+            trace.count(files=1, written=len(wrapper))
+        return dst_path, digest
+
+    def render_bootstrap(self):
+        "Return the contents of the bootstrap plugin, or None if it's unused."
+        sections = []
+        snapshot = self.get_config().get("path_snapshot")
+        if snapshot is not None:
+            paths = site_paths()
+            sections.append(BOOTSTRAP_PATH_SECTION % {"paths": paths})
+            if snapshot.get("index"):
+                index = self.module_index(paths)
+                sections.append(BOOTSTRAP_INDEX_SECTION % {"index": index})
+        modules = self.prewarm_modules()
+        if modules:
+            sections.append(BOOTSTRAP_PREWARM_SECTION % {"modules": modules})
+        if not sections:
+            return None
+        return BOOTSTRAP_TEMPLATE % {"sections": "".join(sections)}
+
+    def module_index(self, paths):
+        """
+        Return a mapping of the top-level packages of the installed entry
+        points to their source files on `paths`.
+        """
+        index = {}
+        for module_type in MODULE_TYPES:
+            for ep in self.find_installed_modules(module_type):
+                root = ep.module.split(".")[0]
+                if root not in index:
+                    location = find_module_path(root, paths)
+                    if location is not None:
+                        index[root] = location
+        return index
+
+    def bootstrap_outdated(self):
+        "Check whether the bootstrap plugin needs to be written or removed."
+        bootstrap = self.render_bootstrap()
+        path = os.path.join(self.wrapper_dir("plugins"), BOOTSTRAP_NAME)
+        if bootstrap is None or not os.path.exists(path):
+            return bootstrap is not None or os.path.exists(path)
+        return manifest.file_digest(path) != manifest.content_digest(bootstrap)
+
+    def write_bootstrap(self, dst_dir):
+        "Write the bootstrap plugin to dst_dir, or remove it if it's unused."
+        bootstrap = self.render_bootstrap()
+        dst_path = os.path.join(dst_dir, BOOTSTRAP_NAME)
+        if os.path.exists(dst_path):
+            # May be hard linked into another generation.
+            os.remove(dst_path)
+        if bootstrap is None:
+            return
+
+        print(
+            "Writing bootstrap to %r..."
+            % os.path.join(self.wrapper_dir("plugins"), BOOTSTRAP_NAME)
+        )
+        with open(dst_path, "w") as wf:
+            wf.write(bootstrap)
+        if trace.enabled:
+            trace.count(files=1, written=len(bootstrap))
+
+    def template_version(self, module_type, ep_info):
+        "Return an identifier for the current template of a wrapper."
+        template = self.wrapper_template(module_type, ep_info)
+        return manifest.content_digest(template)[:12]
+
+    def config_path(self):
+        return os.path.join(self.user_dir, "config.json")
+
+    def get_config(self):
+        if self._config is None:
+            self._config = config.load_config(self.config_path())
+        return self._config
+
+    def save_config(self):
+        config.save_config(self.config_path(), self.get_config())
+
+    def reload_config(self):
+        "Read the configuration again, as another process may have changed it."
+        self._config = None
+        return self.get_config()
+
+    def instrumented(self):
+        "Check whether wrappers record their load times (see runtime.py)."
+        return bool(self.get_config().get("instrument", False))
+
+    def set_instrumented(self, enable=True):
+        """
+        Enable or disable load time recording.  Wrappers are rewritten by the
+        next plan_update/execute_update.
+        """
+        self.get_config()["instrument"] = bool(enable)
+        self.save_config()
+
+    def set_path_snapshot(self, enable=True, index=False):
+        """
+        Make the bootstrap plugin set up sys.path, and optionally a module
+        index, as resolved by each update.  The bootstrap plugin is written by
+        the next plan_update/execute_update.
+        """
+        if enable:
+            self.get_config()["path_snapshot"] = {"index": bool(index)}
+        else:
+            self.get_config().pop("path_snapshot", None)
+        self.save_config()
+
+    def prewarm_modules(self):
+        "Return the modules imported in the background at IDA startup."
+        return list(self.get_config().get("prewarm", []))
+
+    def set_prewarm_modules(self, modules):
+        """
+        Set the modules imported in the background at IDA startup.  IDA
+        modules are left out, as they may only be used from the main thread.
+        The bootstrap plugin is written by the next plan_update/execute_update.
+        """
+        modules = [m for m in modules if not sandbox.is_stub_module(m)]
+        if modules:
+            self.get_config()["prewarm"] = modules
+        else:
+            self.get_config().pop("prewarm", None)
+        self.save_config()
+        return modules
+
+    def active_profile(self):
+        return self.get_config().get("profile", DEFAULT_PROFILE)
+
+    def list_profiles(self):
+        "Return the names of the stored profiles, including the active one."
+        names = set(self.get_config().get("profiles", {}))
+        names.add(self.active_profile())
+        return sorted(names)
+
+    def profile_rules(self, name=None):
+        """
+        Return the rules of a profile, by default the active one, as a list
+        of ("enable" or "disable", pattern) pairs.
+        """
+        profiles = self.get_config().get("profiles", {})
+        profile = profiles.get(name or self.active_profile(), {})
+        return [tuple(rule) for rule in profile.get("rules", [])]
+
+    def is_enabled(self, ep_info, rules=None):
+        """
+        Check whether the active profile, or the given rules, enable an entry
+        point.  The last rule whose glob pattern matches "dist.name" decides;
+        entry points matching no rule are enabled.
+        """
+        if rules is None:
+            rules = self.profile_rules()
+        module_name = "%s.%s" % (ep_info.dist, ep_info.name)
+        for action, pattern in reversed(rules):
+            if fnmatch.fnmatchcase(module_name, pattern):
+                return action == "enable"
+        return True
+
+    def add_profile_rules(self, action, patterns, name=None):
+        """
+        Enable or disable the entry points matching glob patterns in a
+        profile, by default the active one.
+        """
+        if action not in ("enable", "disable"):
+            raise ValueError("Invalid profile action: %r" % action)
+        with self.locked():
+            profiles = self.reload_config().setdefault("profiles", {})
+            profile = profiles.setdefault(name or self.active_profile(), {})
+            # A newer rule for the same pattern replaces the old one.
+            rules = [r for r in profile.get("rules", []) if r[1] not in patterns]
+            profile["rules"] = rules + [[action, pattern] for pattern in patterns]
+            self.save_config()
+
+    def plan_profile_change(self, module_type, old_rules):
+        """
+        Plan only the changes made by new profile rules: wrappers are created
+        for the entry points enabled since `old_rules` and deleted for those
+        disabled.  Outdated wrappers are left for the next full update.
+        """
+        installed = self.find_installed_modules(module_type)
+        quarantined = self.quarantined(module_type)
+        enabled = set(ep for ep in installed if self.is_enabled(ep))
+        was_enabled = set(ep for ep in installed if self.is_enabled(ep, old_rules))
+        toggled = enabled ^ was_enabled
+        wrappers = self.load_wrappers(module_type)
+        wrapper_set = set(ep for ep, _ in wrappers)
+        return {
+            "active": [],
+            "delete": [
+                (ep, path)
+                for ep, path in wrappers
+                if ep in toggled and ep not in enabled
+            ],
+            "create": sorted(
+                ep
+                for ep in toggled & enabled
+                if ep not in wrapper_set and ep not in quarantined
+            ),
+            "rewrite": [],
+            "upgrade": [],
+            "disabled": sorted(installed - enabled),
+            "quarantine": sorted(
+                (ep, quarantined[ep]["error"])
+                for ep in toggled & enabled
+                if ep in quarantined
+            ),
+        }
+
+    def use_profile(self, name, create=False):
+        """
+        Select the active profile.  The wrappers are only updated by the next
+        plan_update/execute_update.
+        """
+        with self.locked():
+            profiles = self.reload_config().setdefault("profiles", {})
+            if name not in self.list_profiles():
+                if not create:
+                    raise ValueError("No profile named %r." % name)
+                profiles[name] = {"rules": []}
+            self.get_config()["profile"] = name
+            self.save_config()
+
+    def delete_profile(self, name):
+        with self.locked():
+            if name == self.reload_config().get("profile", DEFAULT_PROFILE):
+                raise ValueError("Can't delete the active profile %r." % name)
+            if self.get_config().get("profiles", {}).pop(name, None) is None:
+                raise ValueError("No profile named %r." % name)
+            self.save_config()
+
+    def quarantine_path(self):
+        return os.path.join(self.user_dir, "quarantine.json")
+
+    def load_quarantine(self):
+        """
+        Return the entry points that failed verification, as a mapping of
+        (module type, entry point) to a record with the "error" and the
+        distribution "version".
+        """
+        data = config.load_config(self.quarantine_path())
+        quarantine = {}
+        for module_type, records in data.items():
+            for record in records:
+                ep = entrypoints.EntryPointInfo(*map(str, record["entry_point"]))
+                quarantine[(module_type, ep)] = {
+                    "error": record["error"],
+                    "version": record["version"],
+                }
+        return quarantine
+
+    def save_quarantine(self, quarantine):
+        data = {}
+        for (module_type, ep), record in sorted(quarantine.items()):
+            data.setdefault(module_type, []).append(dict(record, entry_point=ep))
+        config.save_config(self.quarantine_path(), data)
+
+    def quarantined(self, module_type):
+        """
+        Return the quarantined entry points of a module type, mapped to their
+        quarantine records.  Entry points whose distribution version changed
+        since they failed are no longer held back.
+        """
+        return dict(
+            (ep, record)
+            for (mtype, ep), record in self.load_quarantine().items()
+            if mtype == module_type
+            and record["version"] == self.dist_versions.get(ep.dist, "")
+        )
+
+    def release_quarantine(self, module_type, eps):
+        "Forget the quarantine records of entry points that were activated."
+        quarantine = self.load_quarantine()
+        released = [(module_type, ep) for ep in eps if (module_type, ep) in quarantine]
+        if released:
+            for key in released:
+                del quarantine[key]
+            self.save_quarantine(quarantine)
+
+    def verify_plans(self, plans, jobs=None, timeout=None):
+        """
+        Import the entry points of new, rewritten and upgraded wrappers in
+        sandboxes, and quarantine those that fail instead of activating them.
+
+        Entry points quarantined earlier are checked again.  Plans, a mapping
+        of module type to plan, are changed in place: failing entry points are
+        dropped from "create", their existing wrappers are deleted, and each
+        plan lists them in "quarantine" as (entry point, error) pairs, while
+        quarantined entry points that pass are created.  Quarantined entry
+        points missing from the plans, such as disabled ones, stay quarantined.
+        Returns the errors by (module type, entry point).
+        """
+        from . import verify
+
+        candidates = []
+        for module_type, plan in plans.items():
+            eps = plan["create"] + [ep for ep, _ in plan["rewrite"] + plan["upgrade"]]
+            eps += [ep for ep, _ in plan.get("quarantine", [])]
+            candidates.extend((module_type, ep) for ep in eps)
+        errors = verify.verify_entry_points(candidates, jobs, timeout)
+
+        for module_type, plan in plans.items():
+            failed = set(ep for mtype, ep in errors if mtype == module_type)
+            plan["create"] = [ep for ep in plan["create"] if ep not in failed]
+            plan["create"] += [
+                ep for ep, _ in plan.get("quarantine", []) if ep not in failed
+            ]
+            for key in ("rewrite", "upgrade"):
+                plan["delete"] += [(ep, path) for ep, path in plan[key] if ep in failed]
+                plan[key] = [(ep, path) for ep, path in plan[key] if ep not in failed]
+            plan["quarantine"] = sorted(
+                (ep, errors[(module_type, ep)]) for ep in failed
+            )
+
+        # Entry points that pass or were uninstalled are released.  Others,
+        # such as disabled ones, stay quarantined until they are checked.
+        checked = set(candidates)
+        quarantine = dict(
+            (key, record)
+            for key, record in self.load_quarantine().items()
+            if key not in checked
+            and (key[0] not in plans or key[1] in self.find_installed_modules(key[0]))
+        )
+        quarantine.update(
+            (
+                (module_type, ep),
+                {"error": error, "version": self.dist_versions.get(ep.dist, "")},
+            )
+            for (module_type, ep), error in errors.items()
+        )
+        self.save_quarantine(quarantine)
+        return errors
+
+    def lazy_plugin_info(self, module_type, ep_info):
+        """
+        Return the plugin attributes used by the lazy wrapper of an entry
+        point, or None if the entry point isn't loaded lazily.
+        """
+        if module_type != "plugins":
+            return None
+        lazy = self.get_config().get("lazy", {})
+        info = lazy.get("%s.%s" % (ep_info.dist, ep_info.name))
+        if info is None:
+            return None
+
+        values = {
+            "wanted_name": ep_info.name,
+            "wanted_hotkey": "",
+            "comment": "",
+            "help": "",
+            "flags": 0,
+        }
+        values.update(info)
+        # The stand-in is always a classic plugin.
+        values["flags"] &= ~introspect.PLUGIN_FLAGS["PLUGIN_MULTI"]
+        return values
+
+    def lazy_loader_info(self, module_type, ep_info):
+        """
+        Return the filters and callback delegates for the lazy wrapper of a
+        loader entry point, or None if the loader is imported eagerly.
+
+        Filters come from the "loader_filters" setting or from a literal named
+        by an idapython_loader_filters entry point of the same name.  Loaders
+        whose callbacks can't be found in their source are imported eagerly.
+
+        Filter entry points are only looked up once entry points were scanned,
+        so rendering a wrapper never starts a scan; until then, loaders
+        without a "loader_filters" setting are taken as eager.
+        """
+        if module_type != "loaders":
+            return None
+        if ep_info in self._lazy_loader_info:
+            return self._lazy_loader_info[ep_info]
+
+        module_name = "%s.%s" % (ep_info.dist, ep_info.name)
+        spec = self.get_config().get("loader_filters", {}).get(module_name)
+        if spec is None:
+            if self._entry_point_index is None:
+                return None
+            for filter_ep in self._entry_point_index.get(LOADER_FILTER_GROUP, ()):
+                if (filter_ep.dist, filter_ep.name) == (ep_info.dist, ep_info.name):
+                    try:
+                        spec = introspect.module_constant(
+                            filter_ep.module, filter_ep.attr
+                        )
+                    except ValueError as e:
+                        print("Warning: ignoring filters of %s: %s" % (module_name, e))
+                    break
+
+        info = None
+        functions = set()
+        if spec is not None:
+            # Only loaders with filters have their source read.
+            functions = introspect.module_functions(ep_info.module) or set()
+        if set(["accept_file", "load_file"]) <= functions:
+            try:
+                filters = introspect.normalize_loader_filters(spec)
+            except ValueError as e:
+                print("Warning: ignoring filters of %s: %s" % (module_name, e))
+            else:
+                delegates = "".join(
+                    LAZY_LOADER_DELEGATE % {"function": f, "module": ep_info.module}
+                    for f in LOADER_OPTIONAL_FUNCTIONS
+                    if f in functions
+                )
+                info = {"filters": filters, "delegates": delegates}
+
+        self._lazy_loader_info[ep_info] = info
+        return info
+
+    def set_lazy(self, ep_info, enable=True, **overrides):
+        """
+        Enable or disable lazy loading for a plugin entry point.  Plugin
+        attributes are captured from the plugin source now, so the wrapper
+        can be written without importing the plugin; overrides take
+        precedence.  Returns the stored attributes.
+        """
+        module_name = "%s.%s" % (ep_info.dist, ep_info.name)
+        lazy = self.get_config().setdefault("lazy", {})
+        if not enable:
+            lazy.pop(module_name, None)
+            self.save_config()
+            return None
+
+        info = introspect.plugin_info(ep_info.module, ep_info.attr)
+        info.update((k, v) for k, v in overrides.items() if v is not None)
+        lazy[module_name] = info
+        self.save_config()
+        return info
 
     def entry_point_name(self, module_type):
         return "idapython_" + module_type
 
     def find_installed_modules(self, module_type):
         entry_point_group = self.entry_point_name(module_type)
-        return set(entrypoints.iter_entry_point_info(entry_point_group))
+        return set(self.entry_point_index()[entry_point_group])
+
+    def entry_point_index(self):
+        """
+        Return a mapping of entry point group to installed entry points.  All
+        module types are collected in a single scan, which is shared by every
+        subsequent lookup.
+        """
+        if self._entry_point_index is None:
+            groups = [self.entry_point_name(t) for t in sorted(MODULE_TYPES)]
+            groups.append(LOADER_FILTER_GROUP)
+            with trace.phase("scan entry points"):
+                self._entry_point_index = self.load_entry_point_index(groups)
+        return self._entry_point_index
+
+    def load_entry_point_index(self, groups):
+        """
+        Scan installed entry points.  Only distributions that were added or
+        modified since the last run are read; the entry points of the others
+        come from the stored distribution records.
+        """
+        cache_path = self.entry_point_cache_path()
+        backend = entrypoints.get_backend()
+
+        records = {}
+        directories = {}
+        if self.use_cache:
+            records = cache.load_dist_records(cache_path, backend, groups, directories)
+        self.dist_versions = {}
+        index, records, self.dist_changes = cache.scan_distributions(
+            groups, records, versions=self.dist_versions, directories=directories
+        )
+
+        if self.full_rescan:
+            # Consistency check of the incremental scan against the backend.
+            # pkg_resources needs to be re-initialized whenever a module is
+            # installed or removed.
+            entrypoints.refresh_entrypoint_caches()
+            full_index = entrypoints.scan_entry_point_info(groups)
+            self.stale_entry_points = self.compare_indexes(index, full_index)
+            if self.stale_entry_points["missing"] or self.stale_entry_points["extra"]:
+                # Re-read every distribution for the stored records, but trust
+                # the backend for the index: the records can't describe
+                # distributions that find_distributions() doesn't know about.
+                self.dist_versions = {}
+                _, records, self.dist_changes = cache.scan_distributions(
+                    groups, {}, versions=self.dist_versions, directories=directories
+                )
+                index = full_index
+
+        try:
+            cache.save_dist_records(cache_path, backend, groups, records, directories)
+        except (IOError, OSError) as e:
+            print("Warning: unable to write entry point cache: %s" % e)
+        return index
+
+    def compare_indexes(self, index, full_index):
+        """
+        Compare an incrementally built entry point index to a full scan.
+        Returns the entry points "missing" from or "extra" in the index.
+        """
+        eps = set(ep for group in index.values() for ep in group)
+        full_eps = set(ep for group in full_index.values() for ep in group)
+        return {"missing": sorted(full_eps - eps), "extra": sorted(eps - full_eps)}
+
+    def entry_point_cache_path(self):
+        return os.path.join(self.user_dir, "entry_points.json")
 
     def wrapper_dir(self, module_type):
         "Return path to wrappers for a given module type."
         return os.path.join(self.user_dir, module_type)
 
+    def manifest_path(self):
+        return os.path.join(self.user_dir, "wrappers.json")
+
+    def wrapper_dir_mtime(self, module_type):
+        return os.stat(self.wrapper_dir(module_type)).st_mtime
+
+    def load_wrappers(self, module_type):
+        """
+        Return a list of (entry point, path) pairs for the installed wrappers
+        of a module type.  Wrapper files are only read when the wrapper
+        directory has changed since the manifest was written.
+        """
+        wrapper_dir = self.wrapper_dir(module_type)
+        records = self.wrapper_section(module_type)["wrappers"]
+        return [
+            (record["entry_point"], os.path.join(wrapper_dir, name))
+            for name, record in sorted(records.items())
+        ]
+
+    def fingerprint(self):
+        """
+        Return a digest of the installed wrappers and the list of wrapper
+        descriptions it was computed from.  Only the manifest is read.
+        """
+        return manifest.fingerprint(
+            dict((t, self.wrapper_section(t)) for t in MODULE_TYPES)
+        )
+
+    def wrapper_section(self, module_type):
+        "Return the up-to-date manifest section for a module type."
+        if self._manifest is None:
+            self._manifest = manifest.load_manifest(self.manifest_path())
+
+        section = self._manifest.get(module_type)
+        if section is None or section["mtime"] != self.wrapper_dir_mtime(module_type):
+            section = self.scan_wrapper_section(module_type)
+            self._manifest[module_type] = section
+            manifest.save_manifest(self.manifest_path(), self._manifest)
+        return section
+
+    def scan_wrapper_section(self, module_type):
+        "Rebuild the manifest section of a module type from the wrapper files."
+        mtime = self.wrapper_dir_mtime(module_type)
+        records = {}
+        with trace.phase("read wrappers"):
+            wrappers = self.find_wrappers(self.wrapper_dir(module_type))
+            digests = [(ep, path, manifest.file_digest(path)) for ep, path in wrappers]
+        for ep, path, digest in digests:
+            rendered = self.render_wrapper(module_type, ep)
+            if manifest.content_digest(rendered) == digest:
+                template = self.template_version(module_type, ep)
+            else:
+                template = ""
+            records[os.path.basename(path)] = {
+                "entry_point": ep,
+                "digest": digest,
+                "template": template,
+                # Unknown unless entry points were scanned; an update fills
+                # it in.
+                "version": self.dist_versions.get(ep.dist, ""),
+            }
+        return {"mtime": mtime, "wrappers": records}
+
     def find_wrappers(self, subdir):
         "Return a list of wrappers in a directory."
         wrappers = []
@@ -159,6 +1324,8 @@ class PluginManager(object):
         with open(path, "r") as f:
             # Wrappers generated by this manager will be small.
             content = f.read(4096)
+        if trace.enabled:
+            trace.count(files=1, read=len(content))
 
         m = re.search(r"EntryPointInfo(\(.*?\))", content)
         if m:
@@ -184,17 +1351,15 @@ class PluginManager(object):
         return "%s_%s_%s.py" % (dist_part, name_part, sha_part)
 
 
-def get_default_manager(require_venv=False):
+def get_default_manager(
+    require_venv=False, use_cache=True, full_rescan=False, compile=True
+):
     """
     Initialize a plugin manager based on the current environment.
     """
-    cur_env = get_virtualenv_path()
-    if cur_env:
-        ida_path = os.path.join(cur_env, "ida")
-    elif require_venv:
-        raise RuntimeError("Not in virtual environment.")
-    else:
-        print("Warning: operating outside of a virtual environment.")
-        ida_path = get_default_ida_usr()
-
-    return PluginManager(ida_path)
+    return PluginManager(
+        get_default_user_dir(require_venv),
+        use_cache=use_cache,
+        full_rescan=full_rescan,
+        compile=compile,
+    )
@@ -0,0 +1,89 @@
+"""
+Manifest of generated wrapper files.
+
+The manifest records the entry point, content digest, template version and
+distribution version of every wrapper written by idaenv, along with the mtime
+of the directory that holds them.  As long as the directory is unchanged,
+wrappers can be listed without opening any of them.
+"""
+import json
+import hashlib
+
+from . import trace
+from .entrypoints import EntryPointInfo
+from .utils import atomic_write
+
+
+MANIFEST_VERSION = 1
+
+
+def content_digest(data):
+    "Return the digest used to identify wrapper contents."
+    if not isinstance(data, bytes):
+        data = data.encode("utf8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if trace.enabled:
+        trace.count(files=1, read=len(data))
+    return content_digest(data)
+
+
+def load_manifest(path):
+    """
+    Return the manifest as a mapping of module type to a section with the
+    directory "mtime" and a "wrappers" mapping of file name to wrapper record.
+    A missing or unreadable manifest is returned as empty.
+    """
+    try:
+        with open(path, "r") as f:
+            text = f.read()
+        data = json.loads(text)
+    except (IOError, OSError, ValueError):
+        return {}
+    if trace.enabled:
+        trace.count(files=1, read=len(text))
+
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return {}
+
+    manifest = {}
+    for module_type, section in data.get("types", {}).items():
+        wrappers = {}
+        for name, record in section["wrappers"].items():
+            wrappers[str(name)] = {
+                "entry_point": EntryPointInfo(*map(str, record["entry_point"])),
+                "digest": str(record["digest"]),
+                "template": str(record["template"]),
+                "version": str(record.get("version", "")),
+            }
+        manifest[str(module_type)] = {"mtime": section["mtime"], "wrappers": wrappers}
+    return manifest
+
+
+def fingerprint(manifest):
+    """
+    Return a digest identifying the wrappers in a manifest, along with the
+    list of wrapper descriptions it was computed from.  The digest depends
+    only on the entry points, distribution versions and wrapper contents.
+    """
+    entries = []
+    for module_type, section in sorted(manifest.items()):
+        for record in section["wrappers"].values():
+            entry = dict(record["entry_point"]._asdict())
+            entry.update(
+                type=module_type, version=record["version"], digest=record["digest"]
+            )
+            entries.append(entry)
+    entries.sort(key=lambda e: (e["type"], e["dist"], e["group"], e["name"]))
+    data = json.dumps(entries, sort_keys=True, separators=(",", ":"))
+    return content_digest(data), entries
+
+
+def save_manifest(path, manifest):
+    # Entry points are namedtuples, which serialize as lists.
+    data = {"version": MANIFEST_VERSION, "types": manifest}
+    atomic_write(path, json.dumps(data, indent=1, sort_keys=True).encode("utf8"))
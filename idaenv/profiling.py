@@ -0,0 +1,117 @@
+"""
+Import cost of installed entry points.
+"""
+from __future__ import print_function
+
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from . import sandbox
+
+
+def profile_entry_point(ep, timeout=None, trace_memory=False, top=5):
+    "Import an entry point in a sandbox and summarize the cost."
+    result = sandbox.run_sandbox(
+        ep.module,
+        ep.attr,
+        timeout=timeout,
+        trace_memory=trace_memory,
+        importtime=True,
+    )
+    # All imports are listed if top is None.
+    imports = sorted(result.pop("imports", None) or [], key=lambda i: -i[1])
+    result.update(
+        {
+            "entry_point": "%s.%s" % (ep.dist, ep.name),
+            "group": ep.group,
+            "module": ep.module,
+            "attr": ep.attr,
+            "imports_available": sandbox.HAS_IMPORTTIME,
+            "import_count": len(imports) if sandbox.HAS_IMPORTTIME else None,
+            "top_imports": [
+                {"module": name, "self_us": self_us, "cumulative_us": cumulative_us}
+                for name, self_us, cumulative_us in imports[:top]
+            ],
+        }
+    )
+    return result
+
+
+def profile_entry_points(eps, jobs=None, timeout=None, trace_memory=False, top=5):
+    """
+    Profile entry points concurrently, one interpreter per entry point.
+    Results are sorted by decreasing import time.
+    """
+    eps = sorted(eps)
+    if not eps:
+        return []
+
+    def profile(ep):
+        return profile_entry_point(ep, timeout, trace_memory, top)
+
+    pool = ThreadPool(min(len(eps), jobs or multiprocessing.cpu_count()))
+    try:
+        results = pool.map(profile, eps)
+    finally:
+        pool.close()
+    return sorted(results, key=lambda r: -r.get("wall_time", 0))
+
+
+def shared_imports(results, min_entry_points=2, min_ms=5.0):
+    """
+    Find the top-level modules imported by several profiled entry points,
+    which are worth importing in the background at IDA startup.  `results`
+    are from profile_entry_points(..., top=None).  Returns module names,
+    most expensive first.
+    """
+    users = {}
+    for r in results:
+        own = r["module"].split(".")[0]
+        for imp in r["top_imports"]:
+            name = imp["module"]
+            if "." in name or name.startswith("_") or name == own:
+                continue
+            if sandbox.is_stub_module(name):
+                continue
+            users.setdefault(name, []).append(imp["cumulative_us"])
+
+    shared = [
+        (max(costs), name)
+        for name, costs in users.items()
+        if len(costs) >= min_entry_points and max(costs) >= min_ms * 1000
+    ]
+    return [name for _, name in sorted(shared, key=lambda s: (-s[0], s[1]))]
+
+
+def format_report(results):
+    "Return a human-readable report as a list of lines."
+    lines = []
+    if any(not r.get("imports_available", True) for r in results):
+        lines.append("Nested import times are only available on Python 3.7+.")
+    for r in results:
+        memory = []
+        if r.get("rss_delta_kb") is not None:
+            memory.append("+%d KiB RSS" % r["rss_delta_kb"])
+        if r.get("tracemalloc_peak") is not None:
+            memory.append("%d KiB traced peak" % (r["tracemalloc_peak"] // 1024))
+
+        lines.append(
+            "%8.1f ms  %s%s"
+            % (
+                r.get("wall_time", 0) * 1000,
+                r["entry_point"],
+                "  (%s)" % ", ".join(memory) if memory else "",
+            )
+        )
+        if not r["ok"] or not r.get("attr_found", True):
+            lines.append("             error: %s" % r["error"])
+        for imp in r["top_imports"]:
+            lines.append(
+                "             %8.1f ms  %s" % (imp["self_us"] / 1000.0, imp["module"])
+            )
+    return lines
+
+
+def dump_report(results):
+    return json.dumps(results, indent=1, sort_keys=True)
@@ -0,0 +1,192 @@
+"""
+Load times recorded inside IDA by instrumented wrappers.
+
+Enabled with `idaenv instrument`.  Wrappers then time the import of their
+module and, for plugins, PLUGIN_ENTRY and the plugin's init(), appending one
+line per measurement to `startup.log` in the prefix, or bundle, the wrapper
+was loaded from:
+
+    time  session  event  module  seconds  database
+
+Events are "import", "entry" and "init".  The session identifies the IDA
+process.  Concurrent IDA instances serialize their appends with a lock file.
+`idaenv startup-report` aggregates the log.
+
+This module is imported by the wrappers, so it must stay cheap to import.
+"""
+import os
+import json
+import time
+
+from .utils import FileLock
+
+
+LOG_NAME = "startup.log"
+
+EVENTS = ("import", "entry", "init")
+
+PERCENTILES = (50, 90, 99)
+
+# Identifies the IDA process the records come from.
+SESSION = "%x-%x" % (int(time.time()), os.getpid())
+
+
+def log_path(user_dir):
+    return os.path.join(user_dir, LOG_NAME)
+
+
+def wrapper_user_dir(path):
+    "Return the prefix of a wrapper file, from the path IDA loaded it by."
+    user_dir = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+    # Wrapper directories link to generations/<type>-N (see manager.py).
+    if os.path.basename(user_dir) == "generations":
+        user_dir = os.path.dirname(user_dir)
+    return user_dir
+
+
+def current_database():
+    "Return the path of the open database, or an empty string."
+    try:
+        import idc
+
+        return idc.get_idb_path() or ""
+    except Exception:
+        return ""
+
+
+def record(user_dir, event, module_name, seconds, database=""):
+    "Append a measurement to the log.  Errors are ignored."
+    line = "%.3f\t%s\t%s\t%s\t%.6f\t%s\n" % (
+        time.time(),
+        SESSION,
+        event,
+        module_name,
+        seconds,
+        database.replace("\t", " ").replace("\n", " "),
+    )
+    path = log_path(user_dir)
+    try:
+        with FileLock(path + ".lock"):
+            with open(path, "a") as f:
+                f.write(line)
+    except (IOError, OSError):
+        pass
+
+
+def instrument_plugin(user_dir, module_name, plugin):
+    "Time the init() of a plugin object returned by PLUGIN_ENTRY."
+    init = getattr(plugin, "init", None)
+    if init is None:
+        return plugin
+
+    def timed_init():
+        start = time.time()
+        try:
+            return init()
+        finally:
+            record(
+                user_dir, "init", module_name, time.time() - start, current_database()
+            )
+
+    try:
+        plugin.init = timed_init
+    except (AttributeError, TypeError):
+        pass
+    return plugin
+
+
+def read_log(user_dir):
+    "Return the logged measurements as a list of dicts, skipping bad lines."
+    records = []
+    try:
+        f = open(log_path(user_dir), "r")
+    except (IOError, OSError):
+        return records
+    with f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 6 or fields[2] not in EVENTS:
+                continue
+            try:
+                timestamp, seconds = float(fields[0]), float(fields[4])
+            except ValueError:
+                continue
+            records.append(
+                {
+                    "time": timestamp,
+                    "session": fields[1],
+                    "event": fields[2],
+                    "module": fields[3],
+                    "seconds": seconds,
+                    "database": fields[5],
+                }
+            )
+    return records
+
+
+def clear_log(user_dir):
+    path = log_path(user_dir)
+    with FileLock(path + ".lock"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def percentile(values, p):
+    "Return the p-th percentile of sorted values by the nearest-rank method."
+    rank = max(1, int(-(-p * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize(records):
+    """
+    Aggregate measurements by module and event.  Returns a list of dicts with
+    the module, event, number of samples and sessions, percentiles and
+    maximum in seconds, slowest (by p90) first.
+    """
+    groups = {}
+    for r in records:
+        group = groups.setdefault((r["module"], r["event"]), ([], set()))
+        group[0].append(r["seconds"])
+        group[1].add(r["session"])
+
+    rows = []
+    for (module_name, event), (values, sessions) in groups.items():
+        values.sort()
+        row = {
+            "module": module_name,
+            "event": event,
+            "samples": len(values),
+            "sessions": len(sessions),
+            "max": values[-1],
+        }
+        for p in PERCENTILES:
+            row["p%d" % p] = percentile(values, p)
+        rows.append(row)
+    rows.sort(key=lambda row: (-row["p90"], row["module"], row["event"]))
+    return rows
+
+
+def format_summary(rows):
+    "Format aggregated measurements as a list of table rows."
+    row_format = "%-32s %-6s %7s %8s %9s %9s %9s %9s"
+    header = ("Module", "Event", "Samples", "Sessions")
+    lines = [row_format % (header + ("p50 ms", "p90 ms", "p99 ms", "Max ms"))]
+    for row in rows:
+        lines.append(
+            row_format
+            % (
+                row["module"],
+                row["event"],
+                row["samples"],
+                row["sessions"],
+                "%.1f" % (row["p50"] * 1000),
+                "%.1f" % (row["p90"] * 1000),
+                "%.1f" % (row["p99"] * 1000),
+                "%.1f" % (row["max"] * 1000),
+            )
+        )
+    return lines
+
+
+def dump_summary(rows):
+    return json.dumps(rows, indent=1, sort_keys=True)
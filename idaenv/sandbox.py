@@ -0,0 +1,247 @@
+"""
+Import entry points outside of IDA.
+
+Each entry point is imported in a separate interpreter, running this module as
+a script, with stand-ins for the IDA modules (idaapi, idc, idautils and
+ida_*).  The child reports how long the import took, how much memory it used
+and whether the entry point attribute was found.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+
+STUB_MODULES = ("idaapi", "idc", "idautils")
+STUB_PREFIXES = ("ida_",)
+
+# Values of IDA constants commonly used at import time
+STUB_CONSTANTS = {
+    "BADADDR": 0xFFFFFFFFFFFFFFFF,
+    "PLUGIN_SKIP": 0,
+    "PLUGIN_OK": 1,
+    "PLUGIN_KEEP": 2,
+    "PLUGIN_MOD": 0x0001,
+    "PLUGIN_DRAW": 0x0002,
+    "PLUGIN_SEG": 0x0004,
+    "PLUGIN_UNL": 0x0008,
+    "PLUGIN_HIDE": 0x0010,
+    "PLUGIN_DBG": 0x0020,
+    "PLUGIN_PROC": 0x0040,
+    "PLUGIN_FIX": 0x0080,
+    "PLUGIN_MULTI": 0x0100,
+}
+
+# Marker written to stderr right before the entry point is imported, so the
+# sandbox's own imports can be told apart in -X importtime output.
+IMPORT_MARKER = "idaenv-sandbox: importing entry point"
+
+# -X importtime was added in Python 3.7; older interpreters reject or ignore it.
+HAS_IMPORTTIME = sys.version_info >= (3, 7)
+
+
+def is_stub_module(fullname):
+    return fullname.split(".")[0] in STUB_MODULES or fullname.startswith(
+        STUB_PREFIXES
+    )
+
+
+def stub_value(name):
+    if name in STUB_CONSTANTS:
+        return STUB_CONSTANTS[name]
+    if name.isupper():
+        return 0
+    return StubMeta(name, (Stub,), {})
+
+
+class StubMeta(type):
+    "Classes that produce further stubs for any attribute."
+
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return stub_value(name)
+
+
+# Base class of every stand-in; instantiable, subclassable and callable.
+Stub = StubMeta(
+    "Stub",
+    (object,),
+    {
+        "__init__": lambda self, *args, **kwargs: None,
+        "__call__": lambda self, *args, **kwargs: None,
+    },
+)
+
+
+def make_stub_module(fullname):
+    import types
+
+    class StubModule(types.ModuleType):
+        def __getattr__(self, name):
+            if name.startswith("__"):
+                raise AttributeError(name)
+            value = stub_value(name)
+            setattr(self, name, value)
+            return value
+
+    module = StubModule(fullname)
+    module.__path__ = []
+    module.__file__ = "<idaenv stub>"
+    return module
+
+
+class StubFinder(object):
+    "Meta path finder providing stand-ins for the IDA modules."
+
+    # Python 3
+    def find_spec(self, fullname, path=None, target=None):
+        if not is_stub_module(fullname):
+            return None
+        import importlib.machinery
+
+        return importlib.machinery.ModuleSpec(fullname, self)
+
+    def create_module(self, spec):
+        return make_stub_module(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+    # Python 2
+    def find_module(self, fullname, path=None):
+        return self if is_stub_module(fullname) else None
+
+    def load_module(self, fullname):
+        return sys.modules.setdefault(fullname, make_stub_module(fullname))
+
+
+def max_rss():
+    "Return the peak resident set size of this process in KiB, if known."
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def import_entry_point(module, attr, trace_memory=False):
+    "Import an entry point in this process and describe the outcome."
+    sys.meta_path.insert(0, StubFinder())
+
+    if trace_memory:
+        import tracemalloc
+
+        tracemalloc.start()
+
+    result = {"ok": False, "error": None, "attr_found": False, "callable": False}
+    rss_before = max_rss()
+    sys.stderr.write(IMPORT_MARKER + "\n")
+    sys.stderr.flush()
+    start = time.time()
+    try:
+        obj = __import__(module, fromlist=["__name__"])
+        result["ok"] = True
+        if attr:
+            for part in attr.split("."):
+                obj = getattr(obj, part)
+        result["attr_found"] = True
+        result["callable"] = callable(obj)
+    except BaseException as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["wall_time"] = time.time() - start
+
+    rss_after = max_rss()
+    if rss_before is not None:
+        result["max_rss_kb"] = rss_after
+        result["rss_delta_kb"] = rss_after - rss_before
+    if trace_memory:
+        result["tracemalloc_peak"] = tracemalloc.get_traced_memory()[1]
+    return result
+
+
+def main():
+    module, attr = sys.argv[1], sys.argv[2]
+    trace_memory = "--trace-memory" in sys.argv[3:]
+
+    # Keep stdout for the result; the imported code may print.
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    result = import_entry_point(module, attr, trace_memory)
+    out.write(json.dumps(result) + "\n")
+    out.flush()
+    # Skip interpreter cleanup, which may run arbitrary plugin code.
+    os._exit(0)
+
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output following the import marker into a list of
+    (module, self us, cumulative us) tuples.
+    """
+    imports = []
+    seen_marker = False
+    for line in stderr.splitlines():
+        if line.strip() == IMPORT_MARKER:
+            seen_marker = True
+            continue
+        if not seen_marker or not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            continue
+        imports.append((fields[2].strip(), self_us, cumulative_us))
+    return imports
+
+
+def run_sandbox(module, attr, timeout=None, trace_memory=False, importtime=False):
+    """
+    Import an entry point in a child interpreter and return the result
+    reported by the child.  The "imports" key lists -X importtime data if
+    requested, or is None if the interpreter can't provide it.
+    """
+    from .utils import communicate
+
+    args = [sys.executable]
+    if importtime and HAS_IMPORTTIME:
+        args += ["-X", "importtime"]
+    args += ["-m", "idaenv.sandbox", module, attr or ""]
+    if trace_memory:
+        args.append("--trace-memory")
+
+    proc = subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    output = communicate(proc, timeout)
+    if output is None:
+        return {"ok": False, "error": "Timed out after %ss" % timeout}
+    stdout, stderr = output
+
+    lines = stdout.strip().splitlines()
+    try:
+        result = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        tail = stderr.strip().splitlines()[-1:] or ["no output"]
+        return {
+            "ok": False,
+            "error": "Exited with status %d: %s" % (proc.returncode, tail[0]),
+        }
+
+    if importtime:
+        result["imports"] = parse_importtime(stderr) if HAS_IMPORTTIME else None
+    return result
+
+
+if __name__ == "__main__":
+    main()
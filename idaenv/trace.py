@@ -0,0 +1,192 @@
+"""
+Phase timings and file operation counts for diagnosing slow updates.
+
+Tracing is off unless enabled with `idaenv --timings` or the IDAENV_TRACE
+environment variable.  Instrumented code checks `trace.enabled` before doing
+any work, so the disabled cost is a global lookup.
+
+Wall time is recorded for each phase, including the time spent in nested
+phases.  Counters are attributed to the innermost active phase:
+
+    dists    distributions visited
+    files    files opened
+    read     bytes read
+    written  bytes written
+
+File counts cover idaenv's own reads and writes, including the metadata read
+by the native backend.  Files read by importlib.metadata and pkg_resources
+are not counted; their time shows up in the "read metadata" phase.
+"""
+import os
+import json
+import time
+
+
+COUNTERS = ("dists", "files", "read", "written")
+
+enabled = False
+
+_lock = None
+_start = None
+# Active phase paths, e.g. ["execute update", "execute update/write wrappers"]
+_stack = []
+# Phase path -> {"calls", "seconds", counter...}, in order of first use
+_phases = {}
+_order = []
+_totals = {}
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        path = "%s/%s" % (_stack[-1], self.name) if _stack else self.name
+        _stack.append(path)
+        self.path = path
+        with _lock:
+            # Register on entry so phases are listed before nested ones.
+            _phase_stats(path)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        _stack.pop()
+        with _lock:
+            stats = _phase_stats(self.path)
+            stats["calls"] += 1
+            stats["seconds"] += elapsed
+        return False
+
+
+def _phase_stats(path):
+    stats = _phases.get(path)
+    if stats is None:
+        stats = _phases[path] = dict((c, 0) for c in COUNTERS)
+        stats.update(calls=0, seconds=0.0)
+        _order.append(path)
+    return stats
+
+
+def enable():
+    "Start collecting timings, discarding anything collected before."
+    global enabled, _lock, _start
+    import threading
+
+    _lock = threading.Lock()
+    del _stack[:]
+    _phases.clear()
+    del _order[:]
+    _totals.clear()
+    _totals.update((c, 0) for c in COUNTERS)
+    _start = time.time()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def phase(name):
+    "Return a context manager timing a phase."
+    if not enabled:
+        return _null_phase
+    return _Phase(name)
+
+
+def traced_iter(name, iterable):
+    "Time the work done to produce each item of an iterable as a phase."
+    it = iter(iterable)
+    while True:
+        with phase(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+
+def count(**counters):
+    """
+    Add to the counters of the current phase, e.g. count(files=1, read=n).
+    Callers check `enabled` first.
+    """
+    with _lock:
+        # Worker threads have no phases of their own; count towards the
+        # phase that started them.
+        stats = _phase_stats(_stack[-1]) if _stack else None
+        for name, value in counters.items():
+            _totals[name] += value
+            if stats is not None:
+                stats[name] += value
+
+
+def report():
+    "Return the collected timings and counters."
+    phases = []
+    for path in _order:
+        stats = dict(_phases[path])
+        stats["phase"] = path
+        phases.append(stats)
+    totals = dict(_totals)
+    totals["seconds"] = time.time() - _start if _start is not None else 0.0
+    return {"phases": phases, "total": totals}
+
+
+def format_size(n):
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024 or unit == "MiB":
+            return ("%d %s" if unit == "B" else "%.1f %s") % (n, unit)
+        n /= 1024.0
+
+
+def format_report(data):
+    "Format a report as a list of table rows."
+    row = "%-34s %6s %10s %7s %7s %10s %10s"
+    lines = [row % ("Phase", "Calls", "Wall ms", "Dists", "Files", "Read", "Written")]
+
+    def format_row(name, stats, calls):
+        return row % (
+            name,
+            calls,
+            "%.1f" % (stats["seconds"] * 1000),
+            stats["dists"],
+            stats["files"],
+            format_size(stats["read"]),
+            format_size(stats["written"]),
+        )
+
+    for stats in data["phases"]:
+        depth = stats["phase"].count("/")
+        name = "  " * depth + stats["phase"].rsplit("/", 1)[-1]
+        lines.append(format_row(name, stats, stats["calls"]))
+    lines.append(format_row("total", data["total"], ""))
+    return lines
+
+
+def dump_report(data):
+    return json.dumps(data, indent=1, sort_keys=True)
+
+
+def env_format():
+    """
+    Return the report format requested by IDAENV_TRACE ("table" or "json"),
+    or None if tracing isn't requested.
+    """
+    value = os.environ.get("IDAENV_TRACE", "").strip().lower()
+    if value in ("", "0", "no", "off", "false"):
+        return None
+    return "json" if value == "json" else "table"
@@ -1,6 +1,7 @@
 import sys
 import os
 
+from . import trace
 
 IDAUSR_DEFAULTS = {
     "darwin": "$HOME/.idapro",
@@ -46,6 +47,21 @@ def get_default_ida_usr():
     return os.path.expandvars(IDAUSR_DEFAULTS[get_platform()])
 
 
+def get_default_user_dir(require_venv=False):
+    """
+    Return the idaenv prefix for the current environment: a directory in the
+    active virtualenv, or the default IDAUSR outside of one.
+    """
+    cur_env = get_virtualenv_path()
+    if cur_env:
+        return os.path.join(cur_env, "ida")
+    elif require_venv:
+        raise RuntimeError("Not in virtual environment.")
+    else:
+        print("Warning: operating outside of a virtual environment.")
+        return get_default_ida_usr()
+
+
 def append_ida_usr(new_dir, preserve_default=True):
     "Append a directory to the IDAUSR environment variable."
     if "IDAUSR" in os.environ:
@@ -58,3 +74,237 @@ def append_ida_usr(new_dir, preserve_default=True):
 
     path.append(new_dir)
     os.environ["IDAUSR"] = os.pathsep.join(path)
+
+
+def atomic_write(path, data):
+    """
+    Replace the contents of a file.  Readers see either the old or the new
+    contents, never a partial write.
+    """
+    import tempfile
+
+    dirname, basename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname or ".", prefix="." + basename)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if trace.enabled:
+            trace.count(files=1, written=len(data))
+        os.chmod(tmp_path, 0o666 & ~get_umask())
+        replace_file(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def replace_file(src, dst):
+    "Atomically move src over dst."
+    if hasattr(os, "replace"):
+        os.replace(src, dst)
+    else:
+        # Python 2: rename only overwrites on POSIX.
+        if sys.platform.startswith("win") and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def get_umask():
+    "Return the process umask."
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def supports_symlinks():
+    "Return True if directory symlinks can be used on this platform."
+    return hasattr(os, "symlink") and get_platform() != "win"
+
+
+def link_tree(src, dst):
+    """
+    Recreate a directory tree, hard linking files where possible.  Files must
+    be unlinked rather than overwritten in place afterwards.
+    """
+    import shutil
+
+    os.mkdir(dst)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path):
+            link_tree(src_path, dst_path)
+        else:
+            try:
+                os.link(src_path, dst_path)
+            except (AttributeError, OSError):
+                shutil.copy2(src_path, dst_path)
+
+
+class FileLock(object):
+    """
+    Advisory exclusive lock on a file.  The lock is re-entrant within a
+    process and is held while in a with block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._depth = 0
+
+    def acquire(self):
+        if self._depth == 0:
+            f = open(self.path, "a+")
+            try:
+                _lock_file(f)
+            except Exception:
+                f.close()
+                raise
+            self._file = f
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+if sys.platform.startswith("win"):
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+else:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def communicate(proc, timeout=None):
+    """
+    Wait for a process like Popen.communicate(), killing it if it runs for
+    more than `timeout` seconds.  Returns its (stdout, stderr), or None if it
+    timed out.
+    """
+    import subprocess
+
+    if timeout is None:
+        return proc.communicate()
+    if hasattr(subprocess, "TimeoutExpired"):
+        try:
+            return proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            # Its own children may hold the pipes open, so don't read to EOF.
+            for f in (proc.stdin, proc.stdout, proc.stderr):
+                if f is not None:
+                    f.close()
+            return None
+
+    # Python 2 has no timeouts; kill the process from a timer thread.
+    import threading
+
+    expired = []
+
+    def kill():
+        if proc.poll() is None:
+            expired.append(True)
+            try:
+                proc.kill()
+            except OSError:
+                # Exited in the meantime
+                pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        output = proc.communicate()
+    finally:
+        timer.cancel()
+    return None if expired else output
+
+
+def find_module_path(module_name, paths=None):
+    """
+    Locate the source file of a module without importing it or any of its
+    parent packages.  Returns None unless the module is a plain source file or
+    package directory on the path.
+    """
+    if paths is None:
+        paths = sys.path
+
+    parts = module_name.split(".")
+    for entry in paths:
+        base = os.path.join(entry or ".", *parts)
+        for candidate in (os.path.join(base, "__init__.py"), base + ".py"):
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def script_path_added():
+    """
+    Check whether sys.path[0] is the entry Python adds for the code being run:
+    the script directory, or '' or the current directory for -c, -m and the
+    interactive interpreter.
+    """
+    if not sys.path or getattr(sys.flags, "safe_path", False):
+        return False
+    first = sys.path[0]
+    if not first:
+        return True
+    candidates = [os.getcwd()]
+    if sys.argv and sys.argv[0]:
+        candidates.append(os.path.dirname(os.path.abspath(sys.argv[0])))
+    return os.path.realpath(first) in set(os.path.realpath(c) for c in candidates)
+
+
+def site_paths(paths=None):
+    """
+    Return the entries of sys.path added by site.py for the current
+    environment: site-packages and the directories named by .pth files.
+    The standard library, the entry Python adds for the script being run and
+    missing directories are left out.
+    """
+    import sysconfig
+
+    if paths is None:
+        paths = sys.path[1:] if script_path_added() else sys.path
+
+    base_prefix = getattr(sys, "base_prefix", sys.prefix)
+    excluded = set()
+    for path in (sysconfig.get_path("stdlib"), sysconfig.get_path("platstdlib")):
+        if path:
+            excluded.add(os.path.realpath(path))
+            excluded.add(os.path.realpath(os.path.join(path, "lib-dynload")))
+    excluded.add(os.path.realpath(os.path.join(base_prefix, "DLLs")))
+
+    result = []
+    for entry in paths:
+        if not entry or not os.path.isdir(entry):
+            continue
+        if os.path.realpath(entry) in excluded:
+            continue
+        if entry not in result:
+            result.append(entry)
+    return result
@@ -0,0 +1,44 @@
+"""
+Check that entry points can be imported before their wrappers are written.
+
+Each entry point is imported in a sandbox (see sandbox.py), concurrently, and
+must provide its attribute; plugin attributes must also be callable.
+"""
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from . import sandbox
+
+
+def check_entry_point(module_type, ep, timeout=None):
+    "Import an entry point in a sandbox.  Returns an error message or None."
+    result = sandbox.run_sandbox(ep.module, ep.attr, timeout=timeout)
+    if not result["ok"] or not result.get("attr_found"):
+        return result["error"] or "Import failed"
+    if module_type == "plugins" and not result.get("callable"):
+        return "%s:%s is not callable" % (ep.module, ep.attr)
+    return None
+
+
+def verify_entry_points(candidates, jobs=None, timeout=None):
+    """
+    Check (module type, entry point) pairs concurrently.  Returns a mapping
+    of the failing pairs to their error messages.
+    """
+    candidates = sorted(set(candidates))
+    if not candidates:
+        return {}
+
+    def check(candidate):
+        return check_entry_point(candidate[0], candidate[1], timeout)
+
+    pool = ThreadPool(min(len(candidates), jobs or multiprocessing.cpu_count()))
+    try:
+        errors = pool.map(check, candidates)
+    finally:
+        pool.close()
+    return dict(
+        (candidate, error)
+        for candidate, error in zip(candidates, errors)
+        if error is not None
+    )
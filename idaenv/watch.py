@@ -0,0 +1,327 @@
+"""
+Watch the directories on sys.path for installed and removed distributions.
+
+On Linux, inotify is used through ctypes, so an idle watch costs nothing but
+a blocked read.  Elsewhere, or if inotify is unavailable, directory mtimes
+are polled.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+
+from . import cache
+
+
+# Names whose appearance, removal or change can alter the installed entry
+# points or sys.path.
+METADATA_SUFFIXES = (".dist-info", ".egg-info", ".pth", ".egg-link")
+
+# Files inside watched dist-info and egg-info directories.  `setup.py
+# develop` rewrites egg-info files in place, and installers may write them
+# after creating the directory.
+METADATA_DIR_SUFFIXES = (".dist-info", ".egg-info")
+METADATA_FILES = ("entry_points.txt", "METADATA", "PKG-INFO")
+
+
+def is_metadata_name(name):
+    return name.endswith(METADATA_SUFFIXES)
+
+
+def watched_paths(paths=None):
+    "Return the existing directories on sys.path, without duplicates."
+    result = []
+    for path in sys.path if paths is None else paths:
+        if not path:
+            continue
+        path = os.path.realpath(path)
+        if os.path.isdir(path) and path not in result:
+            result.append(path)
+    return result
+
+
+def egg_info_dirs(path):
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return []
+    return [
+        os.path.join(path, name)
+        for name in names
+        if name.endswith(".egg-info") and os.path.isdir(os.path.join(path, name))
+    ]
+
+
+class PollingWatcher(object):
+    "Detect changes by comparing directory and egg-info mtimes."
+
+    def __init__(self, paths, interval=2.0):
+        self.interval = interval
+        self.paths = []
+        # Directory -> names of the metadata entries in it
+        self.entries = {}
+        self.snapshot = {}
+        self.add_paths(paths)
+
+    def add_paths(self, paths):
+        for path in paths:
+            if path not in self.paths:
+                self.paths.append(path)
+                self.entries[path] = self.metadata_entries(path)
+        self.snapshot = self.take_snapshot()
+
+    def metadata_entries(self, path):
+        try:
+            return set(n for n in os.listdir(path) if is_metadata_name(n))
+        except OSError:
+            return set()
+
+    def take_snapshot(self):
+        snapshot = {}
+        for path in self.paths:
+            try:
+                snapshot[path] = os.stat(path).st_mtime
+            except OSError:
+                continue
+            for egg_info in egg_info_dirs(path):
+                try:
+                    snapshot[egg_info] = cache.metadata_mtime(egg_info)
+                except OSError:
+                    pass
+        return snapshot
+
+    def changed_paths(self, old, new):
+        changed = set()
+        for path in set(old) | set(new):
+            if old.get(path) == new.get(path):
+                continue
+            if path in self.paths and path in old and path in new:
+                # Report the entries added to or removed from the directory.
+                changed.update(self.changed_entries(path))
+            else:
+                changed.add(path)
+        return changed
+
+    def changed_entries(self, path):
+        names = self.entries.get(path, set())
+        current = self.entries[path] = self.metadata_entries(path)
+        return set(os.path.join(path, n) for n in names ^ current)
+
+    def wait(self, timeout=None):
+        """
+        Block until metadata changes or the timeout expires.  Returns the set
+        of changed paths, which is empty on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.time()))
+            time.sleep(delay)
+
+            new = self.take_snapshot()
+            changed = self.changed_paths(self.snapshot, new)
+            self.snapshot = new
+            if changed:
+                return changed
+            if deadline is not None and time.time() >= deadline:
+                return set()
+
+    def close(self):
+        pass
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+DIR_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+METADATA_DIR_MASK = DIR_MASK | IN_CLOSE_WRITE | IN_MODIFY
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher(object):
+    "Detect changes with inotify."
+
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.watches = {}
+        self.add_paths(paths)
+
+    def add_watch(self, path, mask):
+        import ctypes
+
+        wd = self._add_watch(self.fd, path.encode(sys.getfilesystemencoding()), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(e, "inotify_add_watch(%r): %s" % (path, os.strerror(e)))
+        self.watches[wd] = path
+
+    def add_paths(self, paths):
+        watched = set(self.watches.values())
+        for path in paths:
+            if path in watched:
+                continue
+            self.add_watch(path, DIR_MASK)
+            for egg_info in egg_info_dirs(path):
+                self.add_watch(egg_info, METADATA_DIR_MASK)
+
+    def read_events(self):
+        "Read pending events as (watched path, mask, name) tuples."
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append(
+                (self.watches.get(wd), mask, name.decode(sys.getfilesystemencoding()))
+            )
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+        return events
+
+    def changed_paths(self, events):
+        watched_dirs = set(
+            p for p in self.watches.values() if not p.endswith(METADATA_DIR_SUFFIXES)
+        )
+        changed = set()
+        for path, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost; rescan everything.
+                changed.update(watched_dirs)
+            elif path is None:
+                continue
+            elif path.endswith(METADATA_DIR_SUFFIXES):
+                if name in METADATA_FILES:
+                    changed.add(path)
+            elif is_metadata_name(name):
+                full_path = os.path.join(path, name)
+                changed.add(full_path)
+                if (
+                    name.endswith(METADATA_DIR_SUFFIXES)
+                    and mask & IN_ISDIR
+                    and mask & (IN_CREATE | IN_MOVED_TO)
+                ):
+                    # Notice metadata written after the directory is created.
+                    self.add_watch(full_path, METADATA_DIR_MASK)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Block until metadata changes or the timeout expires.  Returns the set
+        of changed paths, which is empty on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            try:
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+            except (OSError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                return set()
+            changed = self.changed_paths(self.read_events())
+            if changed:
+                return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def make_watcher(paths, interval=2.0, polling=False):
+    "Return an inotify watcher where possible, or a polling watcher."
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            # No inotify in libc, or out of watches
+            pass
+    return PollingWatcher(paths, interval)
+
+
+def wait_for_changes(watcher, debounce=1.0):
+    """
+    Wait for a change, then keep collecting changes until none arrive for
+    `debounce` seconds, so a pip transaction is handled as a single update.
+    """
+    changed = watcher.wait()
+    while True:
+        more = watcher.wait(timeout=debounce)
+        if not more:
+            return changed
+        changed |= more
+
+
+def add_site_dirs(changed):
+    """
+    Process the .pth files of directories where one changed, adding new
+    sys.path entries.  Returns the directories added to sys.path.
+    """
+    import site
+
+    before = set(sys.path)
+    for path in sorted(changed):
+        if path.endswith(".pth"):
+            site.addsitedir(os.path.dirname(path))
+    return watched_paths([p for p in sys.path if p not in before])
+
+
+def watch(callback, paths=None, debounce=1.0, interval=2.0, polling=False):
+    """
+    Call `callback` with the set of changed paths whenever distributions are
+    installed or removed in the directories on sys.path.  Runs until
+    interrupted.
+    """
+    watcher = make_watcher(watched_paths(paths), interval, polling)
+    try:
+        while True:
+            changed = wait_for_changes(watcher, debounce)
+            new_paths = add_site_dirs(changed)
+            if new_paths:
+                watcher.add_paths(new_paths)
+            callback(changed)
+    finally:
+        watcher.close()
@@ -37,16 +37,24 @@ if [[ ! -e "$IDAENV/bin/idaenv" ]]; then
     exit
 fi
 
-# Activate the virtualenv
-source "$IDAENV/bin/activate"
+# Use the environment written by `idaenv update` if it is newer than the
+# virtualenv; otherwise work it out, which takes two Python startups.
+env_file="$IDAENV/ida/idaenv.env"
+if [[ -f "$env_file" && "$env_file" -nt "$IDAENV/bin/activate" &&
+      ( ! -e "$IDAENV/pyvenv.cfg" || "$env_file" -nt "$IDAENV/pyvenv.cfg" ) ]]; then
+    source "$env_file"
+else
+    # Activate the virtualenv
+    source "$IDAENV/bin/activate"
 
-# Configure IDAUSR
-export IDAUSR="$HOME/.idapro:$( "$IDAENV/bin/idaenv" prefix )"
+    # Configure IDAUSR
+    export IDAUSR="$HOME/.idapro:$( "$IDAENV/bin/idaenv" prefix )"
 
-# Try to find libpython for preload
-LIBPYTHON="$(python -c 'import sysconfig; print("%s/%s" % (
-       sysconfig.get_config_var("LIBPL"),
-       sysconfig.get_config_var("LDLIBRARY")))' 2>&1)"
+    # Try to find libpython for preload
+    LIBPYTHON="$(python -c 'import sysconfig; print("%s/%s" % (
+           sysconfig.get_config_var("LIBPL"),
+           sysconfig.get_config_var("LDLIBRARY")))' 2>&1)"
+fi
 
 # Start the target IDA binary
 if [[ -f "$LIBPYTHON" && -f "/lib64/ld-linux-x86-64.so.2" ]]; then
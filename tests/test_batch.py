@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import stat
+import time
+import subprocess
+
+import pytest
+
+from idaenv import batch, launch
+
+from .conftest import build_files
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stands in for idat64.  Inputs say what to do: "ok", "fail", "hang", or
+# "flaky" to fail on the first attempt only.  Like IDA, it runs in the
+# directory of the input.
+STUB_IDA = """#!%s
+import os, sys, time
+
+options = dict((a[:2], a[2:]) for a in sys.argv[1:-1] if a.startswith("-"))
+input_path = os.path.abspath(sys.argv[-1])
+os.chdir(os.path.dirname(input_path))
+with open(input_path) as f:
+    action = f.read().strip()
+rebuild = "rebuild" if "-c" in options else "open"
+fields = (options["-S"], os.environ["IDAUSR"], action, rebuild, os.getpid())
+with open(options["-L"], "a") as log:
+    log.write("%%s %%s %%s %%s %%d\\n" %% fields)
+
+if action == "flaky" and not os.path.exists(input_path + ".tried"):
+    open(input_path + ".tried", "w").close()
+    sys.exit(1)
+if action == "hang":
+    time.sleep(30)
+sys.exit(3 if action == "fail" else 0)
+"""
+
+
+def make_stub(site_dir):
+    ida_dir = site_dir / "ida"
+    build_files(
+        {
+            "ida": {"idat64": STUB_IDA % sys.executable},
+            "corpus": {"a.exe": "ok", "b.exe": "fail", "sub": {"c.exe": "flaky"}},
+        },
+        prefix=site_dir,
+    )
+    path = str(ida_dir / "idat64")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return str(ida_dir)
+
+
+def test_batch_runs_retries_and_resumes(site_dir):
+    ida_dir = make_stub(site_dir)
+    state = str(site_dir / "state")
+    inputs = batch.expand_inputs([str(site_dir / "corpus")])
+    assert [os.path.basename(p) for p in inputs] == ["a.exe", "b.exe", "c.exe"]
+
+    jobs = batch.make_jobs(
+        inputs,
+        batch.find_ida(os.path.join(ida_dir, "idat64")),
+        "my script.py",
+        state,
+        script_args=["--out", "x"],
+    )
+    environ = launch.launch_environ("/prefix/ida")
+    finished = []
+    results = batch.run_batch(
+        jobs, environ, state, concurrency=2, retries=1, progress=finished.append
+    )
+    assert len(finished) == 3
+    assert [(r["status"], r["returncode"], r["attempts"]) for r in results] == [
+        ("ok", 0, 1),
+        ("failed", 3, 2),
+        ("ok", 0, 2),
+    ]
+    with open(results[0]["log"]) as f:
+        assert f.read().startswith('"my script.py" --out x ')
+
+    def attempts(result):
+        "Return whether each attempt of a job discarded the database."
+        with open(result["log"]) as f:
+            return [line.split()[-2] for line in f]
+
+    # Retries rebuild the database a failed attempt may have left behind.
+    assert attempts(results[2]) == ["open", "rebuild"]
+
+    with open(os.path.join(state, batch.MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert manifest["counts"] == {"ok": 2, "failed": 1}
+
+    # Finished jobs are skipped when resuming; failed ones only on request.
+    finished = []
+    batch.run_batch(jobs, environ, state, progress=finished.append)
+    assert finished == []
+    batch.run_batch(jobs, environ, state, rerun_failed=True, progress=finished.append)
+    assert [r["input"] for r in finished] == [inputs[1]]
+    assert attempts(finished[0]) == ["open", "rebuild", "rebuild"]
+
+
+def test_batch_timeout(site_dir):
+    ida_dir = make_stub(site_dir)
+    hang = site_dir / "hang.exe"
+    hang.write_text(u"hang")
+    state = str(site_dir / "state")
+    jobs = batch.make_jobs(
+        [str(hang)], os.path.join(ida_dir, "idat64"), "script.py", state
+    )
+    environ = launch.launch_environ("/prefix/ida")
+    (result,) = batch.run_batch(jobs, environ, state, timeout=0.5)
+    assert result["status"] == "timeout" and result["seconds"] < 10
+
+
+def test_batch_interrupt_kills_ida(site_dir):
+    ida_dir = make_stub(site_dir)
+    hang = site_dir / "hang.exe"
+    hang.write_text(u"hang")
+    state = str(site_dir / "state")
+    inputs = [str(site_dir / "corpus" / "a.exe"), str(hang)]
+    jobs = batch.make_jobs(inputs, os.path.join(ida_dir, "idat64"), "s.py", state)
+    environ = launch.launch_environ("/prefix/ida")
+
+    def interrupt(result):
+        # Once the other job is running
+        while not os.path.exists(jobs[1]["log"]):
+            time.sleep(0.05)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(jobs, environ, state, concurrency=2, progress=interrupt)
+    # The hanging IDA was killed before the state directory was unlocked.
+    with open(jobs[1]["log"]) as f:
+        pid = int(f.read().split()[-1])
+    with pytest.raises(OSError):
+        os.kill(pid, 0)
+    with open(os.path.join(state, batch.MANIFEST_NAME)) as f:
+        statuses = [job["status"] for job in json.load(f)["jobs"]]
+    assert statuses == ["ok", "pending"]
+
+
+def test_run_command(site_dir):
+    ida_dir = make_stub(site_dir)
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, IDAHOME=ida_dir, HOME=str(site_dir))
+    args = [sys.executable, "-m", "idaenv", "run", "--batch", "--script", "s.py"]
+    # The state directory is relative to the current directory, not IDA's.
+    args += ["--state", "state", "--retries", "0", "corpus"]
+    proc = subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        env=env,
+        cwd=str(site_dir),
+        universal_newlines=True,
+    )
+    stdout = proc.communicate()[0]
+    assert proc.returncode == 1
+    assert "3 jobs: 2 failed, 1 ok" in stdout
+    with open(str(site_dir / "state" / batch.MANIFEST_NAME)) as f:
+        jobs = json.load(f)["jobs"]
+    assert all(os.path.isfile(job["log"]) for job in jobs)
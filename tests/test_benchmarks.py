@@ -0,0 +1,41 @@
+import os
+import sys
+import runpy
+
+from idaenv import entrypoints
+
+BENCH_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "benchmarks",
+    "bench_scaling.py",
+)
+
+
+def test_bench_scaling_smoke():
+    bench = runpy.run_path(BENCH_SCRIPT)
+    results = bench["run_benchmarks"]([6], ["native"], [0.0, 1.0], 0.5, 1)
+    phases = set(r["phase"] for r in results)
+    assert phases == {
+        "scan_cold",
+        "scan_warm",
+        "plan_update",
+        "execute_update",
+        "find_module_wrapper",
+        "cmd_status",
+    }
+    assert all(r["module_distributions"] == 3 for r in results)
+
+    slower = [dict(r, seconds=r["seconds"] * 3 + 1) for r in results]
+    baseline = {"results": results}
+    assert bench["find_regressions"](results, baseline, 1.5) == []
+    assert len(bench["find_regressions"](slower, baseline, 1.5)) == len(results)
+
+
+def test_default_backends(monkeypatch):
+    bench = runpy.run_path(BENCH_SCRIPT)
+    # pkg_resources is missing on Python 3.12+ without setuptools.
+    monkeypatch.setattr(entrypoints, "pkg_resources", None)
+    monkeypatch.setitem(sys.modules, "pkg_resources", None)
+    backends = bench["available_backends"]()
+    assert "pkg_resources" not in backends and "native" in backends
+    assert entrypoints.backend is None
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import zipfile
+import zipimport
+
+from idaenv import bundle, entrypoints
+from idaenv.manager import BOOTSTRAP_NAME, PluginManager
+
+from .conftest import build_files
+
+
+def build_site(site_dir):
+    build_files(
+        {
+            "bundled-1.0.dist-info": {
+                "entry_points.txt": "[idapython_plugins]\nmain = bundled_mod:Plugin\n"
+            },
+            "bundled_mod.py": """
+                import pure_dep
+                import native_dep
+
+                class Plugin(object):
+                    pass
+            """,
+            "pure_dep": {
+                "__init__.py": "from . import sub\n",
+                "sub.py": "",
+                "data.txt": "x",
+            },
+            "native_dep": {"__init__.py": "", "_speedups.so": ""},
+            "unused_dep.py": "",
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        mgr.execute_update("plugins", mgr.plan_update("plugins"))
+    finally:
+        entrypoints.set_backend(None)
+    return mgr
+
+
+def test_zip_bundle(site_dir, on_sys_path):
+    mgr = build_site(site_dir)
+    output = str(site_dir / "bundle")
+    description = bundle.build_bundle(mgr, output)
+
+    assert description["wrappers"]["plugins"] == ["bundled.main"]
+    assert description["packages"] == ["bundled_mod.py", "pure_dep"]
+    assert description["native"] == [os.path.join("native_dep", "_speedups.so")]
+    assert sorted(os.listdir(os.path.join(output, "plugins")))[0] == BOOTSTRAP_NAME
+    with open(os.path.join(output, bundle.MANIFEST_NAME)) as f:
+        assert json.load(f) == description
+
+    zip_path = os.path.join(output, bundle.ZIP_NAME)
+    names = zipfile.ZipFile(zip_path).namelist()
+    assert "pure_dep/data.txt" in names and "pure_dep/__init__.pyc" in names
+    assert "unused_dep.py" not in names
+    importer = zipimport.zipimporter(os.path.join(zip_path, "pure_dep"))
+    assert importer.get_code("pure_dep.sub") is not None
+    assert os.path.isfile(
+        os.path.join(output, bundle.NATIVE_NAME, "native_dep", "_speedups.so")
+    )
+
+
+def test_dir_bundle_reports_native(site_dir, on_sys_path):
+    mgr = build_site(site_dir)
+    output = str(site_dir / "bundle")
+    description = bundle.build_bundle(mgr, output, fmt="dir", native="report")
+
+    assert not description["native_extracted"]
+    assert sorted(os.listdir(output)) == [
+        bundle.MANIFEST_NAME,
+        "loaders",
+        bundle.DIR_NAME,
+        "plugins",
+        "procs",
+    ]
+    assert sorted(os.listdir(os.path.join(output, bundle.DIR_NAME))) == [
+        "__pycache__",
+        "bundled_mod.py",
+        "pure_dep",
+    ]
+
+
+def test_bundle_module_path_setup(site_dir, on_sys_path, monkeypatch):
+    mgr = build_site(site_dir)
+    build_files(
+        {
+            "ldr-1.0.dist-info": {
+                "entry_points.txt": "[idapython_loaders]\nldr = bundled_ldr\n"
+            },
+            "bundled_ldr.py": """
+                import pure_dep
+
+                def accept_file(li, filename):
+                    return 0
+            """,
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(mgr.user_dir, compile=False)
+        mgr.execute_update("loaders", mgr.plan_update("loaders"))
+    finally:
+        entrypoints.set_backend(None)
+    output = str(site_dir / "bundle")
+    description = bundle.build_bundle(mgr, output)
+    assert description["wrappers"]["loaders"] == ["ldr.ldr"]
+
+    # Loaders may run before the bootstrap plugin, so they set up sys.path.
+    (name,) = os.listdir(os.path.join(output, "loaders"))
+    path = os.path.join(output, "loaders", name)
+    assert mgr.find_wrappers(os.path.join(output, "loaders"))[0][0].name == "ldr"
+    monkeypatch.setattr(sys, "path", list(sys.path))
+    namespace = {"__file__": path, "__name__": "loader"}
+    for _ in range(2):
+        with open(path) as f:
+            exec(compile(f.read(), path, "exec"), namespace)
+    zip_path = os.path.join(output, bundle.ZIP_NAME)
+    assert sys.path[:2] == [zip_path, os.path.join(output, bundle.NATIVE_NAME)]
+    assert "accept_file" in namespace
@@ -0,0 +1,115 @@
+import os
+
+from idaenv import cache, entrypoints
+
+from .conftest import build_files
+
+
+GROUPS = ["entries"]
+
+
+def test_scan_rereads_only_changed(site_dir):
+    paths = [str(site_dir)]
+    build_files(
+        {
+            "one-1.0.dist-info": {"entry_points.txt": "[entries]\na = mod:a\n"},
+            "two-1.0.dist-info": {"entry_points.txt": "[entries]\nb = mod:b\n"},
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        index, records, changes = cache.scan_distributions(GROUPS, {}, paths)
+        assert sorted(ep.name for ep in index["entries"]) == ["a", "b"]
+        assert len(changes["added"]) == 2
+
+        index2, records2, changes = cache.scan_distributions(GROUPS, records, paths)
+        assert index2 == index
+        assert changes == {"added": [], "modified": [], "removed": []}
+
+        # Unchanged records are trusted rather than re-read.
+        one = str(site_dir / "one-1.0.dist-info")
+        records2[one] = dict(records2[one], entry_points=[])
+        index3, _, _ = cache.scan_distributions(GROUPS, records2, paths)
+        assert [ep.name for ep in index3["entries"]] == ["b"]
+
+        build_files(
+            {"three-1.0.dist-info": {"entry_points.txt": "[entries]\nc = m:c\n"}},
+            prefix=site_dir,
+        )
+        index4, _, changes = cache.scan_distributions(GROUPS, records, paths)
+        assert sorted(ep.name for ep in index4["entries"]) == ["a", "b", "c"]
+        assert changes["added"] == [str(site_dir / "three-1.0.dist-info")]
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_scan_unchanged_directory(site_dir, monkeypatch):
+    paths = [str(site_dir)]
+    build_files(
+        {
+            "one-1.0.dist-info": {"entry_points.txt": "[entries]\na = mod:a\n"},
+            "two-1.0.egg-info": {"entry_points.txt": "[entries]\nb = mod:b\n"},
+        },
+        prefix=site_dir,
+    )
+    os.utime(str(site_dir), (1000, 1000))
+    stats = []
+    metadata_mtime = cache.metadata_mtime
+    monkeypatch.setattr(
+        cache, "metadata_mtime", lambda path: stats.append(path) or metadata_mtime(path)
+    )
+    entrypoints.set_backend("native")
+    try:
+        directories = {}
+        _, records, _ = cache.scan_distributions(GROUPS, {}, paths, None, directories)
+        assert directories[str(site_dir)]["mtime"] == 1000
+        assert len(stats) == 2
+
+        # Only the egg-info directory, which is rewritten in place, is checked.
+        del stats[:]
+        egg_info = str(site_dir / "two-1.0.egg-info")
+        with open(os.path.join(egg_info, "entry_points.txt"), "w") as f:
+            f.write("[entries]\nc = mod:c\n")
+        os.utime(os.path.join(egg_info, "entry_points.txt"), (3000, 3000))
+        index, _, changes = cache.scan_distributions(
+            GROUPS, records, paths, None, directories
+        )
+        assert stats == [egg_info]
+        assert changes["modified"] == [egg_info]
+        assert sorted(ep.name for ep in index["entries"]) == ["a", "c"]
+
+        # A new distribution changes the directory's mtime.
+        build_files(
+            {"three-1.0.dist-info": {"entry_points.txt": "[entries]\nd = m:d\n"}},
+            prefix=site_dir,
+        )
+        index, _, changes = cache.scan_distributions(
+            GROUPS, records, paths, None, directories
+        )
+        assert changes["added"] == [str(site_dir / "three-1.0.dist-info")]
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_records_round_trip(site_dir):
+    path = str(site_dir / "entry_points.json")
+    ep = entrypoints.EntryPointInfo("pkg", "entries", "main", "mod", "main")
+    records = {
+        "/x/pkg-1.0.dist-info": {
+            "key": "pkg",
+            "mtime": 1.5,
+            "version": "1.0",
+            "entry_points": [ep],
+        }
+    }
+
+    assert cache.load_dist_records(path, "native", GROUPS) == {}
+
+    directories = {"/x": {"mtime": 2.5, "dists": [("pkg", "/x/pkg-1.0.dist-info")]}}
+    cache.save_dist_records(path, "native", GROUPS, records, directories)
+    loaded = {}
+    assert cache.load_dist_records(path, "native", GROUPS, loaded) == records
+    assert loaded == directories
+    assert cache.load_dist_records(path, "importlib", GROUPS) == {}
+    assert cache.load_dist_records(path, "native", ["other"]) == {}
@@ -1,4 +1,6 @@
-from idaenv import entrypoints
+from idaenv import cache, entrypoints
+
+from .conftest import add_sys_path, build_files, tempdir
 
 
 def test_imports():
@@ -21,6 +23,9 @@ def test_distinfo_pkg(distinfo_pkg):
         il_eps = list(entrypoints._importlib_iter_entry_point_info("entries"))
         assert sorted(il_eps) == sorted(pr_eps)
 
+    nt_eps = list(entrypoints._native_iter_entry_point_info("entries"))
+    assert sorted(nt_eps) == sorted(pr_eps)
+
 
 def test_distinfo_pkg_dot_legacy(distinfo_pkg_with_dot_legacy):
     entrypoints.refresh_entrypoint_caches()
@@ -31,6 +36,9 @@ def test_distinfo_pkg_dot_legacy(distinfo_pkg_with_dot_legacy):
         il_eps = list(entrypoints._importlib_iter_entry_point_info("entries"))
         assert sorted(il_eps) == sorted(pr_eps)
 
+    nt_eps = list(entrypoints._native_iter_entry_point_info("entries"))
+    assert sorted(nt_eps) == sorted(pr_eps)
+
 
 def test_egginfo_pkg(egginfo_pkg):
     entrypoints.refresh_entrypoint_caches()
@@ -40,3 +48,142 @@ def test_egginfo_pkg(egginfo_pkg):
     if entrypoints.importlib_metadata is not None:
         il_eps = list(entrypoints._importlib_iter_entry_point_info("entries"))
         assert sorted(il_eps) == sorted(pr_eps)
+
+    nt_eps = list(entrypoints._native_iter_entry_point_info("entries"))
+    assert sorted(nt_eps) == sorted(pr_eps)
+
+
+def test_scan_entry_point_info(distinfo_pkg, egginfo_pkg):
+    entrypoints.refresh_entrypoint_caches()
+    groups = ["entries", "missing"]
+
+    pr_index = dict(
+        (group, sorted(entrypoints._pkg_resources_scan_entry_point_info([group])))
+        for group in groups
+    )
+    assert len(pr_index["entries"]) == 3
+    assert pr_index["missing"] == []
+    assert pr_index["entries"] == sorted(
+        entrypoints._pkg_resources_iter_entry_point_info("entries")
+    )
+
+    if entrypoints.importlib_metadata is not None:
+        il_eps = entrypoints._importlib_scan_entry_point_info(set(groups))
+        assert sorted(il_eps) == pr_index["entries"]
+
+    nt_eps = entrypoints._native_scan_entry_point_info(set(groups))
+    assert sorted(nt_eps) == pr_index["entries"]
+
+    index = entrypoints.scan_entry_point_info(groups)
+    assert sorted(index["entries"]) == pr_index["entries"]
+    assert index["missing"] == []
+
+
+def test_native_entry_point_syntax(site_dir, on_sys_path):
+    build_files(
+        {
+            "syntax_pkg-2.0.dist-info": {
+                "METADATA": "Name: Syntax_Pkg\nVersion: 2.0\n",
+                "entry_points.txt": """
+                    # comment
+                    [entries]
+                    plain = mod
+                    spaced  =  mod.sub : main [extra]
+
+                    [other]
+                    skipped = mod:main
+                """,
+            },
+        },
+        prefix=site_dir,
+    )
+    entrypoints.refresh_entrypoint_caches()
+
+    nt_eps = sorted(entrypoints._native_iter_entry_point_info("entries"))
+    assert nt_eps == [
+        entrypoints.EntryPointInfo("syntax-pkg", "entries", "plain", "mod", ""),
+        entrypoints.EntryPointInfo(
+            "syntax-pkg", "entries", "spaced", "mod.sub", "main"
+        ),
+    ]
+
+    pr_eps = list(entrypoints._pkg_resources_iter_entry_point_info("entries"))
+    assert sorted(pr_eps) == nt_eps
+    if entrypoints.importlib_metadata is not None:
+        il_eps = list(entrypoints._importlib_iter_entry_point_info("entries"))
+        assert sorted(il_eps) == nt_eps
+
+
+def test_native_comments_and_encoding(site_dir):
+    # configparser comments, and a file that isn't UTF-8
+    dist = site_dir / "latin-1.0.dist-info"
+    dist.mkdir()
+    with open(str(dist / "entry_points.txt"), "wb") as f:
+        f.write(b"[entries]\n# caf\xe9\n; old = mod:old\nmain = mod:main\n")
+    eps = entrypoints._native_scan_entry_point_info(set(["entries"]), [str(site_dir)])
+    assert list(eps) == [
+        entrypoints.EntryPointInfo("latin", "entries", "main", "mod", "main")
+    ]
+
+
+def test_native_first_dist_wins(site_dir, on_sys_path, fixture_stack):
+    build_files(
+        {
+            "shadow-1.0.dist-info": {
+                "METADATA": "Name: shadow\nVersion: 1.0\n",
+                "entry_points.txt": "[entries]\nold = mod:main\n",
+            },
+        },
+        prefix=site_dir,
+    )
+    front = fixture_stack.enter_context(tempdir())
+    fixture_stack.enter_context(add_sys_path(front))
+    build_files(
+        {"shadow-2.0.dist-info": {"METADATA": "Name: shadow\nVersion: 2.0\n"}},
+        prefix=front,
+    )
+
+    assert list(entrypoints._native_iter_entry_point_info("entries")) == []
+    if entrypoints.importlib_metadata is not None:
+        il_eps = entrypoints._importlib_scan_entry_point_info(set(["entries"]))
+        assert list(il_eps) == []
+
+
+def test_egg_pkg(site_dir, fixture_stack):
+    egg = site_dir / "egg_pkg-1.0-py2.7.egg"
+    build_files(
+        {
+            egg.name: {
+                "EGG-INFO": {
+                    "PKG-INFO": "Name: egg-pkg\nVersion: 1.0\n",
+                    "entry_points.txt": "[entries]\nmain = mod:main\n",
+                },
+                "mod.py": "",
+            }
+        },
+        prefix=site_dir,
+    )
+    fixture_stack.enter_context(add_sys_path(egg))
+    entrypoints.refresh_entrypoint_caches()
+
+    expected = [entrypoints.EntryPointInfo("egg-pkg", "entries", "main", "mod", "main")]
+    pr_eps = list(entrypoints._pkg_resources_iter_entry_point_info("entries"))
+    assert pr_eps == expected
+    assert list(entrypoints._native_iter_entry_point_info("entries")) == expected
+
+    egg_info = str(egg / "EGG-INFO")
+    assert entrypoints.find_distributions(str(egg)) == [("egg-pkg", egg_info)]
+    assert entrypoints.dist_version(egg_info) == "1.0"
+    versions = {}
+    index, _, _ = cache.scan_distributions(["entries"], {}, [str(egg)], versions)
+    assert index["entries"] == expected and versions == {"egg-pkg": "1.0"}
+    backends = ["native", "pkg_resources"]
+    if entrypoints.importlib_metadata is not None:
+        backends.append("importlib")
+    for backend in backends:
+        entrypoints.set_backend(backend)
+        try:
+            eps = entrypoints.read_dist_entry_points("egg-pkg", egg_info, ["entries"])
+        finally:
+            entrypoints.set_backend(None)
+        assert eps == expected
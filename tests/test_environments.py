@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import stat
+
+import pytest
+
+from idaenv import environments
+
+
+def make_env(path, script):
+    bin_dir = path / "bin"
+    bin_dir.mkdir(parents=True)
+    (path / "pyvenv.cfg").write_text(u"home = /usr/bin\n")
+    python = bin_dir / "python"
+    python.write_text(u"#!/bin/sh\n" + script)
+    python.chmod(python.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="POSIX shell stubs")
+def test_update_environments(site_dir):
+    summary = {
+        "changes": {
+            "plugins": {"created": ["pkg.main"], "deleted": [], "rewritten": []}
+        },
+        "compile_errors": {},
+    }
+    updated = make_env(
+        site_dir / "envs" / "updated",
+        # Progress goes to stderr; the summary is the last line of stdout.
+        "echo \"$VIRTUAL_ENV $*\" >&2\necho '%s'\n" % json.dumps(summary),
+    )
+    unchanged = make_env(
+        site_dir / "envs" / "unchanged",
+        "echo '{\"changes\": {}, \"compile_errors\": {}}'\n",
+    )
+    broken = make_env(site_dir / "envs" / "broken", "echo oops >&2\nexit 3\n")
+    (site_dir / "envs" / "other").mkdir()
+
+    env_dirs = environments.find_environments([str(site_dir / "envs" / "*")])
+    assert env_dirs == sorted(
+        os.path.realpath(p) for p in [updated, unchanged, broken]
+    )
+    with pytest.raises(ValueError):
+        environments.find_environments([str(site_dir / "envs" / "other")])
+
+    results = environments.update_environments(
+        env_dirs, update_args=["--no-compile"], jobs=2
+    )
+    by_name = dict((os.path.basename(r["env"]), r) for r in results)
+    assert by_name["updated"]["status"] == "updated"
+    assert by_name["updated"]["changes"] == summary["changes"]
+    assert by_name["unchanged"]["status"] == "unchanged"
+    assert by_name["broken"]["status"] == "failed"
+    assert by_name["broken"]["returncode"] == 3
+    assert "oops" in by_name["broken"]["error"]
+    assert environments.failed(results) == [by_name["broken"]]
+    assert environments.format_summary(results)[-1] == (
+        "3 environments, 1 updated, 1 failed"
+    )
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="POSIX shell stubs")
+def test_update_environment_quarantine(site_dir):
+    # `update --verify` prints its summary, then fails for quarantined modules.
+    summary = {
+        "changes": {"plugins": {"created": ["pkg.good"], "quarantined": ["pkg.bad"]}},
+        "compile_errors": {},
+    }
+    env_dir = make_env(site_dir / "env", "echo '%s'\nexit 1\n" % json.dumps(summary))
+    result = environments.update_environment(env_dir, update_args=["--verify"])
+    assert result["status"] == "failed" and result["returncode"] == 1
+    assert result["changes"] == summary["changes"]
+    assert result["error"] == "Quarantined pkg.bad"
+
+
+@pytest.mark.skipif(sys.platform.startswith("win"), reason="POSIX shell stubs")
+def test_summary_failures_and_timeouts(site_dir):
+    env_dirs = [
+        make_env(site_dir / "broken", "echo Traceback >&2\necho bad >&2\nexit 3\n"),
+        make_env(site_dir / "garbled", "echo 'not json'\n"),
+        make_env(site_dir / "hung", "sleep 30\n"),
+        str(site_dir / "missing"),
+    ]
+    results = environments.update_environments(env_dirs, jobs=4, timeout=0.5)
+    assert [r["status"] for r in results] == ["failed", "failed", "timeout", "failed"]
+    assert all(r["seconds"] < 10 for r in results)
+
+    lines = environments.format_summary(results)
+    assert lines[0].startswith("failed ") and lines[0].endswith(env_dirs[0])
+    assert lines[1] == "           error: Exited with status 3: bad"
+    assert lines[3] == "           error: Exited with status 0: no output"
+    assert lines[4].startswith("timeout ") and lines[4].endswith(env_dirs[2])
+    assert lines[5] == "           error: Timed out after 0.5s"
+    assert lines[7].startswith("           error: ")
+    assert lines[-1] == "4 environments, 0 updated, 4 failed"
+
+    summary = json.loads(environments.dump_summary(results))
+    assert summary["failed"] == 4
+    environs = summary["environments"]
+    assert [(r["env"], r["status"], r["returncode"]) for r in environs] == [
+        (env_dirs[0], "failed", 3),
+        (env_dirs[1], "failed", 0),
+        (env_dirs[2], "timeout", None),
+        (env_dirs[3], "failed", None),
+    ]
+    assert all(r["error"] and r["changes"] == {} for r in environs)
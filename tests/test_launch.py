@@ -0,0 +1,130 @@
+import os
+import stat
+import subprocess
+
+import pytest
+
+from idaenv import launch
+from idaenv.manager import PluginManager
+
+from .conftest import build_files
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="needs bash")
+
+# Prints what IDA would see, one variable per line.
+FAKE_IDA = """#!/bin/bash
+echo "IDAUSR=$IDAUSR"
+echo "VIRTUAL_ENV=$VIRTUAL_ENV"
+echo "SOURCED=$SOURCED"
+"""
+
+
+def make_executable(path, contents):
+    with open(path, "w") as f:
+        f.write(contents)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def source_env(env_file, names):
+    "Source an environment file in bash and return the values of names."
+    script = 'source "$1"; for n in %s; do echo "${!n}"; done' % " ".join(names)
+    env = {"HOME": "/home/me", "PATH": "/usr/bin:/bin", "PYTHONHOME": "/x"}
+    output = subprocess.check_output(
+        ["bash", "-c", script, "bash", env_file], env=env, universal_newlines=True
+    )
+    return dict(zip(names, output.split("\n")))
+
+
+def test_env_file_quoting(site_dir):
+    user_dir = str(site_dir / "it's a prefix")
+    venv = str(site_dir / "my 'venv'")
+    os.mkdir(user_dir)
+    path = launch.write_env_file(user_dir, venv)
+    assert path == os.path.join(user_dir, launch.ENV_FILE_NAME)
+
+    values = source_env(path, ["IDAUSR", "VIRTUAL_ENV", "PATH", "PYTHONHOME"])
+    assert values["IDAUSR"] == "/home/me/.idapro:" + user_dir
+    assert values["VIRTUAL_ENV"] == venv
+    assert values["PATH"] == os.path.join(venv, "bin") + ":/usr/bin:/bin"
+    assert values["PYTHONHOME"] == ""
+
+    # Without a virtualenv only IDAUSR is set.
+    values = source_env(
+        launch.write_env_file(user_dir), ["IDAUSR", "VIRTUAL_ENV", "PATH"]
+    )
+    assert values == {
+        "IDAUSR": "/home/me/.idapro:" + user_dir,
+        "VIRTUAL_ENV": "",
+        "PATH": "/usr/bin:/bin",
+    }
+
+
+def test_launch_environ():
+    environ = launch.launch_environ(
+        "/prefix/ida",
+        "/venvs/a b",
+        {"HOME": "/home/me", "PATH": "/usr/bin", "PYTHONHOME": "/x"},
+    )
+    assert environ["IDAUSR"] == os.pathsep.join(
+        [os.path.join(os.path.expanduser("~"), ".idapro"), "/prefix/ida"]
+    )
+    assert environ["VIRTUAL_ENV"] == "/venvs/a b"
+    assert environ["PATH"] == os.pathsep.join(["/venvs/a b/bin", "/usr/bin"])
+    assert "PYTHONHOME" not in environ
+
+
+def test_update_writes_env_file(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"), compile=False)
+    mgr.find_installed_modules = lambda module_type: set()
+    mgr.update_plugins()
+    with open(os.path.join(mgr.user_dir, launch.ENV_FILE_NAME)) as f:
+        assert "export IDAUSR=" in f.read()
+
+
+def test_run_ida_env_file_freshness(site_dir):
+    venv = site_dir / "venv"
+    build_files(
+        {
+            "venv": {
+                "bin": {"activate": 'export VIRTUAL_ENV="%s"\n' % venv},
+                "ida": {"idaenv.env": "export IDAUSR=from-env-file SOURCED=1\n"},
+                "pyvenv.cfg": "",
+            },
+            "idahome": {},
+        },
+        prefix=site_dir,
+    )
+    make_executable(str(venv / "bin" / "idaenv"), "#!/bin/bash\necho /prefix\n")
+    make_executable(str(site_dir / "idahome" / "ida64"), FAKE_IDA)
+    script = str(site_dir / "ida64")
+    os.symlink(os.path.join(REPO_ROOT, "run-ida.sh"), script)
+
+    def run():
+        env = dict(
+            os.environ,
+            HOME="/home/me",
+            IDAENV=str(venv),
+            IDAHOME=str(site_dir / "idahome"),
+        )
+        output = subprocess.check_output([script], env=env, universal_newlines=True)
+        return dict(line.split("=", 1) for line in output.splitlines())
+
+    def touch(path, mtime):
+        os.utime(str(path), (mtime, mtime))
+
+    # The env file is used when it is newer than the virtualenv.
+    touch(venv / "bin" / "activate", 1000)
+    touch(venv / "pyvenv.cfg", 1000)
+    touch(venv / "ida" / "idaenv.env", 2000)
+    assert run()["IDAUSR"] == "from-env-file"
+
+    # Otherwise the environment is worked out again.
+    for path in [venv / "bin" / "activate", venv / "pyvenv.cfg"]:
+        touch(path, 3000)
+        result = run()
+        assert result["IDAUSR"] == "/home/me/.idapro:/prefix"
+        assert result["VIRTUAL_ENV"] == str(venv) and result["SOURCED"] == ""
+        touch(path, 1000)
@@ -0,0 +1,495 @@
+import os
+import sys
+import types
+import argparse
+import py_compile
+
+import pytest
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+from idaenv import command_line, compiling, entrypoints, introspect, sandbox
+from idaenv.manager import (
+    BOOTSTRAP_NAME,
+    LOADER_FILTER_GROUP,
+    PLUGIN_TEMPLATE,
+    PluginManager,
+)
+from idaenv.utils import site_paths
+
+from .conftest import build_files
+
+
+EP = entrypoints.EntryPointInfo(
+    "pkg", "idapython_plugins", "main", "mod", "Plugin"
+)
+
+
+def test_manifest_tracks_wrappers(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+
+    wrappers = mgr.load_wrappers("plugins")
+    assert [ep for ep, _ in wrappers] == [EP]
+
+    # A fresh manager answers from the manifest without reading wrappers.
+    mgr = PluginManager(mgr.user_dir)
+    mgr.find_wrappers = None
+    assert mgr.load_wrappers("plugins") == wrappers
+    assert mgr.find_module_wrapper("plugins", "pkg.main") == wrappers[0]
+
+
+def test_manifest_rescans_changed_dir(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+
+    # Wrappers removed behind idaenv's back are noticed.
+    for _, path in mgr.load_wrappers("plugins"):
+        os.remove(path)
+    assert PluginManager(mgr.user_dir).load_wrappers("plugins") == []
+
+
+def test_generations_and_rollback(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"))
+    if not os.path.islink(mgr.wrapper_dir("plugins")):
+        return
+
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+    first = os.path.realpath(mgr.wrapper_dir("plugins"))
+    wrapper_name = mgr.wrapper_name(EP)
+
+    mgr.execute_update("plugins", mgr.plan_delete(mgr.load_wrappers("plugins")))
+    assert os.path.realpath(mgr.wrapper_dir("plugins")) != first
+    assert mgr.load_wrappers("plugins") == []
+
+    # The previous generation is left intact.
+    assert os.path.isfile(os.path.join(first, wrapper_name))
+
+    assert mgr.rollback("plugins")
+    assert os.path.realpath(mgr.wrapper_dir("plugins")) == first
+    assert [ep for ep, _ in mgr.load_wrappers("plugins")] == [EP]
+    assert len(mgr.list_generations("plugins")) == 2
+
+
+def test_noop_update_keeps_rollback(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"))
+    if not os.path.islink(mgr.wrapper_dir("plugins")):
+        return
+    loader = EP._replace(group="idapython_loaders", name="loader")
+    mgr.find_installed_modules = lambda module_type: set()
+    mgr.execute_update("loaders", {"create": [loader], "delete": []})
+
+    # An operation changing only the plugins
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.operation = repr(float(mgr.operation) + 1)
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+    generations = dict((t, mgr.list_generations(t)) for t in ["plugins", "loaders"])
+
+    # A no-op update doesn't add generations.
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.find_installed_modules = lambda module_type: set(
+        {"plugins": [EP], "loaders": [loader]}.get(module_type, [])
+    )
+    mgr.update_plugins()
+    assert generations == dict(
+        (t, mgr.list_generations(t)) for t in ["plugins", "loaders"]
+    )
+
+    # Rollback undoes the plugins change, leaving the loaders alone.
+    assert mgr.rollback_last() == ["plugins"]
+    assert mgr.load_wrappers("plugins") == []
+    assert [ep for ep, _ in mgr.load_wrappers("loaders")] == [loader]
+    assert PluginManager(str(site_dir / "ida")).load_wrappers("plugins") == []
+
+
+def test_template_drift_rewrites(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+    mgr.find_installed_modules = lambda module_type: set([EP])
+
+    plan = mgr.plan_update("plugins")
+    assert plan["active"] == [EP]
+    assert plan["rewrite"] == []
+
+    # Unchanged wrappers are never rewritten.
+    (_, path), = mgr.load_wrappers("plugins")
+    mtime = os.stat(path).st_mtime
+    mgr.execute_update("plugins", {"create": [EP], "delete": []})
+    (_, path), = mgr.load_wrappers("plugins")
+    assert os.stat(path).st_mtime == mtime
+
+    mgr.template_map = dict(mgr.template_map, plugins="# new\n" + PLUGIN_TEMPLATE)
+    plan = mgr.plan_update("plugins")
+    assert plan["active"] == []
+    assert plan["rewrite"] == [(EP, path)]
+
+    mgr.execute_update("plugins", plan)
+    with open(path) as f:
+        assert f.read().startswith("# new\n")
+    assert mgr.plan_update("plugins")["active"] == [EP]
+
+
+def test_upgrade_and_fingerprint(site_dir, on_sys_path):
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": "[idapython_plugins]\nmain = mod:Plugin\n"
+            },
+            "old.egg-info": {
+                "PKG-INFO": "Name: old\nVersion: 0.3\n\nVersion: 9\n",
+                "entry_points.txt": "[idapython_procs]\nproc = oldmod\n",
+            },
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        for mtype in ["plugins", "procs"]:
+            mgr.execute_update(mtype, mgr.plan_update(mtype))
+        digest, wrappers = mgr.fingerprint()
+        assert [(w["dist"], w["version"]) for w in wrappers] == [
+            ("pkg", "1.0"),
+            ("old", "0.3"),
+        ]
+
+        # Computed from the manifest alone, without rescanning.
+        mgr = PluginManager(mgr.user_dir)
+        mgr.entry_point_index = None
+        assert mgr.fingerprint() == (digest, wrappers)
+
+        os.rename(
+            str(site_dir / "pkg-1.0.dist-info"), str(site_dir / "pkg-2.0.dist-info")
+        )
+        mgr = PluginManager(mgr.user_dir, compile=False)
+        plan = mgr.plan_update("plugins")
+        assert plan["active"] == [] and plan["create"] == []
+        assert [ep for ep, _ in plan["upgrade"]] == [
+            entrypoints.EntryPointInfo(
+                "pkg", "idapython_plugins", "main", "mod", "Plugin"
+            )
+        ]
+        mgr.execute_update("plugins", plan)
+        assert mgr.plan_update("plugins")["upgrade"] == []
+        assert mgr.fingerprint()[0] != digest
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_profiles(site_dir, on_sys_path):
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": (
+                    "[idapython_plugins]\nmain = mod:Plugin\nextra = mod:Extra\n"
+                )
+            }
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        mgr.execute_update("plugins", mgr.plan_update("plugins"))
+        assert len(mgr.find_wrappers(os.path.join(mgr.user_dir, "plugins"))) == 2
+
+        mgr.add_profile_rules("disable", ["pkg.*"])
+        mgr.add_profile_rules("enable", ["pkg.main"])
+        plan = mgr.plan_update("plugins")
+        assert [ep.name for ep, _ in plan["delete"]] == ["extra"]
+        assert [ep.name for ep in plan["disabled"]] == ["extra"]
+        mgr.execute_update("plugins", plan)
+
+        # The disabled state survives later updates.
+        mgr = PluginManager(mgr.user_dir, compile=False)
+        plan = mgr.plan_update("plugins")
+        assert plan["create"] == [] and plan["delete"] == []
+
+        mgr.use_profile("all", create=True)
+        assert mgr.list_profiles() == ["all", "default"]
+        plan = mgr.plan_update("plugins")
+        assert [ep.name for ep in plan["create"]] == ["extra"]
+        with pytest.raises(ValueError):
+            mgr.use_profile("missing")
+        with pytest.raises(ValueError):
+            mgr.delete_profile("all")
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_set_enabled_applies_delta(site_dir, on_sys_path, capsys):
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": (
+                    "[idapython_plugins]\nmain = mod:Plugin\nextra = mod:Extra\n"
+                )
+            },
+            "two-1.0.dist-info": {"entry_points.txt": "[idapython_plugins]\nt = m:T\n"},
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        mgr.update_plugins()
+
+        def wrapped():
+            wrappers = mgr.load_wrappers("plugins")
+            return sorted("%s.%s" % (ep.dist, ep.name) for ep, _ in wrappers)
+
+        def set_enabled(action, patterns, profile=None):
+            opts = argparse.Namespace(patterns=patterns, profile=profile)
+            command_line.set_enabled(mgr, opts, action)
+            return capsys.readouterr().out
+
+        # Only the toggled modules are planned, not a full update.
+        mgr.plan_update = None
+        # Changes made by another process are kept.
+        PluginManager(mgr.user_dir).add_profile_rules("disable", ["x"], "other")
+
+        set_enabled("disable", ["pkg.*"])
+        assert wrapped() == ["two.t"]
+        assert set_enabled("enable", ["pkg.main"]).endswith("- pkg.main\n")
+        assert wrapped() == ["pkg.main", "two.t"]
+        assert mgr.profile_rules() == [("disable", "pkg.*"), ("enable", "pkg.main")]
+
+        output = set_enabled("disable", ["unknown.*"])
+        assert "no installed module matches 'unknown.*'" in output
+        assert output.endswith("No changes.\n")
+        assert wrapped() == ["pkg.main", "two.t"]
+
+        # Rules for another profile are only applied when switching to it.
+        assert "Saved to profile 'other'" in set_enabled("disable", ["two.*"], "other")
+        assert wrapped() == ["pkg.main", "two.t"]
+        assert mgr.profile_rules("other") == [("disable", "x"), ("disable", "two.*")]
+        mgr.use_profile("other")
+        del mgr.plan_update
+        mgr.update_plugins()
+        assert wrapped() == ["pkg.extra", "pkg.main"]
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_lazy_plugin_wrapper(site_dir, on_sys_path, monkeypatch):
+    build_files(
+        {
+            "lazy_mod.py": """
+                import idaapi
+
+                LOADED.append(True)
+
+                class Plugin(idaapi.plugin_t):
+                    flags = idaapi.PLUGIN_UNL | 0x10
+                    wanted_name = "Lazy"
+                    wanted_hotkey = "Alt-L"
+
+                    def init(self):
+                        return idaapi.PLUGIN_OK
+
+                    def run(self, arg):
+                        return arg + 1
+            """,
+        },
+        prefix=site_dir,
+    )
+    ep = EP._replace(module="lazy_mod")
+    assert introspect.plugin_info("lazy_mod", "Plugin") == {
+        "flags": 0x18,
+        "wanted_name": "Lazy",
+        "wanted_hotkey": "Alt-L",
+    }
+
+    idaapi = types.ModuleType("idaapi")
+    idaapi.plugin_t = type("plugin_t", (object,), {})
+    idaapi.PLUGIN_SKIP, idaapi.PLUGIN_OK, idaapi.PLUGIN_KEEP = 0, 1, 2
+    idaapi.PLUGIN_UNL = 0x8
+    monkeypatch.setitem(sys.modules, "idaapi", idaapi)
+    monkeypatch.setattr(builtins, "LOADED", [], raising=False)
+
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr.set_lazy(ep, wanted_hotkey="Alt-X")
+    namespace = {}
+    exec(mgr.render_wrapper("plugins", ep), namespace)
+
+    plugin = namespace["PLUGIN_ENTRY"]()
+    assert plugin.wanted_name == "Lazy"
+    assert plugin.wanted_hotkey == "Alt-X"
+    assert plugin.flags == 0x18
+    assert plugin.init() == idaapi.PLUGIN_KEEP
+    assert builtins.LOADED == []
+
+    assert plugin.run(1) == 2
+    assert builtins.LOADED == [True]
+
+    mgr.set_lazy(ep, enable=False)
+    assert "LazyPlugin" not in mgr.render_wrapper("plugins", ep)
+
+
+class FakeInput(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def read(self, size):
+        return self.data[self.pos : self.pos + size]
+
+
+def test_lazy_loader_wrapper(site_dir, on_sys_path, monkeypatch):
+    build_files(
+        {
+            "lazy_loader.py": """
+                LOADED.append(True)
+
+                def accept_file(li, filename):
+                    return {"format": "Fake", "processor": "metapc"}
+
+                def load_file(li, neflags, format):
+                    return 1
+
+                def save_file(fp, name):
+                    return 2
+            """,
+            "lazy_loader_filters.py": """
+                FILTERS = [{"magic": b"FAKE", "offset": 2}, {"extensions": "fk"}]
+            """,
+        },
+        prefix=site_dir,
+    )
+    monkeypatch.setattr(builtins, "LOADED", [], raising=False)
+
+    ep = entrypoints.EntryPointInfo(
+        "pkg", "idapython_loaders", "fake", "lazy_loader", ""
+    )
+    filter_ep = entrypoints.EntryPointInfo(
+        "pkg", LOADER_FILTER_GROUP, "fake", "lazy_loader_filters", "FILTERS"
+    )
+    mgr = PluginManager(str(site_dir / "ida"))
+    mgr._entry_point_index = {LOADER_FILTER_GROUP: [filter_ep]}
+
+    namespace = {}
+    exec(mgr.render_wrapper("loaders", ep), namespace)
+    assert "move_segm" not in namespace
+
+    assert namespace["accept_file"](FakeInput(b"xxNOPE"), "a.bin") == 0
+    assert builtins.LOADED == []
+
+    assert namespace["accept_file"](FakeInput(b"xxFAKE"), "a.bin")["format"] == "Fake"
+    assert namespace["accept_file"](FakeInput(b""), "a.FK")["format"] == "Fake"
+    assert namespace["save_file"](None, "x") == 2
+    assert builtins.LOADED == [True]
+
+    # Loaders without filters keep the eager wrapper.  Their source isn't
+    # read, and rendering doesn't scan entry points.
+    monkeypatch.setattr(introspect, "module_functions", None)
+    mgr = PluginManager(str(site_dir / "ida"))
+    assert "import *" in mgr.render_wrapper("loaders", ep)
+    assert mgr._entry_point_index is None
+    mgr._entry_point_index = {LOADER_FILTER_GROUP: []}
+    assert "import *" in mgr.render_wrapper("loaders", ep)
+
+
+def test_normalize_loader_filters():
+    normalize = introspect.normalize_loader_filters
+    assert normalize({"magic": u"4D5A"}) == [(0, "4d5a", ())]
+    assert normalize({"magic": b"MZ", "offset": 2}) == [(2, "4d5a", ())]
+    assert normalize([{"extensions": u"exe"}]) == [(0, "", (".exe",))]
+    for magic in [u"4d5", u"zz", u"\xe9", 1]:
+        with pytest.raises(ValueError):
+            normalize({"magic": magic})
+
+
+def test_compile_sources(site_dir):
+    build_files(
+        {
+            "good_pkg": {"__init__.py": "x = 1\n", "sub.py": "y = 2\n"},
+            "bad.py": "def broken(:\n",
+        },
+        prefix=site_dir,
+    )
+    errors = compiling.compile_sources(
+        [str(site_dir / "good_pkg"), str(site_dir / "bad.py")]
+    )
+    assert [os.path.basename(path) for path, _ in errors] == ["bad.py"]
+
+    sub = str(site_dir / "good_pkg" / "sub.py")
+    if hasattr(py_compile, "PycInvalidationMode"):
+        assert compiling.bytecode_is_current(sub)
+
+        # Bytecode stays valid when only the mtime changes.
+        os.utime(sub, (0, 0))
+        assert compiling.bytecode_is_current(sub)
+
+        with open(sub, "w") as f:
+            f.write("y = 3\n")
+        assert not compiling.bytecode_is_current(sub)
+
+
+def test_bootstrap_plugin(site_dir):
+    mgr = PluginManager(str(site_dir / "ida"), compile=False)
+    path = os.path.join(mgr.wrapper_dir("plugins"), BOOTSTRAP_NAME)
+    assert not mgr.compute_plan("plugins")["bootstrap"]
+
+    assert mgr.set_prewarm_modules(["idaapi", "capstone", "ida_bytes"]) == ["capstone"]
+    plan = mgr.compute_plan("plugins")
+    assert plan["bootstrap"]
+    mgr.execute_update("plugins", plan)
+    with open(path) as f:
+        assert "MODULES = ['capstone']" in f.read()
+    assert mgr.find_wrappers(mgr.wrapper_dir("plugins")) == []
+    assert not mgr.compute_plan("plugins")["bootstrap"]
+
+    mgr.set_prewarm_modules([])
+    mgr.execute_update("plugins", mgr.compute_plan("plugins"))
+    assert not os.path.exists(path)
+
+
+def test_site_paths(site_dir, monkeypatch):
+    project = site_dir / "project"
+    project.mkdir()
+    monkeypatch.chdir(str(project))
+    monkeypatch.setattr(sys, "argv", [str(site_dir / "bin" / "idaenv")])
+
+    # The current directory is kept unless Python added it for the script.
+    monkeypatch.setattr(sys, "path", ["", str(project), str(site_dir / "missing")])
+    assert site_paths() == [str(project)]
+    monkeypatch.setattr(sys, "path", [str(project), str(site_dir)])
+    assert site_paths() == [str(site_dir)]
+
+
+def test_bootstrap_path_snapshot(site_dir, on_sys_path, monkeypatch):
+    build_files(
+        {
+            "snap-1.0.dist-info": {
+                "entry_points.txt": "[idapython_procs]\nproc = snap_pkg.proc\n"
+            },
+            "snap_pkg": {"__init__.py": "", "proc.py": ""},
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        mgr.set_path_snapshot(index=True)
+        bootstrap = mgr.render_bootstrap()
+    finally:
+        entrypoints.set_backend(None)
+
+    monkeypatch.setattr(sys, "path", [])
+    monkeypatch.setattr(sys, "meta_path", [sandbox.StubFinder()] + sys.meta_path)
+    namespace = {}
+    exec(compile(bootstrap, BOOTSTRAP_NAME, "exec"), namespace)
+    assert str(site_dir) in sys.path
+    location = str(site_dir / "snap_pkg" / "__init__.py")
+    assert namespace["INDEX"] == {"snap_pkg": location}
+
+    spec = namespace["IndexFinder"].find_spec("snap_pkg")
+    assert spec.origin == location
+    assert spec.submodule_search_locations == [str(site_dir / "snap_pkg")]
+    assert namespace["IndexFinder"].find_spec("other") is None
@@ -0,0 +1,87 @@
+import os
+import sys
+import runpy
+import shutil
+
+from idaenv import entrypoints, runtime
+from idaenv.manager import PluginManager
+
+from .conftest import build_files
+
+
+def test_instrumented_wrappers(site_dir, on_sys_path):
+    build_files(
+        {
+            "timed-1.0.dist-info": {
+                "entry_points.txt": (
+                    "[idapython_plugins]\nmain = timed_mod:Plugin\n"
+                    "[idapython_procs]\nproc = timed_mod\n"
+                )
+            },
+            "timed_mod.py": """
+                class Plugin(object):
+                    def init(self):
+                        return 2
+            """,
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        mgr.set_instrumented()
+        for mtype in ["plugins", "procs"]:
+            mgr.execute_update(mtype, mgr.plan_update(mtype))
+
+        # Load the wrappers the way IDA does.
+        namespaces = {}
+        for mtype in ["plugins", "procs"]:
+            ((_, path),) = mgr.find_wrappers(mgr.wrapper_dir(mtype))
+            namespaces[mtype] = runpy.run_path(path)
+        assert namespaces["plugins"]["PLUGIN_ENTRY"]().init() == 2
+
+        records = runtime.read_log(mgr.user_dir)
+        events = sorted((r["module"], r["event"]) for r in records)
+        assert events == [
+            ("timed.main", "entry"),
+            ("timed.main", "import"),
+            ("timed.main", "init"),
+            ("timed.proc", "import"),
+        ]
+        assert set(r["session"] for r in records) == set([runtime.SESSION])
+
+        # The log is found from the wrapper's location, so copied wrappers,
+        # e.g. in a bundle, don't write to the prefix they were built in.
+        ((_, path),) = mgr.find_wrappers(mgr.wrapper_dir("plugins"))
+        assert runtime.wrapper_user_dir(path) == mgr.user_dir
+        assert runtime.wrapper_user_dir(os.path.realpath(path)) == mgr.user_dir
+        copy_dir = site_dir / "copy" / "plugins"
+        copy_dir.mkdir(parents=True)
+        copy = str(copy_dir / os.path.basename(path))
+        shutil.copy(path, copy)
+        runpy.run_path(copy)
+        assert len(runtime.read_log(str(site_dir / "copy"))) == 1
+        assert len(runtime.read_log(mgr.user_dir)) == 4
+
+        # Switching instrumentation off rewrites the wrappers.
+        mgr.set_instrumented(False)
+        assert len(mgr.plan_update("plugins")["rewrite"]) == 1
+    finally:
+        entrypoints.set_backend(None)
+        sys.modules.pop("timed_mod", None)
+
+
+def test_summarize():
+    records = [
+        {"module": "a.b", "event": "import", "session": str(i % 3), "seconds": i}
+        for i in range(1, 101)
+    ]
+    records.append({"module": "c.d", "event": "init", "session": "0", "seconds": 0.5})
+    rows = runtime.summarize(records)
+    assert [(r["module"], r["samples"], r["sessions"]) for r in rows] == [
+        ("a.b", 100, 3),
+        ("c.d", 1, 1),
+    ]
+    assert (rows[0]["p50"], rows[0]["p90"], rows[0]["p99"]) == (50, 90, 99)
+    assert rows[1]["p50"] == rows[1]["max"] == 0.5
+    assert len(runtime.format_summary(rows)) == 3
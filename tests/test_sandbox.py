@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from idaenv import command_line, entrypoints, profiling, sandbox
+from idaenv.manager import PluginManager
+from idaenv.utils import communicate
+
+from .conftest import build_files
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sandbox_path(monkeypatch, site_dir):
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(site_dir), REPO_ROOT]))
+
+
+def test_sandbox_stubs_ida(site_dir, monkeypatch):
+    sandbox_path(monkeypatch, site_dir)
+    build_files(
+        {
+            "stubbed_plugin.py": """
+                import json
+                import idaapi
+                import ida_kernwin
+                from idc import BADADDR
+
+                print("noise on stdout")
+
+                class Plugin(idaapi.plugin_t):
+                    flags = idaapi.PLUGIN_UNL | idaapi.PLUGIN_HIDE
+                    hotkey = ida_kernwin.get_kernel_version()
+            """,
+        },
+        prefix=site_dir,
+    )
+    result = sandbox.run_sandbox("stubbed_plugin", "Plugin", importtime=True)
+    assert result["ok"], result["error"]
+    assert result["attr_found"] and result["callable"]
+    assert result["wall_time"] > 0
+
+    imported = [name for name, _, _ in result["imports"]]
+    assert "stubbed_plugin" in imported
+    assert "idaenv.sandbox" not in imported
+
+
+def test_profile_without_importtime(site_dir, monkeypatch):
+    sandbox_path(monkeypatch, site_dir)
+    build_files({"plain_plugin.py": "import json\n"}, prefix=site_dir)
+    ep = entrypoints.EntryPointInfo(
+        "pkg", "idapython_plugins", "main", "plain_plugin", None
+    )
+    for available in [True, False]:
+        monkeypatch.setattr(sandbox, "HAS_IMPORTTIME", available)
+        result = profiling.profile_entry_point(ep)
+        assert result["ok"], result["error"]
+        assert result["imports_available"] == available
+        note = "Nested import times are only available on Python 3.7+."
+        assert (note in profiling.format_report([result])) != available
+        if not available:
+            assert result["import_count"] is None and result["top_imports"] == []
+
+
+def test_sandbox_reports_errors(site_dir, monkeypatch):
+    sandbox_path(monkeypatch, site_dir)
+    build_files({"broken_plugin.py": "import does_not_exist\n"}, prefix=site_dir)
+
+    result = sandbox.run_sandbox("broken_plugin", "Plugin")
+    assert not result["ok"]
+    assert "does_not_exist" in result["error"]
+
+    result = sandbox.run_sandbox("json", "missing_attr")
+    assert result["ok"] and not result["attr_found"]
+
+
+def test_communicate_timeout(monkeypatch):
+    # Python 2 has no subprocess timeouts.
+    for timeouts in [True, False]:
+        if not timeouts:
+            monkeypatch.delattr(subprocess, "TimeoutExpired")
+        proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+        start = time.time()
+        assert communicate(proc, timeout=0.5) is None
+        assert time.time() - start < 10 and proc.returncode is not None
+
+        proc = subprocess.Popen(
+            [sys.executable, "-c", "print(1)"], stdout=subprocess.PIPE
+        )
+        assert communicate(proc, timeout=30)[0].strip() == b"1"
+
+
+def test_verify_quarantines(site_dir, on_sys_path, monkeypatch):
+    sandbox_path(monkeypatch, site_dir)
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": """
+                    [idapython_plugins]
+                    good = goodmod:Plugin
+                    missing = goodmod:Missing
+                    constant = goodmod:VALUE
+                    [idapython_procs]
+                    broken = brokenmod
+                """
+            },
+            "goodmod.py": """
+                VALUE = 1
+
+                class Plugin(object):
+                    pass
+            """,
+            "brokenmod.py": "raise ImportError('no backend')\n",
+        },
+        prefix=site_dir,
+    )
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        plans = dict((t, mgr.plan_update(t)) for t in ["plugins", "procs"])
+        errors = mgr.verify_plans(plans, jobs=4)
+        for module_type, plan in plans.items():
+            mgr.execute_update(module_type, plan)
+    finally:
+        entrypoints.set_backend(None)
+
+    failed = sorted((t, ep.name) for t, ep in errors)
+    assert failed == [
+        ("plugins", "constant"),
+        ("plugins", "missing"),
+        ("procs", "broken"),
+    ]
+    assert [ep.name for ep, _ in mgr.load_wrappers("plugins")] == ["good"]
+    assert mgr.load_wrappers("procs") == []
+    (broken, error), = plans["procs"]["quarantine"]
+    assert "no backend" in error
+    assert mgr.quarantined("procs") == {broken: {"error": error, "version": "1.0"}}
+
+    entrypoints.set_backend("native")
+    try:
+        # A plain update leaves quarantined entry points alone.
+        plan = PluginManager(str(site_dir / "ida")).plan_update("procs")
+        assert plan["create"] == [] and plan["quarantine"] == [(broken, error)]
+
+        # A verified update releases them once they pass.
+        (site_dir / "brokenmod.py").write_text(u"")
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        plans = {"procs": mgr.plan_update("procs")}
+        mgr.verify_plans(plans)
+        assert plans["procs"]["create"] == [broken]
+        assert plans["procs"]["quarantine"] == []
+        assert mgr.quarantined("procs") == {}
+
+        # So does a new version of the distribution.
+        mgr.save_quarantine({("procs", broken): {"error": error, "version": "1.0"}})
+        os.rename(
+            str(site_dir / "pkg-1.0.dist-info"), str(site_dir / "pkg-1.1.dist-info")
+        )
+        mgr = PluginManager(str(site_dir / "ida"), compile=False)
+        plan = mgr.plan_update("procs")
+        assert plan["create"] == [broken] and plan["quarantine"] == []
+        mgr.execute_update("procs", plan)
+        assert ("procs", broken) not in mgr.load_quarantine()
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_verify_exit_status(site_dir, on_sys_path, monkeypatch, capsys):
+    sandbox_path(monkeypatch, site_dir)
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": """
+                    [idapython_plugins]
+                    good = goodmod:Plugin
+                    broken = brokenmod:Plugin
+                """
+            },
+            "goodmod.py": "class Plugin(object):\n    pass\n",
+            "brokenmod.py": "raise ImportError('no backend')\n",
+        },
+        prefix=site_dir,
+    )
+    opts = argparse.Namespace(
+        json=False, verify=True, full_rescan=False, jobs=2, timeout=None
+    )
+    user_dir = str(site_dir / "ida")
+    entrypoints.set_backend("native")
+    try:
+        mgr = PluginManager(user_dir, compile=False)
+        assert command_line.cmd_update(mgr, opts) == 1
+        assert "- pkg.broken: " in capsys.readouterr().out
+
+        # Disabled modules keep their quarantine records through verified
+        # updates, so enabling them doesn't skip verification.
+        mgr = PluginManager(user_dir, compile=False)
+        mgr.add_profile_rules("disable", ["pkg.broken"])
+        assert command_line.cmd_update(mgr, opts) is None
+        assert [ep.name for _, ep in mgr.load_quarantine()] == ["broken"]
+        mgr.add_profile_rules("enable", ["pkg.broken"])
+        plan = mgr.plan_update("plugins")
+        assert plan["create"] == [] and len(plan["quarantine"]) == 1
+
+        # Without --verify, known quarantines don't fail the update.
+        opts.verify = False
+        assert command_line.cmd_update(mgr, opts) is None
+    finally:
+        entrypoints.set_backend(None)
+
+
+def test_shared_imports():
+    def result(module, imports):
+        return {
+            "module": module,
+            "top_imports": [
+                {"module": name, "self_us": 0, "cumulative_us": us}
+                for name, us in imports
+            ],
+        }
+
+    results = [
+        result("a", [("capstone", 40000), ("json", 200), ("ida_bytes", 90000)]),
+        result("b.plugin", [("capstone", 30000), ("networkx", 80000), ("b", 9000)]),
+        result("c", [("networkx", 70000), ("json", 300), ("networkx.algorithms", 1)]),
+        result("d", [("a", 50000), ("b", 50000)]),
+    ]
+    assert profiling.shared_imports(results) == ["networkx", "capstone"]
+    assert profiling.shared_imports(results, min_ms=0.1) == [
+        "networkx",
+        "capstone",
+        "json",
+    ]
@@ -0,0 +1,44 @@
+"""
+`idaenv prefix` and `idaenv env` run on every IDA launch and must stay cheap,
+so they must not import the entry point machinery.
+"""
+import os
+import sys
+import json
+import subprocess
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["multiprocessing", "idaenv.manager"]
+
+# Only deferred where modules support __getattr__ (Python 3.7+); see
+# entrypoints._import_backends().
+if sys.version_info >= (3, 7):
+    HEAVY_MODULES += ["importlib_metadata", "importlib.metadata", "pkg_resources"]
+
+# The command's output goes to os.devnull, which takes str on Python 2 and 3.
+SCRIPT = """
+import os, sys, json
+from idaenv.command_line import main
+sys.argv = ["idaenv"] + sys.argv[1:]
+out, sys.stdout = sys.stdout, open(os.devnull, "w")
+main()
+sys.stdout = out
+print(json.dumps({"modules": sorted(sys.modules)}))
+"""
+
+
+def run_command(args):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    output = subprocess.check_output(
+        [sys.executable, "-c", SCRIPT] + args, env=env, universal_newlines=True
+    )
+    return json.loads(output.splitlines()[-1])
+
+
+def test_prefix_startup():
+    for args in (["prefix"], ["env"]):
+        result = run_command(args)
+        for name in HEAVY_MODULES:
+            assert name not in result["modules"], (args, name)
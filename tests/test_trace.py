@@ -0,0 +1,39 @@
+from idaenv import entrypoints, trace
+from idaenv.manager import PluginManager
+
+from .conftest import build_files
+
+
+def test_trace_update(site_dir, on_sys_path):
+    build_files(
+        {
+            "pkg-1.0.dist-info": {
+                "entry_points.txt": "[idapython_plugins]\nmain = mod:Plugin\n"
+            },
+        },
+        prefix=site_dir,
+    )
+    mgr = PluginManager(str(site_dir / "ida"), use_cache=False, compile=False)
+    entrypoints.set_backend("native")
+    trace.enable()
+    try:
+        mgr.execute_update("plugins", mgr.plan_update("plugins"))
+    finally:
+        trace.disable()
+        entrypoints.set_backend(None)
+
+    data = trace.report()
+    phases = dict((p["phase"], p) for p in data["phases"])
+    assert phases["plan update"]["calls"] == 1
+    scan = phases["plan update/scan entry points"]
+    assert scan["dists"] >= 1
+    read = phases["plan update/scan entry points/read metadata"]
+    assert read["files"] >= 1 and read["read"] > 0
+    written = phases["execute update/write wrappers"]
+    assert written["files"] == 1 and written["written"] > 0
+    assert trace.format_report(data)[-1].startswith("total")
+
+
+def test_trace_disabled():
+    trace.disable()
+    assert trace.phase("anything") is trace.phase("other")
@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from idaenv import watch
+
+
+def make_watcher(kind, paths):
+    if kind == "inotify":
+        if not sys.platform.startswith("linux"):
+            pytest.skip("inotify is Linux only")
+        return watch.InotifyWatcher(paths)
+    return watch.PollingWatcher(paths, interval=0.05)
+
+
+@pytest.mark.parametrize("kind", ["inotify", "polling"])
+def test_watcher_reports_metadata(site_dir, kind):
+    path = os.path.realpath(str(site_dir))
+    egg_info = os.path.join(path, "old.egg-info")
+    os.mkdir(egg_info)
+    watcher = make_watcher(kind, watch.watched_paths([path]))
+    try:
+        # Unrelated files are ignored.
+        with open(os.path.join(path, "module.py"), "w") as f:
+            f.write("")
+        assert watcher.wait(timeout=0.3) == set()
+
+        dist_info = os.path.join(path, "new-1.0.dist-info")
+        os.mkdir(dist_info)
+        assert watcher.wait(timeout=5) == {dist_info}
+
+        with open(os.path.join(egg_info, "entry_points.txt"), "w") as f:
+            f.write("[idapython_plugins]\n")
+        assert egg_info in watcher.wait(timeout=5)
+    finally:
+        watcher.close()
+
+
+def test_debounce_collects_burst(site_dir):
+    path = os.path.realpath(str(site_dir))
+    watcher = watch.PollingWatcher([path], interval=0.05)
+    names = ["a-1.0.dist-info", "b-1.0.dist-info", "c.pth"]
+
+    def install():
+        for name in names:
+            target = os.path.join(path, name)
+            if name.endswith(".pth"):
+                open(target, "w").close()
+            else:
+                os.mkdir(target)
+
+    timer = threading.Timer(0.1, install)
+    timer.start()
+    try:
+        changed = watch.wait_for_changes(watcher, debounce=0.5)
+    finally:
+        timer.join()
+    assert changed == set(os.path.join(path, name) for name in names)